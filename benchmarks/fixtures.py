@@ -0,0 +1,175 @@
+'''
+Synthetic, deterministic fixtures for the SatCheck benchmarks.
+
+Nothing here touches the network: observation files, TLE catalogs and the UCS
+database are generated from a seed, and Space-Track responses are recorded to
+disk once and replayed by the local stand-in in spacetrack_standin.py.
+'''
+
+import os
+import numpy as np
+import h5py
+
+from astropy.time import Time
+
+# a night that the generated TLE epochs and observations all agree on
+DEFAULT_MJD = 59000.2
+
+def makeH5(path, ntime=16, nchans=2**16, tstart=DEFAULT_MJD, ra=4.2, dec=12.5, seed=0):
+    """
+    Write a synthetic Breakthrough Listen style h5 file covering GBT L band.
+
+    Parameters
+    ----------
+    path : str
+        Output path.
+    ntime, nchans : int
+        Shape of the (time, pol, freq) data array.
+    tstart : float
+        Start time (MJD).
+    ra, dec : float
+        Target coordinates in hours and degrees.
+    seed : int
+        Seed for the random data.
+
+    Returns
+    -------
+    str
+        The path written.
+    """
+    rng = np.random.default_rng(seed)
+    fch1 = 1926.0
+    foff = -800.0 / nchans
+
+    with h5py.File(path, 'w') as f:
+        f.attrs['CLASS'] = 'FILTERBANK'
+        f.attrs['VERSION'] = '1.0'
+        dset = f.create_dataset('data', shape=(ntime, 1, nchans), dtype='float32',
+                                chunks=(min(ntime, 16), 1, min(nchans, 2**16)))
+        for t0 in range(0, ntime, 16):
+            rows = min(16, ntime - t0)
+            dset[t0:t0+rows] = rng.random((rows, 1, nchans), dtype=np.float32)
+
+        header = {'fch1' : fch1, 'foff' : foff, 'nchans' : nchans, 'nifs' : 1, 'nbits' : 32,
+                  'tsamp' : 18.253611008, 'tstart' : tstart, 'src_raj' : ra, 'src_dej' : dec,
+                  'telescope_id' : 6, 'machine_id' : 10, 'data_type' : 1, 'source_name' : 'BENCH',
+                  'az_start' : 0.0, 'za_start' : 0.0}
+        for key, val in header.items():
+            dset.attrs[key] = val
+
+    return path
+
+def makeObservations(outDir, nfiles, nchans=2**10, tstart=DEFAULT_MJD, seed=0):
+    """
+    Write nfiles small observations spread over one night in BL file naming.
+
+    Returns
+    -------
+    list of str
+        Paths to the observation files.
+    """
+    os.makedirs(outDir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    files = []
+    for ii in range(nfiles):
+        mjd = tstart + ii * 330 / 86400
+        name = f'blc00_guppi_{int(mjd)}_{ii:05d}_TARG{ii:04d}_{ii:04d}.0000.h5'
+        files.append(makeH5(os.path.join(outDir, name), ntime=16, nchans=nchans, tstart=mjd,
+                            ra=rng.uniform(0, 24), dec=rng.uniform(-20, 80), seed=ii))
+    return files
+
+def _checksum(line):
+    total = 0
+    for char in line:
+        if char.isdigit():
+            total += int(char)
+        elif char == '-':
+            total += 1
+    return str(total % 10)
+
+def makeTLE(norad, name, epochMjd, rng):
+    """
+    Generate one satellite as a Space-Track style 3le entry.
+
+    Orbits are drawn from a mix of LEO, MEO and GEO populations.
+
+    Returns
+    -------
+    str
+        Three lines (name, line 1, line 2) joined with newlines.
+    """
+    kind = rng.random()
+    if kind < 0.7:
+        meanMotion, ecc = rng.uniform(13.5, 15.8), rng.uniform(0, 0.01)
+    elif kind < 0.85:
+        meanMotion, ecc = rng.uniform(1.9, 2.1), rng.uniform(0, 0.02)
+    else:
+        meanMotion, ecc = rng.uniform(1.0020, 1.0030), rng.uniform(0, 0.001)
+
+    epoch = Time(epochMjd, format='mjd').datetime
+    dayOfYear = epoch.timetuple().tm_yday + (epoch.hour * 3600 + epoch.minute * 60 + epoch.second) / 86400
+
+    line1 = f'1 {norad:05d}U {"20001A":<8} {epoch.year % 100:02d}{dayOfYear:012.8f}  .00000000  00000-0  00000-0 0  999'
+    line2 = (f'2 {norad:05d} {rng.uniform(0, 100):8.4f} {rng.uniform(0, 360):8.4f} {int(ecc * 1e7):07d} '
+             f'{rng.uniform(0, 360):8.4f} {rng.uniform(0, 360):8.4f} {meanMotion:11.8f}{int(rng.integers(1, 99999)):5d}')
+
+    return '\n'.join([f'0 {name}', line1 + _checksum(line1), line2 + _checksum(line2)])
+
+def makeCatalog(nsats, epochMjd=DEFAULT_MJD, seed=0, firstId=10000):
+    """
+    Generate a catalog of nsats satellites.
+
+    Returns
+    -------
+    dict
+        Mapping of NORAD id to its 3le text.
+    """
+    rng = np.random.default_rng(seed)
+    return {norad : makeTLE(norad, f'BENCHSAT-{norad}', epochMjd - 0.3, rng)
+            for norad in range(firstId, firstId + nsats)}
+
+def writeCatalog(catalog, path):
+    """
+    Write a catalog from makeCatalog as a TLE file readable by load_tle.
+    """
+    with open(path, 'w') as f:
+        f.write('\n'.join(catalog.values()) + '\n')
+    return path
+
+def makeUCS(catalog):
+    """
+    Build a tab-separated UCS Satellite Database covering the catalog.
+
+    Returns
+    -------
+    bytes
+        The database encoded the same way as the UCS download (cp1252).
+    """
+    lines = ['Name of Satellite, Alternate Names\tClass of Orbit\tDate of Launch\tNORAD Number']
+    for norad in catalog:
+        lines.append(f'BENCHSAT-{norad}\tLEO\t1/1/2015\t{norad}')
+    return '\n'.join(lines).encode('cp1252')
+
+def recordResponses(catalog, outDir):
+    """
+    Record the responses the Space-Track stand-in replays.
+
+    One file per satellite holds the exact text Space-Track returns for that
+    NORAD id, plus the UCS database, so benchmarks replay identical bytes
+    from disk run after run.
+
+    Returns
+    -------
+    str
+        The directory with the recorded responses.
+    """
+    os.makedirs(outDir, exist_ok=True)
+    for norad, text in catalog.items():
+        with open(os.path.join(outDir, f'{norad}.3le'), 'w') as f:
+            f.write(text + '\n')
+
+    with open(os.path.join(outDir, 'ucs.txt'), 'wb') as f:
+        f.write(makeUCS(catalog))
+
+    return outDir
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+'''
+Load generator for the crossmatch service.
+
+Sends queries from a number of concurrent clients and reports latency
+percentiles and throughput. By default a service is started in-process on a
+synthetic catalog (no network needed); give --url or --unix to load an
+already running `satcheck serve` instead:
+
+    python benchmarks/load_service.py --clients 16 --queries 50
+    python benchmarks/load_service.py --url http://127.0.0.1:8765 --mjd 59000.2
+'''
+
+import os, sys, io, json, time, socket, shutil, tempfile, threading, contextlib
+import http.client
+from urllib.parse import urlparse
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures
+
+class HTTPClient:
+
+    def __init__(self, url):
+        url = urlparse(url)
+        self.conn = http.client.HTTPConnection(url.hostname, url.port)
+
+    def query(self, message):
+        body = json.dumps(message)
+        self.conn.request('POST', '/query', body=body, headers={'Content-Type' : 'application/json'})
+        return json.loads(self.conn.getresponse().read())
+
+    def close(self):
+        self.conn.close()
+
+class UnixClient:
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rwb')
+
+    def query(self, message):
+        self.file.write(json.dumps(message).encode() + b'\n')
+        self.file.flush()
+        return json.loads(self.file.readline())
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+def makeQueries(nqueries, mjd, duration, seed=0, distinctTimes=8):
+    """
+    Random pointings starting at one of a few times on the same day, like a
+    cadence of observations being checked by several users at once.
+    """
+    rng = np.random.default_rng(seed)
+    starts = mjd + rng.uniform(0, 0.2, distinctTimes)
+    return [{'ra' : float(rng.uniform(0, 360)), 'dec' : float(rng.uniform(-30, 90)),
+             'tstart' : float(rng.choice(starts)), 'duration' : duration} for _ in range(nqueries)]
+
+def runLoad(connect, queries, clients):
+    """
+    Send every query, split over concurrent clients, and time each one.
+
+    Returns
+    -------
+    dict
+        Latency percentiles in ms, throughput in queries per second, the
+        number of failed queries and the mean server side batch size.
+    """
+    latencies = [[] for _ in range(clients)]
+    batchSizes = [[] for _ in range(clients)]
+    errors = [0] * clients
+
+    def client(ii):
+        conn = connect()
+        try:
+            for message in queries[ii::clients]:
+                t0 = time.perf_counter()
+                result = conn.query(message)
+                latencies[ii].append((time.perf_counter() - t0) * 1e3)
+                if 'error' in result:
+                    errors[ii] += 1
+                else:
+                    batchSizes[ii].append(result['batchSize'])
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=client, args=(ii,)) for ii in range(clients)]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - t0
+
+    allLatencies = np.concatenate([np.asarray(l, dtype=float) for l in latencies])
+    allBatches = np.concatenate([np.asarray(b, dtype=float) for b in batchSizes])
+    return {'clients' : clients,
+            'queries' : len(queries),
+            'errors' : sum(errors),
+            'wall_seconds' : wall,
+            'throughput_qps' : len(queries) / wall,
+            'latency_ms' : {f'p{p}' : float(np.percentile(allLatencies, p)) for p in (50, 90, 99)} | {'max' : float(allLatencies.max())},
+            'mean_batch_size' : float(allBatches.mean()) if len(allBatches) else 0.0}
+
+@contextlib.contextmanager
+def localService(nsats, mjd, batchWindow):
+    """
+    Run a service in this process on a synthetic catalog written for mjd.
+    """
+    from satcheck.service import CrossmatchService, serve
+    from satcheck.findSatsHelper import tle_filename
+
+    tmp = tempfile.mkdtemp(prefix='satcheck_load_')
+    try:
+        fixtures.writeCatalog(fixtures.makeCatalog(nsats, epochMjd=mjd), tle_filename(mjd, tmp))
+        service = CrossmatchService(tmp, batchWindow=batchWindow)
+        with contextlib.redirect_stdout(io.StringIO()):
+            service.catalog(mjd)
+
+        sockPath = os.path.join(tmp, 'service.sock')
+        thread = threading.Thread(target=serve, args=(service,), kwargs={'port' : None, 'unix_socket' : sockPath}, daemon=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            thread.start()
+            while not os.path.exists(sockPath):
+                time.sleep(0.01)
+        yield service, sockPath
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measure latency and throughput of the satcheck crossmatch service')
+    parser.add_argument('--url', help='HTTP address of a running service', default=None)
+    parser.add_argument('--unix', help='unix socket of a running service', default=None)
+    parser.add_argument('--clients', help='comma separated numbers of concurrent clients to run', default='1,4,16')
+    parser.add_argument('--queries', help='queries per run', default=200, type=int)
+    parser.add_argument('--duration', help='observation length of each query in seconds', default=300, type=float)
+    parser.add_argument('--mjd', help='day to query', default=fixtures.DEFAULT_MJD, type=float)
+    parser.add_argument('--nsats', help='catalog size of the in-process service', default=1000, type=int)
+    parser.add_argument('--batch-ms', help='batch window of the in-process service', default=5, type=float)
+    parser.add_argument('--output', help='JSON file to write the results to', default=None)
+    args = parser.parse_args()
+
+    queries = makeQueries(args.queries, args.mjd, args.duration)
+    clientCounts = [int(c) for c in args.clients.split(',')]
+
+    with contextlib.ExitStack() as stack:
+        if args.url:
+            connect = lambda: HTTPClient(args.url)
+        elif args.unix:
+            connect = lambda: UnixClient(args.unix)
+        else:
+            service, sockPath = stack.enter_context(localService(args.nsats, args.mjd, args.batch_ms / 1e3))
+            connect = lambda: UnixClient(sockPath)
+
+        results = []
+        for clients in clientCounts:
+            result = runLoad(connect, queries, clients)
+            results.append(result)
+            print(f"{clients:>4} clients: {result['throughput_qps']:8.1f} queries/s, "
+                  f"p50 {result['latency_ms']['p50']:8.1f} ms, p99 {result['latency_ms']['p99']:8.1f} ms, "
+                  f"mean batch {result['mean_batch_size']:5.1f}, errors {result['errors']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args' : vars(args), 'results' : results}, f, indent=2)
+        print(f'Results saved to: {args.output}')
+
+if __name__ == '__main__':
+    sys.exit(main())
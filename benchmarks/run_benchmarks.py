@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+'''
+Offline benchmark suite for the SatCheck hot paths.
+
+Times package import and CLI start-up, pull_relevant_header_info, load_tle, separation, downloadTLEs (against a
+local Space-Track stand-in), end-to-end findSats, plotH5 and forecast on synthetic
+fixtures, and writes the results as JSON so runs from different versions can
+be compared:
+
+    python benchmarks/run_benchmarks.py --output new.json
+    python benchmarks/run_benchmarks.py --compare old.json new.json
+'''
+
+import os, sys, io, json, time, shutil, tempfile, platform, subprocess, contextlib
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures
+from spacetrack_standin import SpaceTrackStandin
+
+import ephem
+import satcheck
+from satcheck import findSatsHelper
+from satcheck.findSats import findSats, downloadTLEs
+from satcheck.findSatsHelper import pull_relevant_header_info, load_tle, separation, convert
+from satcheck.genPlotsAll import plotH5
+from satcheck.forecast import readSchedule, forecastSchedule
+
+STARTUP_COMMANDS = ['import', 'find', 'plot', 'gps', 'confirm']
+
+FULL_SIZES = {'startup' : STARTUP_COMMANDS,
+              'headers' : [10, 100],
+              'load_tle' : [100, 1000, 10000, 50000],
+              'separation' : [100, 1000],
+              'downloadTLEs' : [1000, 5000],
+              'findSats' : [500],
+              'plotH5' : [2**16, 2**18, 2**20],
+              'forecast' : [1000, 5000]}
+
+QUICK_SIZES = {'startup' : STARTUP_COMMANDS,
+               'headers' : [10],
+               'load_tle' : [100, 1000],
+               'separation' : [100],
+               'downloadTLEs' : [1000],
+               'findSats' : [100],
+               'plotH5' : [2**16],
+               'forecast' : [1000]}
+
+def timeit(func, repeat, warmup=True):
+    """
+    Run func repeat times with its output silenced and return the wall times.
+
+    An untimed warm-up call first pays for one-off costs such as the lazy
+    imports of blimpy and astropy, which the startup case measures separately.
+    """
+    if warmup:
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - t0)
+    return times
+
+def gbtObserver():
+    gbt = ephem.Observer()
+    gbt.long = "-79.839857"
+    gbt.lat = "38.432987"
+    gbt.elevation = 807.0
+    return gbt
+
+def benchStartup(tmp, size, repeat):
+    # a fresh interpreter each time, so nothing is already imported
+    if size == 'import':
+        cmd = [sys.executable, '-c', 'import satcheck']
+    else:
+        cmd = [sys.executable, '-m', 'satcheck', size, '--help']
+    return timeit(lambda: subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL), repeat, warmup=False)
+
+def benchHeaders(tmp, size, repeat):
+    files = fixtures.makeObservations(os.path.join(tmp, f'headers_{size}'), size)
+    return timeit(lambda: pull_relevant_header_info(files), repeat)
+
+def benchLoadTle(tmp, size, repeat):
+    path = fixtures.writeCatalog(fixtures.makeCatalog(size), os.path.join(tmp, f'catalog_{size}.txt'))
+    return timeit(lambda: load_tle(path), repeat)
+
+def benchSeparation(tmp, size, repeat):
+    path = fixtures.writeCatalog(fixtures.makeCatalog(size), os.path.join(tmp, f'catalog_{size}.txt'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        satdict = load_tle(path)
+    start = convert(fixtures.DEFAULT_MJD)
+    return timeit(lambda: separation(satdict, '4h12m00s', '12d30m00s', start, gbtObserver()), repeat)
+
+def _standin(tmp, size):
+    responses = fixtures.recordResponses(fixtures.makeCatalog(size), os.path.join(tmp, f'responses_{size}'))
+    server = SpaceTrackStandin(responses)
+    findSatsHelper.SPACETRACK_URL = server.url
+    findSatsHelper.UCS_URL = server.ucsUrl
+    findSatsHelper.SPACETRACK_SLEEP = 0
+    return server
+
+def benchDownloadTLEs(tmp, size, repeat):
+    files = fixtures.makeObservations(os.path.join(tmp, f'download_obs_{size}'), 3)
+    workDir = os.path.join(tmp, f'download_work_{size}')
+
+    def run():
+        # start from a cold cache every time
+        shutil.rmtree(workDir, ignore_errors=True)
+        downloadTLEs(files, None, 'bench', 'bench', work_dir=workDir)
+
+    with _standin(tmp, size):
+        return timeit(run, repeat)
+
+def benchFindSats(tmp, size, repeat):
+    files = fixtures.makeObservations(os.path.join(tmp, f'findsats_obs_{size}'), 5)
+    workDir = os.path.join(tmp, f'findsats_work_{size}')
+
+    def run():
+        shutil.rmtree(workDir, ignore_errors=True)
+        findSats(None, None, '*.h5', False, None, file_list=files, spacetrack_account='bench', spacetrack_password='bench', work_dir=workDir)
+
+    with _standin(tmp, size):
+        return timeit(run, repeat)
+
+def benchPlotH5(tmp, size, repeat):
+    h5 = fixtures.makeH5(os.path.join(tmp, f'plot_{size}.h5'), ntime=16, nchans=size)
+    csv = os.path.join(tmp, 'BENCHSAT-1_separation_BENCH_0000.csv')
+    workDir = os.path.join(tmp, 'plots')
+    return timeit(lambda: plotH5([csv], h5, work_dir=workDir), repeat)
+
+def benchForecast(tmp, size, repeat):
+    tle = fixtures.writeCatalog(fixtures.makeCatalog(size), os.path.join(tmp, f'catalog_{size}.txt'))
+
+    # a night of 100 back to back 5 minute slots on random targets
+    rng = np.random.default_rng(0)
+    path = os.path.join(tmp, 'schedule.csv')
+    with open(path, 'w') as f:
+        f.write('target,ra,dec,start,duration\n')
+        for ii in range(100):
+            f.write(f'T{ii},{rng.uniform(0, 360)},{rng.uniform(-30, 90)},{fixtures.DEFAULT_MJD + ii * 330 / 86400},300\n')
+    schedule = readSchedule(path)
+
+    return timeit(lambda: forecastSchedule(schedule, tle), repeat)
+
+CASES = {'startup' : (benchStartup, 'command'),
+         'headers' : (benchHeaders, 'nfiles'),
+         'load_tle' : (benchLoadTle, 'nsats'),
+         'separation' : (benchSeparation, 'nsats'),
+         'downloadTLEs' : (benchDownloadTLEs, 'nsats'),
+         'findSats' : (benchFindSats, 'nsats'),
+         'plotH5' : (benchPlotH5, 'nchans'),
+         'forecast' : (benchForecast, 'nsats')}
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runBenchmarks(sizes, repeat, only=None, tmp=None):
+    """
+    Run the benchmark cases and collect their timings.
+
+    Parameters
+    ----------
+    sizes : dict
+        Mapping of case name to the list of sizes to run it at.
+    repeat : int
+        Number of timed repetitions of each case.
+    only : list of str, optional
+        Restrict the run to these case names.
+    tmp : str, optional
+        Directory for the fixtures. A temporary directory is used if None.
+
+    Returns
+    -------
+    dict
+        'meta' describing the environment and 'results' with one entry per
+        (case, size) holding all timings and their min/median/mean.
+    """
+    cleanup = tmp is None
+    if tmp is None:
+        tmp = tempfile.mkdtemp(prefix='satcheck_bench_')
+
+    results = []
+    try:
+        for name, (bench, param) in CASES.items():
+            if only is not None and name not in only:
+                continue
+            for size in sizes[name]:
+                print(f'{name} ({param}={size})...', end=' ', flush=True)
+                times = bench(tmp, size, repeat)
+                print(f'{np.median(times):.4f} s')
+                results.append({'name' : name, 'params' : {param : size}, 'times' : times,
+                                'min' : min(times), 'median' : float(np.median(times)), 'mean' : float(np.mean(times))})
+    finally:
+        if cleanup:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    meta = {'satcheck_version' : satcheck.__version__,
+            'git_commit' : gitCommit(),
+            'python' : platform.python_version(),
+            'platform' : platform.platform(),
+            'numpy' : np.__version__,
+            'ephem' : ephem.__version__,
+            'repeat' : repeat,
+            'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    return {'meta' : meta, 'results' : results}
+
+def _key(result):
+    return result['name'] + ' ' + ' '.join(f'{k}={v}' for k, v in sorted(result['params'].items()))
+
+def compareResults(basePath, newPath, threshold=1.2):
+    """
+    Print the median-time ratio of every case present in both result files.
+
+    Returns
+    -------
+    int
+        Number of cases slower than threshold times the baseline.
+    """
+    with open(basePath) as f:
+        base = {_key(r) : r for r in json.load(f)['results']}
+    with open(newPath) as f:
+        new = {_key(r) : r for r in json.load(f)['results']}
+
+    regressions = 0
+    print(f"{'case':<40}{'base [s]':>12}{'new [s]':>12}{'ratio':>8}")
+    for key in base:
+        if key not in new:
+            continue
+        ratio = new[key]['median'] / base[key]['median']
+        flag = ''
+        if ratio > threshold:
+            flag = '  <-- slower'
+            regressions += 1
+        print(f"{key:<40}{base[key]['median']:>12.4f}{new[key]['median']:>12.4f}{ratio:>8.2f}{flag}")
+
+    return regressions
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the SatCheck hot paths')
+    parser.add_argument('--output', help='JSON file to write the results to', default='bench_results.json')
+    parser.add_argument('--repeat', help='number of timed repetitions per case', default=3, type=int)
+    parser.add_argument('--quick', help='run only the small sizes', action='store_true')
+    parser.add_argument('--only', help='comma separated list of cases to run: ' + ', '.join(CASES), default=None)
+    parser.add_argument('--compare', help='compare two result files (baseline then new) instead of running', nargs=2, default=None)
+    parser.add_argument('--threshold', help='slowdown ratio reported as a regression by --compare', default=1.2, type=float)
+    args = parser.parse_args()
+
+    if args.compare:
+        return 1 if compareResults(*args.compare, threshold=args.threshold) > 0 else 0
+
+    sizes = QUICK_SIZES if args.quick else FULL_SIZES
+    only = args.only.split(',') if args.only else None
+
+    results = runBenchmarks(sizes, args.repeat, only=only)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results saved to: {args.output}')
+
+if __name__ == '__main__':
+    sys.exit(main())
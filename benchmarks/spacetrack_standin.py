@@ -0,0 +1,97 @@
+'''
+Local stand-in for Space-Track.org and the UCS download.
+
+Serves responses recorded by fixtures.recordResponses over plain HTTP on
+localhost so downloadTLEs and findSats can be benchmarked offline. Point
+SatCheck at it by setting findSatsHelper.SPACETRACK_URL and UCS_URL to the
+urls the server reports.
+'''
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        # drain the login form, any credentials are accepted
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/ajaxauth/login':
+            self._send(200, b'""')
+        else:
+            self._send(404, b'')
+
+    def do_GET(self):
+        self.server.requestCount += 1
+        path = unquote(self.path)
+
+        if path == '/ucs.txt':
+            with open(os.path.join(self.server.responseDir, 'ucs.txt'), 'rb') as f:
+                self._send(200, f.read())
+            return
+
+        if not path.startswith('/basicspacedata/query/'):
+            self._send(404, b'')
+            return
+
+        # /basicspacedata/query/class/tle/EPOCH/d1--d2/NORAD_CAT_ID/ids/orderby/...
+        parts = path.split('/')
+        ids = parts[parts.index('NORAD_CAT_ID') + 1].split(',')
+
+        body = []
+        for norad in ids:
+            recorded = os.path.join(self.server.responseDir, f'{int(float(norad))}.3le')
+            if os.path.exists(recorded):
+                with open(recorded) as f:
+                    body.append(f.read())
+
+        if len(body) == 0:
+            self._send(204, b'')
+        else:
+            self._send(200, ''.join(body).encode())
+
+class SpaceTrackStandin:
+    """
+    Run the stand-in server in a background thread.
+
+    Parameters
+    ----------
+    responseDir : str
+        Directory written by fixtures.recordResponses.
+
+    Examples
+    --------
+    >>> with SpaceTrackStandin(responseDir) as server:
+    ...     findSatsHelper.SPACETRACK_URL = server.url
+    ...     findSatsHelper.UCS_URL = server.ucsUrl
+    """
+
+    def __init__(self, responseDir):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.responseDir = responseDir
+        self.server.requestCount = 0
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.ucsUrl = self.url + '/ucs.txt'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def requestCount(self):
+        return self.server.requestCount
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -17,8 +17,13 @@ Main Features
 Key Functions
 -------------
 findSats : Main satellite detection function
+iterFindSats : Crossmatch files one at a time, yielding each summary row as it is written
 plotSep : Generate satellite separation plots  
 plotH5 : Generate observation waterfall plots
+confirmPasses : Rank satellite passes by the power they add to the data
+Metrics : Collect per-stage timings, peak memory and counters of a run
+CrossmatchService : Answer single-pointing crossmatch queries from warm TLE catalogs
+forecast : Rank planned observing slots by predicted satellite contamination
 queryUCS : Download satellite database
 query_space_track : Fetch TLE data from Space-Track.org
 
@@ -37,8 +42,16 @@ Basic Usage
 For detailed documentation of all functions, see FUNCTION_DOCUMENTATION.md
 """
 
+# Every submodule defers its heavy imports (blimpy, turbo_seti, astropy, matplotlib,
+# pandas, requests, h5py, sgp4) to the functions that need them, so importing the
+# package only costs numpy and ephem.
 from .findSats import findSats
+from .streaming import iterFindSats
 from .genPlotsAll import plotSep, plotH5
+from .confirmPasses import confirmPasses
+from .metrics import Metrics
+from .service import CrossmatchService
+from .forecast import forecast
 from .findSatsHelper import (
     find_files,
     pull_relevant_header_info,
@@ -53,8 +66,13 @@ from .findSatsHelper import (
 __version__ = "0.1.0"
 __all__ = [
     "findSats",
+    "iterFindSats",
     "plotSep", 
     "plotH5",
+    "confirmPasses",
+    "Metrics",
+    "CrossmatchService",
+    "forecast",
     "find_files",
     "pull_relevant_header_info", 
     "convert",
@@ -0,0 +1,63 @@
+import sys, importlib
+
+'''
+Single `satcheck` command line entry point.
+
+Each subcommand is the main() of one module, which is only imported when that
+subcommand runs, so e.g. `satcheck gps` never loads blimpy or matplotlib.
+'''
+
+# subcommand -> (module, description)
+COMMANDS = {
+    'find' : ('satcheck.findSats', 'search h5 files for satellites passing through the beam'),
+    'merge' : ('satcheck.shards', 'merge the outputs of a sharded find run'),
+    'plot' : ('satcheck.genPlotsAll', 'plot waterfalls and separations of affected files'),
+    'plot-target' : ('satcheck.genPlot1', 'plot the waterfall and separations of one target'),
+    'passes' : ('satcheck.passIndex', 'look up passes by satellite, target, file or time'),
+    'export' : ('satcheck.passExport', 'export the pass index to FITS or VOTable for TOPCAT'),
+    'gps' : ('satcheck.findGPSFiles', 'find files with flagged frequencies near GPS L1'),
+    'confirm' : ('satcheck.confirmPasses', 'rank passes by the power they add to the data'),
+    'hits' : ('satcheck.hitJoin', 'tag turboSETI hits that overlap satellite passes and drift like them'),
+    'cutout' : ('satcheck.cutouts', 'copy the data around each pass into small standalone h5 files'),
+    'forecast' : ('satcheck.forecast', 'rank planned schedule slots by predicted satellite contamination'),
+    'downlinks' : ('satcheck.downlinks', 'add satellite downlink frequencies to the table used by find --prune_bands'),
+    'ephem-cache' : ('satcheck.ephemCache', 'build the per-day ephemeris cache of TLE files'),
+    'visibility' : ('satcheck.visibility', 'build the daily satellite visibility index of TLE files'),
+    'serve' : ('satcheck.service', 'answer crossmatch queries from warm in-memory TLE catalogs'),
+    'convert-flagged' : ('satcheck.flaggedFiles', 'convert the flagged-files pickle to a memory-mapped store'),
+}
+
+def usage():
+    lines = ['usage: satcheck <command> [options]', '', 'commands:']
+    for name, (module, description) in COMMANDS.items():
+        lines.append(f'  {name:<18}{description}')
+    lines += ['', "Run 'satcheck <command> --help' for the options of each command."]
+    return '\n'.join(lines)
+
+def main(argv=None):
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if len(argv) == 0 or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+
+    if argv[0] == '--version':
+        from . import __version__
+        print(f'satcheck {__version__}')
+        return 0
+
+    if argv[0] not in COMMANDS:
+        print(f"satcheck: unknown command '{argv[0]}'\n", file=sys.stderr)
+        print(usage(), file=sys.stderr)
+        return 2
+
+    # show 'satcheck <command>' in the usage messages of the subcommand
+    sys.argv[0] = f'satcheck {argv[0]}'
+
+    module = importlib.import_module(COMMANDS[argv[0]][0])
+    return module.main(argv[1:])
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+#imports
+import os, sys, ast
+import numpy as np
+import argparse
+
+from .h5Tools import h5pyModule, readH5Header, fineChannelsPerCoarse, iterBlocks
+from .genPlotsAll import decryptSepName
+
+def passRows(minTime, tsamp, ntime, onWindow, offWindow):
+    """
+    Split the time rows around a satellite pass into on-pass and off-pass rows.
+
+    Parameters
+    ----------
+    minTime : float
+        Time of the minimum separation in seconds after the start of the file.
+    tsamp : float
+        Sampling time of one row in seconds.
+    ntime : int
+        Number of time rows in the file.
+    onWindow : float
+        Half width in seconds of the on-pass window centred on minTime.
+    offWindow : float
+        Half width in seconds of the window the off-pass rows are taken from.
+        Rows inside it but outside the on-pass window are off-pass.
+
+    Returns
+    -------
+    tuple of (int, int, numpy.ndarray)
+        First and last+1 row to read, and a boolean on-pass mask for those rows.
+    """
+    def rowsCovering(t0, t1):
+        r0 = int(np.clip(np.floor(t0 / tsamp), 0, ntime))
+        r1 = int(np.clip(np.ceil(t1 / tsamp), 0, ntime))
+        return r0, max(r1, r0)
+
+    on0, on1 = rowsCovering(minTime - onWindow, minTime + onWindow)
+    if on1 == on0 and on0 < ntime:
+        on1 = on0 + 1
+    off0, off1 = rowsCovering(minTime - offWindow, minTime + offWindow)
+    r0, r1 = min(on0, off0), max(on1, off1)
+
+    onMask = np.zeros(r1-r0, dtype=bool)
+    onMask[on0-r0:on1-r0] = True
+
+    return r0, r1, onMask
+
+def passPower(h5Path, minTime, onWindow=30, offWindow=120, maxBytes=64*2**20):
+    """
+    Compare per-coarse-channel power during a satellite pass to the power around it.
+
+    Only the time rows within offWindow of the pass are read, in blocks of at
+    most maxBytes, so memory use does not depend on the size of the file.
+
+    Parameters
+    ----------
+    h5Path : str
+        Path to HDF5 observation file.
+    minTime : float
+        Time of the minimum separation in seconds after the start of the file.
+    onWindow : float, default=30
+        Half width in seconds of the on-pass window.
+    offWindow : float, default=120
+        Half width in seconds of the window used for the off-pass reference.
+    maxBytes : int, default=64 MiB
+        Upper bound on the size of each block read from the file.
+
+    Returns
+    -------
+    dict
+        - 'onPower', 'offPower': mean power per coarse channel (NaN if no rows)
+        - 'onRows', 'offRows': number of time rows in each window
+        - 'freqs': centre frequency of each coarse channel in MHz
+    """
+    h5py = h5pyModule()
+
+    hdr = readH5Header(h5Path)
+    ntime, nifs, nchans = hdr['shape']
+    nfpc = fineChannelsPerCoarse(hdr)
+    ncoarse = nchans // nfpc
+
+    r0, r1, onMask = passRows(minTime, hdr['tsamp'], ntime, onWindow, offWindow)
+
+    onSum = np.zeros(ncoarse)
+    offSum = np.zeros(ncoarse)
+    with h5py.File(h5Path, 'r') as f:
+        for rowStart, chanStart, block in iterBlocks(f['data'], r0, r1, maxBytes=maxBytes, chanAlign=nfpc):
+            mask = onMask[rowStart-r0:rowStart-r0+block.shape[0]]
+
+            # sum over polarizations and fine channels within each coarse channel
+            perRow = block.sum(axis=1, dtype=np.float64)
+            perRow = perRow.reshape(block.shape[0], -1, nfpc).sum(axis=2)
+
+            c0 = chanStart // nfpc
+            c1 = c0 + perRow.shape[1]
+            onSum[c0:c1] += perRow[mask].sum(axis=0)
+            offSum[c0:c1] += perRow[~mask].sum(axis=0)
+
+    nOn = int(onMask.sum())
+    nOff = len(onMask) - nOn
+    norm = nifs * nfpc
+
+    chanCentres = hdr['fch1'] + hdr['foff'] * (np.arange(ncoarse) * nfpc + nfpc / 2)
+
+    return {'onPower' : onSum / (nOn * norm) if nOn > 0 else np.full(ncoarse, np.nan),
+            'offPower' : offSum / (nOff * norm) if nOff > 0 else np.full(ncoarse, np.nan),
+            'onRows' : nOn,
+            'offRows' : nOff,
+            'freqs' : chanCentres}
+
+def scorePass(power):
+    """
+    Score a pass by the largest on/off power ratio over the coarse channels.
+
+    Parameters
+    ----------
+    power : dict
+        Output of passPower.
+
+    Returns
+    -------
+    tuple of (float, int, float)
+        Score in dB, index of the coarse channel that produced it and that
+        channel's centre frequency in MHz. The score is NaN when either window
+        is empty.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = 10 * np.log10(power['onPower'] / power['offPower'])
+
+    if np.all(np.isnan(ratio)):
+        return np.nan, -1, np.nan
+
+    best = int(np.nanargmax(ratio))
+    return float(ratio[best]), best, float(power['freqs'][best])
+
+def confirmPasses(work_dir=None, onWindow=30, offWindow=120, maxBytes=64*2**20):
+    """
+    Rank every satellite pass found by findSats by the power it adds to the data.
+
+    For each pass listed in files_affected_by_sats.csv the time rows around
+    minTime are read from the h5 file in bounded blocks, the mean power of each
+    coarse channel is compared between the on-pass and off-pass windows, and
+    the largest ratio is used as the pass score.
+
+    Parameters
+    ----------
+    work_dir : str, optional
+        Directory with files_affected_by_sats.csv; the ranked results are
+        written here as pass_confirmation.csv. Defaults to the current directory.
+    onWindow : float, default=30
+        Half width in seconds of the on-pass window.
+    offWindow : float, default=120
+        Half width in seconds of the off-pass reference window.
+    maxBytes : int, default=64 MiB
+        Upper bound on the size of each block read from an h5 file.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per pass sorted by decreasing 'score' with columns
+        'filepath', 'csvPath', 'satellite', 'minSeparation', 'minTime',
+        'score', 'peakCoarseChannel', 'peakFrequency', 'onRows', 'offRows'.
+
+    Notes
+    -----
+    - Files shorter than the off-pass window around the pass get a NaN score
+      and are listed last
+    - Missing or unreadable h5 files are reported and skipped
+
+    Examples
+    --------
+    >>> ranked = confirmPasses(work_dir="/output/")
+    >>> ranked.head(20)
+    """
+
+    import pandas as pd
+
+    # Set work directory, default to current working directory
+    if work_dir is None:
+        work_dir = os.getcwd()
+
+    affectedFiles = pd.read_csv(os.path.join(work_dir, 'files_affected_by_sats.csv'))
+    # files without passes have N/A, which read_csv turns into NaN
+    affectedFiles = affectedFiles[affectedFiles['minTime'].notna()]
+
+    rows = []
+    for h5Path, minSeps, minTimes, csvs in zip(affectedFiles['filepath'], affectedFiles['minSeparation'], affectedFiles['minTime'], affectedFiles['csvPaths']):
+
+        minSeps = ast.literal_eval(minSeps)
+        minTimes = ast.literal_eval(minTimes)
+        csvs = ast.literal_eval(csvs)
+
+        for minSep, minTime, csv in zip(minSeps, minTimes, csvs):
+            try:
+                power = passPower(h5Path, minTime, onWindow=onWindow, offWindow=offWindow, maxBytes=maxBytes)
+            except (OSError, KeyError) as e:
+                print(f'Could not read {h5Path}: {e}')
+                continue
+
+            score, chan, freq = scorePass(power)
+            rows.append({'filepath' : h5Path,
+                         'csvPath' : csv,
+                         'satellite' : decryptSepName(csv)[0],
+                         'minSeparation' : minSep,
+                         'minTime' : minTime,
+                         'score' : score,
+                         'peakCoarseChannel' : chan,
+                         'peakFrequency' : freq,
+                         'onRows' : power['onRows'],
+                         'offRows' : power['offRows']})
+
+    ranked = pd.DataFrame(rows, columns=['filepath', 'csvPath', 'satellite', 'minSeparation', 'minTime', 'score',
+                                         'peakCoarseChannel', 'peakFrequency', 'onRows', 'offRows'])
+    ranked = ranked.sort_values('score', ascending=False, na_position='last').reset_index(drop=True)
+
+    outPath = os.path.join(work_dir, 'pass_confirmation.csv')
+    ranked.to_csv(outPath)
+    print(f"Pass scores saved to: {outPath}")
+
+    return ranked
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--work_dir', help='directory with files_affected_by_sats.csv, defaults to current working directory', default=None)
+    parser.add_argument('--onWindow', help='half width in seconds of the on-pass window', default=30, type=float)
+    parser.add_argument('--offWindow', help='half width in seconds of the off-pass reference window', default=120, type=float)
+    parser.add_argument('--chunkMB', help='maximum size in MB of each block read from the h5 files', default=64, type=float)
+    args = parser.parse_args(argv)
+
+    confirmPasses(args.work_dir, onWindow=args.onWindow, offWindow=args.offWindow, maxBytes=int(args.chunkMB*2**20))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import os, sys, ast
+import numpy as np
+import argparse
+
+from .h5Tools import h5pyModule, readH5Header, iterBlocks
+from .confirmPasses import passRows
+from .passIndex import PassIndex, indexPath
+
+'''
+Small standalone h5 files with just the data around each satellite pass.
+
+Downstream RFI work only needs a few minutes of data around the closest
+approach of a pass, but used to reload whole observations through blimpy. A
+cutout copies the time rows within a window of minTime (and optionally only a
+frequency range) into a new h5 file with the same dataset layout: the original
+header, with tstart, fch1 and nchans moved to the cutout, and the same chunk
+shape, compression and filters. The data is copied in blocks of bounded size,
+so the source file is never loaded whole, and several cutouts are made at once
+in separate processes.
+'''
+
+CUTOUT_DIR = 'cutouts'
+
+def channelRange(hdr, fmin=None, fmax=None):
+    """
+    Channels of an observation between two frequencies.
+
+    Parameters
+    ----------
+    hdr : dict
+        Header from readH5Header.
+    fmin, fmax : float, optional
+        Frequency limits in MHz. Default to the edges of the band.
+
+    Returns
+    -------
+    tuple of (int, int)
+        First and last+1 channel covering [fmin, fmax]; empty if the range
+        is outside the band.
+    """
+    nchans = int(hdr['nchans'])
+    if fmin is None and fmax is None:
+        return 0, nchans
+
+    # channel i is centred on fch1 + i*foff, foff is usually negative
+    edges = hdr['fch1'] + hdr['foff'] * np.array([-0.5, nchans - 0.5])
+    lo = edges.min() if fmin is None else fmin
+    hi = edges.max() if fmax is None else fmax
+    chans = (np.array([lo, hi]) - hdr['fch1']) / hdr['foff']
+    c0 = int(np.clip(np.floor(chans.min() + 0.5), 0, nchans))
+    c1 = int(np.clip(np.ceil(chans.max() + 0.5), 0, nchans))
+    return c0, max(c0, c1)
+
+def cutout(h5Path, minTime, outPath, window=150, fmin=None, fmax=None, maxBytes=64*2**20):
+    """
+    Copy the data around one pass into its own h5 file.
+
+    Parameters
+    ----------
+    h5Path : str
+        Path to the HDF5 observation file.
+    minTime : float
+        Time of the minimum separation in seconds after the start of the file.
+    outPath : str
+        Output h5 file.
+    window : float, default=150
+        Half width in seconds of the cutout, centred on minTime.
+    fmin, fmax : float, optional
+        Frequency limits in MHz. Defaults to the whole band.
+    maxBytes : int, default=64 MiB
+        Upper bound on the size of each block copied.
+
+    Returns
+    -------
+    dict
+        'cutoutPath' and the 'rowStart', 'rowStop', 'chanStart' and
+        'chanStop' copied from the source file.
+
+    Raises
+    ------
+    ValueError
+        If the window or frequency range contains no data.
+    """
+    h5py = h5pyModule()
+
+    hdr = readH5Header(h5Path)
+    ntime, nifs, nchans = hdr['shape']
+    r0, r1, _ = passRows(minTime, hdr['tsamp'], ntime, window, window)
+    c0, c1 = channelRange(hdr, fmin, fmax)
+    if r1 <= r0 or c1 <= c0:
+        raise ValueError(f'No data in {h5Path} within {window} s of {minTime} s between {fmin} and {fmax} MHz')
+
+    os.makedirs(os.path.dirname(os.path.abspath(outPath)), exist_ok=True)
+    tmpPath = f'{outPath}.{os.getpid()}.tmp'
+    try:
+        with h5py.File(h5Path, 'r') as src, h5py.File(tmpPath, 'w') as dst:
+            for key, val in src.attrs.items():
+                dst.attrs[key] = val
+
+            for name in ('data', 'mask'):
+                if name not in src:
+                    continue
+                dset = src[name]
+                out = _createLike(h5py, dst, name, dset, (r1 - r0, nifs, c1 - c0))
+
+                for rowStart, chanStart, block in iterBlocks(dset, r0, r1, c0, c1, maxBytes=maxBytes):
+                    out[rowStart-r0:rowStart-r0+block.shape[0], :, chanStart-c0:chanStart-c0+block.shape[2]] = block
+
+                for key, val in dset.attrs.items():
+                    out.attrs[key] = val
+                for ii, dim in enumerate(dset.dims):
+                    out.dims[ii].label = dim.label
+
+            # the header describes the cutout, the attributes below where it came from
+            data = dst['data']
+            data.attrs['tstart'] = hdr['tstart'] + r0 * hdr['tsamp'] / 86400
+            data.attrs['fch1'] = hdr['fch1'] + c0 * hdr['foff']
+            data.attrs['nchans'] = c1 - c0
+            dst.attrs['cutout_source'] = os.path.abspath(h5Path)
+            dst.attrs['cutout_rows'] = (r0, r1)
+            dst.attrs['cutout_channels'] = (c0, c1)
+        os.replace(tmpPath, outPath)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+    return {'cutoutPath' : outPath, 'rowStart' : r0, 'rowStop' : r1, 'chanStart' : c0, 'chanStop' : c1}
+
+def _createLike(h5py, dst, name, dset, shape):
+    # same type and creation properties (chunks, compression, filters) as dset
+    dcpl = dset.id.get_create_plist()
+    if dset.chunks is not None:
+        dcpl.set_chunk(tuple(min(c, s) for c, s in zip(dset.chunks, shape)))
+    space = h5py.h5s.create_simple(shape)
+    h5py.h5d.create(dst.id, name.encode(), dset.id.get_type(), space, dcpl=dcpl)
+    return dst[name]
+
+def _passList(work_dir):
+    # (h5 file, satellite, minTime) of every pass, from the pass index if there is one
+    if os.path.exists(indexPath(work_dir)):
+        with PassIndex(work_dir) as index:
+            passes = index.passes()
+        return list(zip(passes['filepath'], passes['satellite'], passes['minTime']))
+
+    import pandas as pd
+    from .genPlotsAll import decryptSepName
+
+    affectedFiles = pd.read_csv(os.path.join(work_dir, 'files_affected_by_sats.csv'))
+    # files without passes have N/A, which read_csv turns into NaN
+    affectedFiles = affectedFiles[affectedFiles['minTime'].notna()]
+
+    passes = []
+    for h5Path, minTimes, csvs in zip(affectedFiles['filepath'], affectedFiles['minTime'], affectedFiles['csvPaths']):
+        for minTime, csv in zip(ast.literal_eval(minTimes), ast.literal_eval(csvs)):
+            passes.append((h5Path, decryptSepName(csv)[0], minTime))
+    return passes
+
+def cutoutName(h5Path, satellite, minTime):
+    """
+    File name of the cutout of one pass.
+    """
+    stem = os.path.splitext(os.path.basename(h5Path))[0]
+    sat = satellite.replace(' ', '_').replace('(', '-').replace(')', '-').replace('/', '-')
+    return f'{stem}_{sat}_{int(round(minTime))}s_cutout.h5'
+
+def _cutoutTask(args):
+    h5Path, satellite, minTime, outPath, window, fmin, fmax, maxBytes = args
+    row = {'filepath' : h5Path, 'satellite' : satellite, 'minTime' : minTime}
+    try:
+        row.update(cutout(h5Path, minTime, outPath, window, fmin, fmax, maxBytes))
+    except (OSError, KeyError, ValueError) as e:
+        row['error'] = str(e)
+    return row
+
+def cutoutPasses(work_dir=None, out_dir=None, window=150, fmin=None, fmax=None, maxBytes=64*2**20, workers=4, overwrite=False):
+    """
+    Make a cutout around every pass found by findSats.
+
+    Parameters
+    ----------
+    work_dir : str, optional
+        work_dir of the findSats run. Passes are taken from its pass index,
+        or files_affected_by_sats.csv for runs without one. Defaults to the
+        current directory.
+    out_dir : str, optional
+        Directory for the cutouts. Defaults to work_dir/cutouts.
+    window : float, default=150
+        Half width in seconds of each cutout, centred on minTime.
+    fmin, fmax : float, optional
+        Frequency limits in MHz. Defaults to the whole band.
+    maxBytes : int, default=64 MiB
+        Upper bound on the size of each block copied.
+    workers : int, default=4
+        Number of cutouts made at once, each in its own process.
+    overwrite : bool, default=False
+        Remake cutouts that already exist.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per pass with 'filepath', 'satellite', 'minTime',
+        'cutoutPath', the copied 'rowStart', 'rowStop', 'chanStart',
+        'chanStop' and an 'error' for passes that could not be cut out.
+        Also written to out_dir as cutouts.csv.
+
+    Examples
+    --------
+    >>> cutouts = cutoutPasses("/output/", window=60, fmin=1600, fmax=1610)
+    """
+    import pandas as pd
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Set work directory, default to current working directory
+    if work_dir is None:
+        work_dir = os.getcwd()
+    if out_dir is None:
+        out_dir = os.path.join(work_dir, CUTOUT_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+
+    tasks, rows = [], []
+    for h5Path, satellite, minTime in _passList(work_dir):
+        outPath = os.path.join(out_dir, cutoutName(h5Path, satellite, minTime))
+        if os.path.exists(outPath) and not overwrite:
+            rows.append({'filepath' : h5Path, 'satellite' : satellite, 'minTime' : minTime, 'cutoutPath' : outPath})
+            continue
+        tasks.append((h5Path, satellite, minTime, outPath, window, fmin, fmax, maxBytes))
+
+    print(f'Cutting out {len(tasks)} passes ({len(rows)} already done)')
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows += list(pool.map(_cutoutTask, tasks))
+    else:
+        rows += [_cutoutTask(task) for task in tasks]
+
+    for row in rows:
+        if 'error' in row:
+            print(f"Could not cut out {row['satellite']} from {row['filepath']}: {row['error']}")
+
+    cutouts = pd.DataFrame(rows, columns=['filepath', 'satellite', 'minTime', 'cutoutPath',
+                                          'rowStart', 'rowStop', 'chanStart', 'chanStop', 'error'])
+    outPath = os.path.join(out_dir, 'cutouts.csv')
+    cutouts.to_csv(outPath)
+    print(f"Cutouts listed in: {outPath}")
+
+    return cutouts
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Copy the data around every satellite pass into small standalone h5 files')
+    parser.add_argument('--work_dir', help='work_dir of the findSats run, defaults to current working directory', default=None)
+    parser.add_argument('--out_dir', help='directory for the cutouts, defaults to work_dir/cutouts', default=None)
+    parser.add_argument('--window', help='half width in seconds of each cutout around the closest approach', default=150, type=float)
+    parser.add_argument('--fmin', help='lowest frequency to keep in MHz', default=None, type=float)
+    parser.add_argument('--fmax', help='highest frequency to keep in MHz', default=None, type=float)
+    parser.add_argument('--chunkMB', help='maximum size in MB of each block copied', default=64, type=float)
+    parser.add_argument('--workers', help='number of cutouts made at once', default=4, type=int)
+    parser.add_argument('--overwrite', help='remake cutouts that already exist', action='store_true')
+    args = parser.parse_args(argv)
+
+    cutoutPasses(args.work_dir, args.out_dir, window=args.window, fmin=args.fmin, fmax=args.fmax,
+                 maxBytes=int(args.chunkMB*2**20), workers=args.workers, overwrite=args.overwrite)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+import os, sys, re, csv, json, fnmatch
+import numpy as np
+import argparse
+
+from .h5Tools import readH5Header
+from .passIndex import noradId
+
+'''
+Known downlink frequencies of satellites, for pruning the catalog by band.
+
+A satellite can only put RFI into an observation if it transmits somewhere
+near the observed band, yet findSats propagates every object in the catalog,
+including Ku band constellations for L band files and debris that transmits
+nothing. A DownlinkTable maps satellites, by NORAD id or by a pattern on their
+name, to their downlink ranges; with it findSats only crossmatches satellites
+transmitting within (or close to) each observation's frequency span, and
+either keeps or drops the satellites the table knows nothing about.
+
+The table shipped in satcheck/data/downlinks.csv covers the main navigation,
+communication and weather systems. Rows from other sources, such as a SatNOGS
+transmitter export, are added to work_dir/downlinks.csv with
+`satcheck downlinks`, which findSats reads as well.
+'''
+
+DOWNLINK_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'downlinks.csv')
+LOCAL_TABLE = 'downlinks.csv'
+COLUMNS = ['norad', 'name', 'fmin_mhz', 'fmax_mhz', 'service']
+# transmitters leak outside their allocations, so keep satellites whose
+# downlinks are within this many MHz of the observed band
+MARGIN_MHZ = 10
+
+def observationSpan(h5Path):
+    """
+    Frequency range of an observation.
+
+    Parameters
+    ----------
+    h5Path : str
+        Path to HDF5 observation file.
+
+    Returns
+    -------
+    tuple of (float, float)
+        Lowest and highest frequency in MHz.
+    """
+    hdr = readH5Header(h5Path)
+    edges = hdr['fch1'] + hdr['foff'] * np.array([-0.5, hdr['nchans'] - 0.5])
+    return float(edges.min()), float(edges.max())
+
+def readTable(path):
+    """
+    Read the rows of a downlink table.
+
+    Parameters
+    ----------
+    path : str
+        CSV file with the columns norad, name, fmin_mhz, fmax_mhz and service.
+        Lines starting with '#' are comments.
+
+    Returns
+    -------
+    list of dict
+        Rows with 'norad' (int or None), 'name' (str or None), 'fmin_mhz' and
+        'fmax_mhz' (float or None) and 'service'.
+    """
+    rows = []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(line for line in f if not line.lstrip().startswith('#')):
+            rows.append({'norad' : int(row['norad']) if row.get('norad') else None,
+                         'name' : row.get('name') or None,
+                         'fmin_mhz' : float(row['fmin_mhz']) if row.get('fmin_mhz') else None,
+                         'fmax_mhz' : float(row['fmax_mhz']) if row.get('fmax_mhz') else None,
+                         'service' : row.get('service', '')})
+    return rows
+
+class DownlinkTable:
+    """
+    Downlink ranges of satellites, from one or more downlink tables.
+
+    Parameters
+    ----------
+    paths : list of str, optional
+        Extra tables read after the one shipped with satcheck.
+    work_dir : str, optional
+        Also read work_dir/downlinks.csv if it exists.
+    keepUnknown : bool, default=True
+        Whether prune keeps satellites that are in none of the tables.
+    margin : float, default=MARGIN_MHZ
+        MHz by which a downlink may miss the observed band and still be kept.
+
+    Examples
+    --------
+    >>> table = DownlinkTable(work_dir="/output/")
+    >>> table.ranges("NAVSTAR 43 (USA 132) 24876")
+    array([[1563.42, 1587.42], ...
+    >>> table.prune(satdict.keys(), 1100, 1900)
+    """
+
+    def __init__(self, paths=None, work_dir=None, keepUnknown=True, margin=MARGIN_MHZ):
+        self.keepUnknown = keepUnknown
+        self.margin = margin
+
+        self.paths = [DOWNLINK_TABLE] + list(paths or [])
+        if work_dir is not None and os.path.exists(os.path.join(work_dir, LOCAL_TABLE)):
+            self.paths.append(os.path.join(work_dir, LOCAL_TABLE))
+
+        self.byNorad = {}
+        patterns = []
+        for path in self.paths:
+            for row in readTable(path):
+                rng = (row['fmin_mhz'], row['fmax_mhz']) if row['fmin_mhz'] is not None else None
+                if row['norad'] is not None:
+                    self.byNorad.setdefault(row['norad'], []).append(rng)
+                elif row['name']:
+                    patterns.append((re.compile(fnmatch.translate(row['name'].upper())), rng))
+        self.patterns = patterns
+        self._cache = {}
+
+    def ranges(self, satellite):
+        """
+        Downlink ranges of a satellite.
+
+        Parameters
+        ----------
+        satellite : str
+            Satellite name as in load_tle ("NAME NORADID").
+
+        Returns
+        -------
+        numpy.ndarray or None
+            (k, 2) array of [fmin, fmax] in MHz, empty for objects known not to
+            transmit, or None if the satellite is in none of the tables.
+        """
+        if satellite in self._cache:
+            return self._cache[satellite]
+
+        norad = noradId(satellite)
+        name = satellite.rsplit(' ', 1)[0] if norad is not None else satellite
+        matches = list(self.byNorad.get(norad, []))
+        matches += [rng for pattern, rng in self.patterns if pattern.match(name.upper())]
+
+        if matches:
+            rngs = np.array([rng for rng in matches if rng is not None], dtype=float).reshape(-1, 2)
+        else:
+            rngs = None
+        self._cache[satellite] = rngs
+        return rngs
+
+    def transmitsIn(self, satellite, fmin, fmax):
+        """
+        Whether a satellite has a downlink within margin of [fmin, fmax] MHz,
+        or None if it is unknown.
+        """
+        rngs = self.ranges(satellite)
+        if rngs is None:
+            return None
+        return bool(np.any((rngs[:, 0] <= fmax + self.margin) & (rngs[:, 1] >= fmin - self.margin)))
+
+    def prune(self, names, fmin, fmax):
+        """
+        Satellites that may transmit within an observation's band.
+
+        Parameters
+        ----------
+        names : iterable of str
+            Satellite names as in load_tle.
+        fmin, fmax : float
+            Observed band in MHz.
+
+        Returns
+        -------
+        list of str
+            Names transmitting within margin of the band, plus the unknown
+            ones if keepUnknown.
+        """
+        keep = []
+        for name in names:
+            inBand = self.transmitsIn(name, fmin, fmax)
+            if inBand or (inBand is None and self.keepUnknown):
+                keep.append(name)
+        return keep
+
+def _satnogsRows(transmitters):
+    # SatNOGS DB transmitters: frequencies in Hz, one entry per transmitter
+    rows = []
+    for tx in transmitters:
+        if not tx.get('norad_cat_id') or not tx.get('downlink_low') or tx.get('status') == 'invalid':
+            continue
+        low = tx['downlink_low'] / 1e6
+        high = (tx.get('downlink_high') or tx['downlink_low']) / 1e6
+        rows.append({'norad' : int(tx['norad_cat_id']), 'name' : None, 'fmin_mhz' : min(low, high),
+                     'fmax_mhz' : max(low, high), 'service' : tx.get('description', '')})
+    return rows
+
+def ingest(source, work_dir=None, out=None):
+    """
+    Add the downlinks of a local file to a downlink table.
+
+    Parameters
+    ----------
+    source : str
+        A CSV with the columns of the downlink table, or a SatNOGS DB
+        transmitter export (JSON, https://db.satnogs.org/api/transmitters/).
+    work_dir : str, optional
+        Directory of the table, work_dir/downlinks.csv, read by findSats.
+        Defaults to the current directory.
+    out : str, optional
+        Table to add to instead.
+
+    Returns
+    -------
+    int
+        Number of new rows.
+    """
+    # Set work directory, default to current working directory
+    if work_dir is None:
+        work_dir = os.getcwd()
+    if out is None:
+        out = os.path.join(work_dir, LOCAL_TABLE)
+
+    if source.endswith('.json'):
+        with open(source) as f:
+            new = _satnogsRows(json.load(f))
+    else:
+        new = readTable(source)
+
+    def key(row):
+        return (row['norad'], row['name'], row['fmin_mhz'], row['fmax_mhz'])
+
+    rows = readTable(out) if os.path.exists(out) else []
+    seen = {key(row) for row in rows}
+    added = 0
+    for row in new:
+        if key(row) not in seen:
+            seen.add(key(row))
+            rows.append(row)
+            added += 1
+
+    tmpPath = f'{out}.{os.getpid()}.tmp'
+    with open(tmpPath, 'w', newline='') as f:
+        writer = csv.DictWriter(f, COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({col : '' if row[col] is None else row[col] for col in COLUMNS})
+    os.replace(tmpPath, out)
+
+    print(f'Added {added} downlinks to {out}')
+    return added
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Add known satellite downlinks to the table findSats --prune_bands reads, or look satellites up in it')
+    parser.add_argument('sources', help='CSV tables or SatNOGS transmitter JSON exports to add', nargs='*')
+    parser.add_argument('--work_dir', help='directory of the local table (downlinks.csv), defaults to current working directory', default=None)
+    parser.add_argument('--lookup', help='print the downlinks of these satellites ("NAME NORADID")', nargs='+', default=None)
+    args = parser.parse_args(argv)
+
+    for source in args.sources:
+        ingest(source, work_dir=args.work_dir)
+
+    if args.lookup:
+        table = DownlinkTable(work_dir=args.work_dir if args.work_dir else os.getcwd())
+        for satellite in args.lookup:
+            rngs = table.ranges(satellite)
+            if rngs is None:
+                print(f'{satellite}: unknown')
+            elif len(rngs) == 0:
+                print(f'{satellite}: no downlinks')
+            else:
+                print(f'{satellite}: ' + ', '.join(f'{lo:g}-{hi:g} MHz' for lo, hi in rngs))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,367 @@
+import os, sys, json, shutil
+from datetime import datetime
+import numpy as np
+import argparse
+import ephem
+
+from .sgp4Tools import GBT_SITE, readTLELines, satrecArray, topocentricVectors, vectorsToRaDec
+from .findSatsHelper import angularSeparation, parseRaDec, load_tle, separation, convert, precessionMatrix, rotateRaDec
+
+'''
+Per-day, per-site ephemeris cache.
+
+Every observation on a given night propagates the same satellites from the
+same TLE file. The cache propagates each satellite once with sgp4 and fits
+its position relative to the site (TEME, km) over the day with piecewise
+Chebyshev polynomials, one segment per hour by default. Evaluating a position
+at any time is then a polynomial evaluation for the whole catalog at once.
+
+The fit is checked against sgp4 between the interpolation nodes when the cache
+is built and the largest angular error is recorded; satellites whose error is
+above the tolerance are marked and cachedSeparation computes them directly
+with PyEphem instead.
+
+The tolerance is relative to sgp4, not to separation(). The cache positions
+are in TEME, so cachedSeparation precesses the J2000 target to the date of
+each observation. The sgp4 package and PyEphem's older propagator still
+disagree: on the synthetic benchmark catalog, separations from the cache
+differ from separation() by a few thousandths of a degree for low orbits
+and by up to about 0.07 degrees for satellites at GNSS altitudes. That is
+enough to move a sample across a threshold or a pass across a narrow tier.
+
+On disk a cache is a directory under work_dir/ephem_cache with
+- coeffs.npy : float64 (nsegments, nsats, 3, degree+1), memory-mapped when read
+- names.npy : satellite names, as in load_tle
+- maxError.npy : largest angular fit error of each satellite in degrees
+- meta.json : time span, segment length, degree, site, tolerance and the TLE
+  file it was built from
+'''
+
+CACHE_DIR = 'ephem_cache'
+
+DEFAULT_SEGMENT = 3600 # s
+DEFAULT_DEGREE = 16
+DEFAULT_TOLERANCE = 1e-3 # degrees
+
+# extra time covered after the end of the day, for observations running past midnight
+DEFAULT_OVERLAP = 3600 # s
+
+def siteKey(site):
+    """
+    Short string identifying a site in cache directory names.
+    """
+    return f"{site['lat']:.4f}_{site['lon']:.4f}_{site['elevation']:.0f}"
+
+def cachePath(tle_file, site=GBT_SITE, work_dir=None):
+    """
+    Directory of the ephemeris cache for a TLE file and site.
+    """
+    if work_dir is None:
+        work_dir = os.getcwd()
+    name = os.path.splitext(os.path.basename(tle_file))[0]
+    return os.path.join(work_dir, CACHE_DIR, f'{name}_{siteKey(site)}')
+
+def tleDay(tle_file):
+    """
+    MJD of the start of the UTC day a TLE file from downloadTLEs is named after.
+    """
+    date = datetime.strptime(os.path.basename(tle_file)[:11], '%b_%d_%Y')
+    return float((date - datetime(1858, 11, 17)).days)
+
+def _tleSignature(tle_file):
+    stat = os.stat(tle_file)
+    return {'tle_file' : os.path.abspath(tle_file), 'tle_size' : stat.st_size, 'tle_mtime' : stat.st_mtime}
+
+def buildEphemCache(tle_file, site=GBT_SITE, work_dir=None, start_mjd=None, segment=DEFAULT_SEGMENT,
+                    degree=DEFAULT_DEGREE, tolerance=DEFAULT_TOLERANCE, overlap=DEFAULT_OVERLAP):
+    """
+    Fit and write the ephemeris cache of one TLE file for one site.
+
+    Parameters
+    ----------
+    tle_file : str
+        TLE file written by downloadTLEs.
+    site : dict, default=GBT_SITE
+        Observer 'lat', 'lon' (degrees) and 'elevation' (m).
+    work_dir : str, optional
+        The cache is written to work_dir/ephem_cache. If None, uses current
+        working directory.
+    start_mjd : float, optional
+        Start of the covered span. Defaults to the start of the UTC day the
+        TLE file is named after.
+    segment : float, default=3600
+        Length in seconds of each Chebyshev segment.
+    degree : int, default=16
+        Degree of the Chebyshev polynomials.
+    tolerance : float, default=0.001
+        Largest acceptable angular fit error in degrees.
+    overlap : float, default=3600
+        Seconds covered beyond the end of the day.
+
+    Returns
+    -------
+    str
+        The cache directory.
+    """
+    from numpy.polynomial import chebyshev
+
+    if start_mjd is None:
+        start_mjd = tleDay(tle_file)
+
+    path = cachePath(tle_file, site, work_dir)
+    tmpPath = f'{path}.{os.getpid()}.tmp'
+    os.makedirs(tmpPath, exist_ok=True)
+
+    names, sats, allSats = satrecArray(readTLELines(tle_file))
+    nsegments = int(np.ceil((86400 + overlap) / segment))
+    ncoeffs = degree + 1
+
+    # interpolate at the Chebyshev nodes and check half way between them
+    nodes = np.cos(np.pi * (np.arange(ncoeffs) + 0.5) / ncoeffs)[::-1]
+    checks = (nodes[1:] + nodes[:-1]) / 2
+    checks = np.concatenate([[-1], checks, [1]])
+    solve = np.linalg.inv(chebyshev.chebvander(nodes, degree))
+    checkVander = chebyshev.chebvander(checks, degree)
+
+    coeffs = np.lib.format.open_memmap(os.path.join(tmpPath, 'coeffs.npy'), mode='w+', dtype=np.float64,
+                                       shape=(nsegments, len(names), 3, ncoeffs))
+    maxError = np.zeros(len(names))
+
+    for seg in range(nsegments):
+        t0 = start_mjd + seg * segment / 86400
+        topo, _, err = topocentricVectors(allSats, t0 + (nodes + 1) / 2 * segment / 86400, site)
+        coef = np.einsum('kn,snc->sck', solve, topo)
+        coeffs[seg] = coef
+
+        truth, _, checkErr = topocentricVectors(allSats, t0 + (checks + 1) / 2 * segment / 86400, site)
+        fit = np.einsum('mk,sck->smc', checkVander, coef)
+        with np.errstate(invalid='ignore'):
+            error = np.rad2deg(np.linalg.norm(fit - truth, axis=-1) / np.linalg.norm(truth, axis=-1)).max(axis=1)
+
+        # satellites sgp4 cannot propagate are never served from the cache
+        failed = (err != 0).any(axis=1) | (checkErr != 0).any(axis=1) | np.isnan(error)
+        maxError = np.maximum(maxError, np.where(failed, np.inf, error))
+
+    coeffs.flush()
+    del coeffs
+
+    np.save(os.path.join(tmpPath, 'names.npy'), np.asarray(names, dtype=str))
+    np.save(os.path.join(tmpPath, 'maxError.npy'), maxError)
+
+    good = maxError <= tolerance
+    meta = {'version' : 1,
+            'start_mjd' : float(start_mjd),
+            'segment' : float(segment),
+            'nsegments' : nsegments,
+            'degree' : degree,
+            'site' : site,
+            'tolerance' : tolerance,
+            'max_error_deg' : float(maxError[good].max()) if good.any() else None,
+            'nsats' : len(names),
+            'nsats_exact' : int((~good).sum())}
+    meta.update(_tleSignature(tle_file))
+    with open(os.path.join(tmpPath, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    # swap the finished cache into place
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmpPath, path)
+
+    print(f"Ephemeris cache for {len(names)} satellites saved to: {path} "
+          f"(max error {meta['max_error_deg']} deg, {meta['nsats_exact']} satellites above {tolerance} deg)")
+    return path
+
+class EphemCache:
+    """
+    Memory-mapped ephemeris cache written by buildEphemCache.
+
+    Parameters
+    ----------
+    path : str
+        Cache directory.
+
+    Attributes
+    ----------
+    names : numpy.ndarray
+        Satellite names, as in load_tle.
+    maxError : numpy.ndarray
+        Largest angular fit error (degrees) of each satellite.
+    exact : numpy.ndarray
+        Boolean mask of satellites whose fit error is above the tolerance and
+        which have to be propagated directly.
+    meta : dict
+        Contents of meta.json.
+
+    Examples
+    --------
+    >>> cache = EphemCache(cachePath("may_31_2020_TLEs.txt"))
+    >>> ra, dec = cache.raDec(59000.2 + np.arange(1, 301) / 86400)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+        self.coeffs = np.load(os.path.join(path, 'coeffs.npy'), mmap_mode='r')
+        self.names = np.load(os.path.join(path, 'names.npy'))
+        self.maxError = np.load(os.path.join(path, 'maxError.npy'))
+        self.exact = ~(self.maxError <= self.meta['tolerance'])
+
+        self.start_mjd = self.meta['start_mjd']
+        self.segment = self.meta['segment']
+        self.stop_mjd = self.start_mjd + self.meta['nsegments'] * self.segment / 86400
+
+    def __len__(self):
+        return len(self.names)
+
+    def isValid(self, tle_file, segment=DEFAULT_SEGMENT, degree=DEFAULT_DEGREE, tolerance=DEFAULT_TOLERANCE):
+        """
+        Whether the cache was built from this TLE file, unchanged, with these settings.
+        """
+        if not os.path.exists(tle_file):
+            return False
+        signature = _tleSignature(tle_file)
+        return (all(self.meta.get(key) == value for key, value in signature.items())
+                and self.meta['segment'] == segment and self.meta['degree'] == degree
+                and self.meta['tolerance'] == tolerance)
+
+    def rows(self, names):
+        """
+        Indices of the named satellites in the cache; unknown names are ignored.
+        """
+        if not hasattr(self, '_rows'):
+            self._rows = {str(name) : ii for ii, name in enumerate(self.names)}
+        return np.array(sorted(self._rows[name] for name in names if name in self._rows), dtype=int)
+
+    def positions(self, mjds, rows=None):
+        """
+        Position (km) of every satellite (or only the given rows) relative to
+        the site at the given times.
+
+        Returns
+        -------
+        numpy.ndarray
+            Shape (nsats, ntimes, 3).
+
+        Raises
+        ------
+        ValueError
+            If a time is outside the span covered by the cache.
+        """
+        from numpy.polynomial import chebyshev
+
+        mjds = np.atleast_1d(np.asarray(mjds, dtype=float))
+        seconds = (mjds - self.start_mjd) * 86400
+        seg = np.floor(seconds / self.segment).astype(int)
+        if seg.min() < 0 or seg.max() >= self.meta['nsegments']:
+            raise ValueError(f'Times outside the span of the ephemeris cache {self.path}')
+
+        x = 2 * (seconds - seg * self.segment) / self.segment - 1
+        out = np.empty((len(self.names) if rows is None else len(rows), len(mjds), 3))
+        for s in np.unique(seg):
+            cols = np.flatnonzero(seg == s)
+            coeffs = self.coeffs[s] if rows is None else self.coeffs[s, rows]
+            out[:, cols] = np.einsum('mk,sck->smc', chebyshev.chebvander(x[cols], self.meta['degree']), coeffs)
+        return out
+
+    def raDec(self, mjds, rows=None):
+        """
+        Topocentric RA and Dec (radians) of every satellite (or only the given
+        rows), each (nsats, ntimes).
+        """
+        ra, dec, _ = vectorsToRaDec(self.positions(mjds, rows))
+        return ra, dec
+
+def ephemCache(tle_file, site=GBT_SITE, work_dir=None, start_mjd=None, segment=DEFAULT_SEGMENT,
+               degree=DEFAULT_DEGREE, tolerance=DEFAULT_TOLERANCE):
+    """
+    Open the ephemeris cache of a TLE file, building it first if it is missing
+    or out of date.
+
+    Returns
+    -------
+    EphemCache
+    """
+    path = cachePath(tle_file, site, work_dir)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        cache = EphemCache(path)
+        if cache.isValid(tle_file, segment, degree, tolerance) and (start_mjd is None or cache.start_mjd <= start_mjd < cache.stop_mjd):
+            return cache
+
+    buildEphemCache(tle_file, site, work_dir, start_mjd=start_mjd, segment=segment, degree=degree, tolerance=tolerance)
+    return EphemCache(path)
+
+def cachedSeparation(cache, tle_file, ra_obs, dec_obs, start_mjd, gbt, threshold=3, duration=300, names=None):
+    """
+    Same as separation(), with positions taken from an ephemeris cache.
+
+    Parameters
+    ----------
+    cache : EphemCache
+        Cache covering the observation.
+    tle_file : str
+        The TLE file the cache was built from; satellites the cache could not
+        fit within its tolerance are loaded from it and computed directly.
+    ra_obs, dec_obs : str
+        Target coordinates as in separation().
+    start_mjd : float
+        Observation start time (MJD).
+    gbt : ephem.Observer
+        Observer used for the directly computed satellites.
+    threshold : float, default=3
+        Separation in degrees below which a satellite is reported.
+    duration : int, default=300
+        Seconds after the start to check, one sample per second.
+    names : list of str, optional
+        Only check these satellites (e.g. the ones a VisibilityIndex reports
+        as up). Defaults to all of them.
+
+    Returns
+    -------
+    dict
+        Same structure as separation().
+    """
+    # the cache is in TEME: precess the J2000 target to the date rather than every sample back
+    toDate = precessionMatrix(start_mjd)
+    raRad, decRad = rotateRaDec(*parseRaDec(ra_obs, dec_obs), toDate)
+    offsets = np.arange(1, duration + 1)
+    rows = np.arange(len(cache)) if names is None else cache.rows(names)
+
+    ra, dec = cache.raDec(start_mjd + offsets / 86400, rows)
+    sep = np.rad2deg(angularSeparation(ra, dec, raRad, decRad))
+    exact = cache.exact[rows]
+    close = (sep < threshold) & ~exact[:, None]
+
+    sat_hit_dict = {}
+    for ii in np.flatnonzero(close.any(axis=1)):
+        mask = close[ii]
+        raJ2000, decJ2000 = rotateRaDec(ra[ii, mask], dec[ii, mask], toDate.T)
+        sat_hit_dict[str(cache.names[rows[ii]])] = {'RA' : [str(ephem.hours(x)) for x in raJ2000],
+                                                    'DEC' : [str(ephem.degrees(x)) for x in decJ2000],
+                                                    'Separation' : sep[ii, mask].tolist(),
+                                                    'Time after start' : offsets[mask].tolist()}
+
+    if exact.any():
+        exactNames = set(str(name) for name in cache.names[rows[exact]])
+        tle = {name : sat for name, sat in load_tle(tle_file).items() if name in exactNames}
+        sat_hit_dict.update(separation(tle, ra_obs, dec_obs, convert(start_mjd), gbt, threshold))
+
+    return sat_hit_dict
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Build the per-day ephemeris cache of TLE files')
+    parser.add_argument('tle_files', help='TLE files written by findSats/downloadTLEs', nargs='+')
+    parser.add_argument('--work_dir', help='directory to write ephem_cache/ to, defaults to current working directory', default=None)
+    parser.add_argument('--segment', help='length in seconds of each Chebyshev segment', default=DEFAULT_SEGMENT, type=float)
+    parser.add_argument('--degree', help='degree of the Chebyshev polynomials', default=DEFAULT_DEGREE, type=int)
+    parser.add_argument('--tolerance', help='largest acceptable fit error in degrees', default=DEFAULT_TOLERANCE, type=float)
+    args = parser.parse_args(argv)
+
+    for tle_file in args.tle_files:
+        buildEphemCache(tle_file, work_dir=args.work_dir, segment=args.segment, degree=args.degree, tolerance=args.tolerance)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import os, time
+from contextlib import contextmanager
+
+'''
+Cross-process locks and atomic writes for files shared through work_dir.
+
+Several findSats runs (or a run and the crossmatch service) may share a
+work_dir. Every file that is expensive to make, like a day's TLEs, is made
+under an exclusive lock on a sidecar lock file: the first process to take it
+does the work, the others wait for it and then find the finished file.
+
+Files are written to a temporary name in the same directory and renamed into
+place, so a reader sees either no file or the whole file, never a partial
+one, even if the writer is killed.
+
+Lock files live in a hidden .locks directory next to the files they guard
+and are never deleted, because removing a lock file another process has open
+would let a third process lock a different file of the same name.
+'''
+
+LOCK_DIR = '.locks'
+POLL_INTERVAL = 0.1 # s, between attempts when waiting with a timeout or without flock
+
+def lockPath(path):
+    """
+    Path of the lock file guarding path.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, LOCK_DIR, name + '.lock')
+
+@contextmanager
+def fileLock(path, timeout=None):
+    """
+    Hold an exclusive lock on path for the duration of a with block.
+
+    The lock is advisory: it only excludes other code that takes the same
+    lock. It is released if the process dies.
+
+    Parameters
+    ----------
+    path : str
+        File to lock. It does not need to exist.
+    timeout : float, optional
+        Seconds to wait for the lock before raising TimeoutError. By default
+        waits for as long as it takes.
+
+    Examples
+    --------
+    >>> with fileLock("may_31_2020_TLEs.txt"):
+    ...     if not os.path.exists("may_31_2020_TLEs.txt"):
+    ...         download()
+    """
+    lock = lockPath(path)
+    os.makedirs(os.path.dirname(lock), exist_ok=True)
+
+    fd = os.open(lock, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _acquire(fd, lock, timeout)
+        try:
+            yield lock
+        finally:
+            _release(fd)
+    finally:
+        os.close(fd)
+
+def _acquire(fd, lock, timeout):
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+
+    if fcntl is not None and timeout is None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+
+    start = time.monotonic()
+    while True:
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                import msvcrt
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(f'Timed out after {timeout} s waiting for lock {lock}')
+        time.sleep(POLL_INTERVAL)
+
+def _release(fd):
+    try:
+        import fcntl
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    except ImportError:
+        import msvcrt
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def atomicWrite(path, mode='w'):
+    """
+    Open a temporary file that replaces path when the with block finishes.
+
+    If the block raises, the temporary file is removed and path is left as
+    it was.
+
+    Parameters
+    ----------
+    path : str
+        File to write.
+    mode : str, default='w'
+        'w' for text or 'wb' for bytes.
+
+    Examples
+    --------
+    >>> with atomicWrite("may_31_2020_TLEs.txt") as f:
+    ...     f.write(text)
+    """
+    tmpPath = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmpPath, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpPath, path)
+    except BaseException:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+        raise
@@ -1,10 +1,11 @@
 import os, sys
 import numpy as np
-import pandas as pd
 import pickle
 import argparse
 
-def findGPSTargs(e):
+from .flaggedFiles import flaggedPath, FlaggedFiles
+
+def findGPSTargs(e, path=None):
     """
     Identify observation files with flagged frequencies in GPS L1 band.
     
@@ -17,6 +18,11 @@ def findGPSTargs(e):
     e : float
         Epsilon tolerance in MHz around the 1600 MHz center frequency.
         Files with flagged frequencies in the range [1600-e, 1600+e] MHz are returned.
+    path : str, optional
+        Path to the flagged-files database. Either a columnar store written by
+        flaggedFiles.convertFlaggedPickle (memory-mapped, opens instantly) or a
+        legacy .pkl file. If None, uses the SATCHECK_FLAGGED_FILES environment
+        variable and then '/home/ubuntu/scratch/flagged_files_2SD.flagged'.
         
     Returns
     -------
@@ -26,10 +32,10 @@ def findGPSTargs(e):
         
     Notes
     -----
-    - Reads from hardcoded pickle file: '/home/ubuntu/scratch/flagged_files_2SD.pkl'
+    - Legacy .pkl databases are fully unpickled on every call; convert them once
+      with `python -m satcheck.flaggedFiles flagged_files_2SD.pkl`
     - GPS L1 band is centered around 1575.42 MHz, but uses 1600 MHz as reference
     - Flagged frequencies indicate detected interference or anomalies
-    - File path is specific to the original analysis environment
     
     Examples
     --------
@@ -42,7 +48,10 @@ def findGPSTargs(e):
     
     >>> gps_files = findGPSTargs(5.0)  # ±5 MHz around 1600 MHz
     """
-    file = '/home/ubuntu/scratch/flagged_files_2SD.pkl'
+    file = flaggedPath(path)
+
+    if not file.endswith('.pkl'):
+        return FlaggedFiles(file).fileNamesInRange(1600-e, 1600+e)
 
     with open(file, "rb") as f:
         flaggedFiles = pickle.load(f)
@@ -60,13 +69,14 @@ def findGPSTargs(e):
     #print(gpsFiles)
     return gpsFiles
 
-def main():
+def main(argv=None):
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--epsilon', default=10)
-    args = parser.parse_args()
+    parser.add_argument('--flagged', help='flagged files store (or legacy .pkl), defaults to $SATCHECK_FLAGGED_FILES', default=None)
+    args = parser.parse_args(argv)
 
-    gps = findGPSTargs(float(args.epsilon))
+    gps = findGPSTargs(float(args.epsilon), path=args.flagged)
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -5,43 +5,39 @@ see: https://github.com/stevecroft/bl-interns/blob/master/chrismurphy/find_satel
 
 import os, sys
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 import argparse
 
-import ephem
-
 from .findSatsHelper import *
 from .genPlotsAll import plotSep
-
-def io(n, work_dir=None):
+from .metrics import stage, count, useMetrics, addMetricsArgs, metricsFromArgs, writeMetricsFromArgs
+from .shards import parseShard, shardDir, partitionByDate, writeShardManifest
+from .ephemCache import ephemCache, cachedSeparation
+from .visibility import visibilityIndex, minElevation
+from .passIndex import PassIndex
+from .queryPlanner import defaultPlanner
+from .downlinks import DownlinkTable, observationSpan
+from .tiers import SeparationTiers
+from .selection import SatelliteSelector
+from .sites import DEFAULT_SITE, siteOfTelescope, siteNamed, siteObserver
+from .memo import CrossmatchMemo
+
+def ucsCatalog(work_dir=None):
     """
-    Get NORAD IDs from UCS database, filtered for satellites likely to have historical data.
-    
-    This function downloads the UCS (Union of Concerned Scientists) Satellite Database
-    and extracts NORAD catalog numbers for satellites that are likely to have historical
-    TLE (Two-Line Element) data available from Space-Track.org.
-    
+    Download the UCS database and keep the satellites likely to have historical TLEs.
+
     Parameters
     ----------
-    n : int
-        Number of partitions to split the satellite ID list into for efficient querying.
-        Higher values may be less efficient for Space Track API calls.
     work_dir : str, optional
         Directory to store downloaded database files. If None, uses current working directory.
-        
+
     Returns
     -------
-    list of numpy.ndarray
-        List containing n arrays, each with NORAD catalog numbers for querying.
-        The arrays are roughly equal in size to balance query loads.
-        
-    Notes
-    -----
-    The function filters satellites to focus on those launched before 2022, as these
-    are more likely to have historical TLE data available for retrospective analysis
-    of older observation data.
+    pandas.DataFrame
+        The UCS catalog rows with a valid NORAD number, launched before 2022
+        (or at an unknown date).
     """
+    import pandas as pd
+
     # read in the UCS Satellite Database for complete list of satellites
     df = pd.read_csv(queryUCS(work_dir=work_dir))
     
@@ -59,8 +55,47 @@ def io(n, work_dir=None):
             print(f"Filtered to {len(df)} satellites launched before 2022 (or unknown launch date)")
         except:
             print("Could not filter by launch date, using all satellites")
+
+    return df
+
+def io(n=None, work_dir=None, selector=None):
+    """
+    Get NORAD IDs from UCS database, filtered for satellites likely to have historical data.
     
-    idList = np.array(df['NORAD Number'].tolist())
+    This function downloads the UCS (Union of Concerned Scientists) Satellite Database
+    and extracts NORAD catalog numbers for satellites that are likely to have historical
+    TLE (Two-Line Element) data available from Space-Track.org.
+    
+    Parameters
+    ----------
+    n : int, optional
+        Number of partitions to split the satellite ID list into. If None the
+        whole list is returned as one array, for the query planner to batch.
+    work_dir : str, optional
+        Directory to store downloaded database files. If None, uses current working directory.
+    selector : SatelliteSelector, optional
+        Only the satellites it selects (see satcheck.selection). The UCS
+        database is not downloaded if it only lists NORAD ids.
+        
+    Returns
+    -------
+    list of numpy.ndarray
+        List containing n arrays (one if n is None), each with NORAD catalog numbers
+        for querying. The arrays are roughly equal in size to balance query loads.
+        
+    Notes
+    -----
+    The function filters satellites to focus on those launched before 2022, as these
+    are more likely to have historical TLE data available for retrospective analysis
+    of older observation data.
+    """
+    import pandas as pd
+
+    if selector is not None:
+        idList = selector.noradIds(work_dir)
+    else:
+        df = ucsCatalog(work_dir)
+        idList = np.array(df['NORAD Number'].tolist())
     
     # Remove any invalid IDs (NaN, negative, etc.)
     idList = idList[~pd.isna(idList)]
@@ -68,25 +103,29 @@ def io(n, work_dir=None):
     
     print(f"Total satellite IDs to query: {len(idList)}")
     
+    if n is None:
+        return [idList]
     return np.array_split(idList, n)
 
-def downloadTLEs(list_of_filenames, n, spacetrack_account=None, spacetrack_password=None, work_dir=None):
+def downloadTLEs(list_of_filenames, n=None, spacetrack_account=None, spacetrack_password=None, work_dir=None, start_time_mjd=None, overwrite=False, norad_ids=None, selector=None):
     """
     Download Two-Line Element (TLE) data from Space-Track.org for satellite analysis.
     
     This function queries the Space-Track.org database to download TLE data for all
-    satellites that might interfere with radio astronomy observations. It partitions
-    the satellite catalog into manageable chunks and downloads TLEs for the time
-    periods corresponding to the input observation files.
+    satellites that might interfere with radio astronomy observations. It splits
+    the satellite catalog into as few queries as Space-Track's limits allow (see
+    queryPlanner) and downloads TLEs for the time periods corresponding to the
+    input observation files.
     
     Parameters
     ----------
     list_of_filenames : list of str
         List of HDF5 file paths containing radio astronomy observation data.
         The observation timestamps from these files determine the TLE query dates.
-    n : int
-        Number of partitions to split the satellite catalog into for efficient querying.
-        Typically 10 is optimal; lower values may overload Space-Track.org API.
+    n : int, optional
+        Split the satellite catalog into exactly n queries instead of letting the
+        query planner choose, as older versions did. Queries that fail are still
+        split and retried.
     spacetrack_account : str, optional
         Space-Track.org account username (usually email address).
         If None, reads from SPACETRACK_ACCT environment variable.
@@ -96,6 +135,20 @@ def downloadTLEs(list_of_filenames, n, spacetrack_account=None, spacetrack_passw
     work_dir : str, optional
         Directory to store downloaded TLE files and temporary data.
         If None, uses current working directory.
+    start_time_mjd : list of float, optional
+        Observation start times (MJD) matching list_of_filenames. If None they
+        are read from the file headers once. Pass these with an empty file list
+        to download TLEs for arbitrary dates.
+    overwrite : bool, default=False
+        Download days whose combined TLE file already exists again.
+    norad_ids : list of numpy.ndarray, optional
+        NORAD ids as returned by io(n), to avoid downloading the UCS database
+        again when called once per day. Fetched with io(n) the first time they
+        are needed if None.
+    selector : SatelliteSelector, optional
+        Only download the satellites it selects, into TLE files named after
+        the selection. Days whose full TLE file is already in work_dir are
+        not downloaded.
         
     Returns
     -------
@@ -112,37 +165,19 @@ def downloadTLEs(list_of_filenames, n, spacetrack_account=None, spacetrack_passw
     -----
     - Requires valid Space-Track.org account credentials
     - Downloads are rate-limited to comply with Space-Track.org API policies  
+    - Query sizes are planned from the URL length limit, the expected response
+      size and the remaining hourly query budget, and failed queries are halved
+      and retried
     - TLE files are cached locally to avoid repeated downloads for the same dates
     - Files are named using the format: {month}_{day}_{year}_TLEs.txt
+    - Each day is downloaded under a lock on its combined file, so when several
+      processes share work_dir one of them downloads it and the others wait and
+      reuse the result. Combined files are written atomically.
+    - If Space-Track keeps failing for some satellites, their day is still
+      written but marked with a .incomplete file listing them, and the next
+      call downloads it again.
     """
 
-    noradIds = io(n, work_dir=work_dir)
-
-    # get relevant TLEs
-    allTLEfiles = []
-    for idx, nIds in enumerate(noradIds):
-        # get comma separated string of relevant ids to get the TLEs
-        ids = ','.join(str(i) for i in nIds)  # Remove trailing comma
-        tles = query_space_track(list_of_filenames, ids, idx, spacetrack_account=spacetrack_account, spacetrack_password=spacetrack_password, work_dir=work_dir)
-        allTLEfiles.append(tles)
-
-    # rewrite all TLEs ase unique files
-    baseNames = []
-    for lis in allTLEfiles:
-        for f in lis:
-            baseNames.append(f[:-6])
-    baseNames = np.unique(np.array(baseNames))
-
-    sepTLEs = {}
-    for name in baseNames:
-        for lis in allTLEfiles:
-            for f in lis:
-                if f[:-6] == name:
-                    if name in sepTLEs:
-                        sepTLEs[name].append(f)
-                    else:
-                        sepTLEs[name] = [f]
-
     # Set work directory, default to current working directory  
     if work_dir is None:
         work_dir = os.getcwd()
@@ -150,19 +185,298 @@ def downloadTLEs(list_of_filenames, n, spacetrack_account=None, spacetrack_passw
     # Ensure work_dir exists
     os.makedirs(work_dir, exist_ok=True)
 
-    for key in sepTLEs.keys():
-        combined_file_path = os.path.join(work_dir, f"{key}.txt")
-        with open(combined_file_path, "wb") as outfile:
-            for f in sepTLEs[key]:
-                if os.path.exists(f):
-                    with open(f, "rb") as infile:
-                        outfile.write(infile.read())
+    # read the start times once instead of once per partition
+    if start_time_mjd is None:
+        start_time_mjd = pull_relevant_header_info(list_of_filenames)[0]
+
+    # one observation start time per day, keyed by the combined TLE file
+    days = {}
+    for mjd in start_time_mjd:
+        days.setdefault(_tleFile(mjd, work_dir, selector), mjd)
+
+    noradIds = norad_ids
+    for combined_file_path, mjd in days.items():
+        incomplete = _incompletePath(combined_file_path)
+        stamp = os.path.getmtime(combined_file_path) if os.path.isfile(combined_file_path) else None
+        stale = overwrite or os.path.isfile(incomplete)
+        with fileLock(combined_file_path):
+            # another process may have made (or remade) this day while we waited
+            if os.path.isfile(combined_file_path) and (not stale or os.path.getmtime(combined_file_path) != stamp):
+                count('tle_cache_hits')
+                continue
+
+            if noradIds is None:
+                noradIds = io(n, work_dir=work_dir, selector=selector)
+
+            # get relevant TLEs, in as few queries as the planner can manage unless n is fixed
+            chunks, failed = defaultPlanner().download(np.concatenate(noradIds), mjd, spacetrack_account, spacetrack_password, work_dir=work_dir,
+                                               overwrite=overwrite, batches=noradIds if n is not None else None,
+                                               tag=selector.tag if selector is not None else None)
+
+            # nothing downloaded, e.g. Space-Track unreachable: leave the day to be retried
+            if not any(os.path.exists(f) for f in chunks):
+                print(f'Warning: no TLEs downloaded for {combined_file_path}')
+                continue
+
+            # rewrite all TLEs as one file per day
+            with atomicWrite(combined_file_path, 'wb') as outfile:
+                for f in chunks:
+                    with fileLock(f):
+                        if os.path.exists(f):
+                            with open(f, "rb") as infile:
+                                outfile.write(infile.read())
+
+            # a day with satellites missing is used by this run but downloaded again by the next
+            if len(failed) > 0:
+                with atomicWrite(incomplete) as f:
+                    f.write(','.join(str(i) for i in failed) + '\n')
+                print(f'Warning: {len(failed)} satellites missing from {combined_file_path}, it will be downloaded again by the next run')
+            elif os.path.exists(incomplete):
+                os.remove(incomplete)
+
+            # the chunks are only removed once the combined file is in place, and
+            # under their own locks so a process still reading one is not disturbed
+            for f in chunks:
+                with fileLock(f):
+                    if os.path.exists(f):
+                        os.remove(f)
+
+    return np.array(sorted(days))
+
+def _incompletePath(combined_file_path):
+    # NORAD ids missing from a combined TLE file whose download was given up on
+    return combined_file_path + '.incomplete'
+
+def _tleFile(mjd, work_dir, selector=None):
+    # the day's full TLE file if there is one, otherwise the selection's own
+    full = tle_filename(mjd, work_dir)
+    if selector is None or os.path.isfile(full):
+        return full
+    return tle_filename(mjd, work_dir, selector.tag)
+
+def gbtObserver():
+    """
+    ephem Observer at the Green Bank Telescope.
+    """
+    return siteObserver(DEFAULT_SITE)
+
+def _fileSite(fil_file, telescope_id, site=None):
+    # observatory of an observation: the one forced for the run, otherwise its header's
+    return site if site is not None else siteOfTelescope(telescope_id, h5Path=fil_file)
+
+def _observationSpan(fil_file, downlinks, tiers):
+    # frequency range of an observation, if band pruning or a beam tier needs it
+    if downlinks is not None or (tiers is not None and tiers.needsFrequency):
+        return observationSpan(fil_file)
+    return None
+
+def _crossmatchFile(dd, ra, dec, tles, work_dir, observers, caches, indices, ephem_cache, visibility, downlinks=None, span=None, tiers=None, selector=None, site=None, memo=None):
+    # passes of one observation, or None if its TLEs are missing
+
+    date = convert(dd)
+
+    # observer, ephemeris caches and visibility indices are shared by every file of a site
+    if site is None:
+        site = DEFAULT_SITE
+    if site['name'] not in observers:
+        observers[site['name']] = siteObserver(site)
+    observer = observers[site['name']]
+
+    # crossmatch out to the widest tier and tag the passes afterwards
+    radii = tiers.radii(span[0] if span is not None else None, site.get('diameter')) if tiers is not None else None
+    threshold = tiers.threshold(radii) if tiers is not None else 3
+
+    # Construct full path for filename matching
+    full_filename = _tleFile(dd, work_dir, selector)
+    filename = os.path.basename(full_filename)
+    key = (full_filename, site['name'])
+
+    # figure out which tle to compare to
+    whichTLE = np.where(full_filename == tles)[0]
+
+    # a selection's own TLE file only holds selected satellites, a full one needs filtering
+    if selector is not None and full_filename != tle_filename(dd, work_dir):
+        selector = None
+
+    # names of the satellites above the horizon during the observation
+    up = None
+    if visibility and len(whichTLE) > 0 and os.path.exists(full_filename):
+        # satellites as far below the horizon as the threshold can still pass targets on it
+        min_elevation = minElevation(threshold)
+        indexKey = key + (min_elevation,)
+        if indexKey not in indices:
+            with stage('visibility_index'):
+                indices[indexKey] = visibilityIndex(full_filename, site=site, min_elevation=min_elevation, start_mjd=np.floor(dd))
+        up = indices[indexKey].visibleNames(dd, dd + 301/86400)
+
+    # calculate the separation for 5 minutes after the start of observation
+    if len(whichTLE) > 0 and os.path.exists(full_filename) and ephem_cache:
+        if key not in caches:
+            with stage('ephem_cache'):
+                caches[key] = ephemCache(full_filename, site=site, work_dir=work_dir, start_mjd=np.floor(dd))
+        cache = caches[key]
+
+        if selector is not None:
+            names = [str(name) for name in cache.names] if up is None else up
+            up = selector.filter(names, work_dir)
+            count('satellites_not_selected', len(names) - len(up))
+
+        if downlinks is not None:
+            names = [str(name) for name in cache.names] if up is None else up
+            up = downlinks.prune(names, *span)
+            count('satellites_out_of_band', len(names) - len(up))
+
+        # only the satellites whose current TLEs have not been crossmatched for this observation
+        if memo is not None:
+            names = [str(name) for name in cache.names] if up is None else up
+            memoKey = memo.observationKey(site, ra, dec, dd, threshold, method='cache')
+            up, known = memo.recall(memoKey, full_filename, names)
+            count('satellites_memoized', len(names) - len(up))
+
+        with stage('propagation'):
+            sat_hit_dict = cachedSeparation(cache, full_filename, ra, dec, dd, observer, threshold=threshold, names=up)
+        rows = np.arange(len(cache)) if up is None else cache.rows(up)
+        count('satellites_propagated', int(cache.exact[rows].sum()))
+        count('ephem_evaluations', 300*int(cache.exact[rows].sum()))
+        count('cache_evaluations', 300*len(rows))
+
+        if memo is not None:
+            memo.remember(memoKey, full_filename, up, sat_hit_dict)
+            sat_hit_dict = _recalled(names, sat_hit_dict, known)
+        count('hits', len(sat_hit_dict))
+    elif len(whichTLE) > 0 and os.path.exists(full_filename):
+        tle = tles[whichTLE][0]
+        with stage('tle_parse'):
+            satdict = load_tle(tle)
+        count('tles_loaded', len(satdict))
+
+        if up is not None:
+            count('satellites_skipped', len(satdict) - len(up))
+            satdict = {name : satdict[name] for name in up if name in satdict}
+
+        # only the selected satellites, when a full TLE file is used for a selection
+        if selector is not None:
+            keep = selector.filter(satdict, work_dir)
+            count('satellites_not_selected', len(satdict) - len(keep))
+            satdict = {name : satdict[name] for name in keep}
+
+        # only the satellites transmitting near the observed band
+        if downlinks is not None:
+            keep = downlinks.prune(satdict, *span)
+            count('satellites_out_of_band', len(satdict) - len(keep))
+            satdict = {name : satdict[name] for name in keep}
+
+        # only the satellites whose current TLEs have not been crossmatched for this observation
+        if memo is not None:
+            names = list(satdict)
+            memoKey = memo.observationKey(site, ra, dec, dd, threshold)
+            todo, known = memo.recall(memoKey, full_filename, names)
+            count('satellites_memoized', len(names) - len(todo))
+            satdict = {name : satdict[name] for name in todo}
+
+        with stage('propagation'):
+            sat_hit_dict = separation(satdict, ra, dec, date, observer, threshold)
+        count('satellites_propagated', len(satdict))
+        count('ephem_evaluations', 300*len(satdict))
+
+        if memo is not None:
+            memo.remember(memoKey, full_filename, todo, sat_hit_dict)
+            sat_hit_dict = _recalled(names, sat_hit_dict, known)
+        count('hits', len(sat_hit_dict))
+    else:
+        print(f'No satellites to crossmatch for {filename}, skipping this observation')
+        print(f'Expected file: {full_filename}')
+        print(f'Available TLE files: {[os.path.basename(t) for t in tles[:5]]}...')  # Show first 5 for debugging
+        return None
+
+    if tiers is not None:
+        for name, n in tiers.tag(sat_hit_dict, radii).items():
+            count(f'passes_{name}', n)
+
+    return sat_hit_dict
+
+def _recalled(names, sat_hit_dict, known):
+    # passes just computed and recalled from the memo, in the order of names
+    hits = {**known, **sat_hit_dict}
+    return {name : hits[name] for name in names if name in hits}
+
+def _writeFileOutputs(fil_file, dd, sat_hit_dict, work_dir, plot, passIndex, files_affected_by_sats, site=None):
+    # separation CSVs, plots, pass index and summary entry of one observation
+
+    import pandas as pd
+
+    csvPaths = {}
+    if len(sat_hit_dict.keys()) > 0:
+
+        # write information to output files
+        for stored_sats_in_obs, unique_sat_info in sat_hit_dict.items():
+
+            outname = os.path.join(work_dir, stored_sats_in_obs.replace(' ','_').replace('(','-').replace(')','-').replace('/', '-')+'_separation_'+fil_file.split('_')[-2] + '_' + fil_file.split('_')[-1]).replace('h5', 'csv')
+
+            if not os.path.exists(outname):
+
+                print('Writing to: ', outname)
+                with stage('write_outputs'):
+                    separationData = pd.DataFrame({key : value for key, value in unique_sat_info.items() if key != 'Tier'})
+                    separationData.to_csv(outname)
+
+            minpoint = min(unique_sat_info['Separation'])
+
+            minindex = unique_sat_info['Separation'].index(minpoint)
+            mintime = unique_sat_info['Time after start'][minindex]
+
+            if plot:
+                with stage('plotting'):
+                    plotSep(outname, work_dir=work_dir)
+                #plotSeparation(unique_sat_info, stored_sats_in_obs, fil_file, mintime, minpoint, minindex, work_dir=work_dir)
+
+            files_affected_by_sats[fil_file][0].append(float(minpoint))
+            files_affected_by_sats[fil_file][1].append(mintime)
+            files_affected_by_sats[fil_file][2].append(outname)
+            csvPaths[stored_sats_in_obs] = outname
+
+    with stage('write_outputs'):
+        passIndex.addFile(fil_file, dd, sat_hit_dict, csvPaths, site=site['name'] if site is not None else None)
+
+def _summaryFrame(files_affected_by_sats):
+    # rows of files_affected_by_sats.csv
+
+    import pandas as pd
+
+    # unpack files_affected_by_sats
+    forDf = {'filepath' : [], 'satellite?' : [],'minSeparation' : [], 'minTime' : [], 'csvPaths' : []}
+    for key in files_affected_by_sats:
+
+        forDf['filepath'].append(key) # add filename to df
+
+        # check if it has satellites
+        if len(files_affected_by_sats[key]) == 0:
+            forDf['satellite?'].append(False)
+            forDf['minSeparation'].append('N/A')
+            forDf['minTime'].append('N/A')
+            forDf['csvPaths'].append('N/A')
+        else:
+            forDf['satellite?'].append(True)
+            forDf['minSeparation'].append(files_affected_by_sats[key][0])
+            forDf['minTime'].append(files_affected_by_sats[key][1])
+            forDf['csvPaths'].append(files_affected_by_sats[key][2])
+
+    return pd.DataFrame(forDf)
+
+def _writeSummary(files_affected_by_sats, work_dir):
+    # Write csv file of files affected and their minimum separation and time
 
-                    os.remove(f)
+    affectedFiles = _summaryFrame(files_affected_by_sats)
+    
+    # Save the summary file to the work directory
+    summary_file_path = os.path.join(work_dir, 'files_affected_by_sats.csv')
+    with stage('write_outputs'):
+        affectedFiles.to_csv(summary_file_path)
+    print(f"Summary saved to: {summary_file_path}")
 
-    return np.array([os.path.join(work_dir, name+'.txt') for name in baseNames])
+    return affectedFiles
 
-def findSats(dir=None, file=None, pattern='*.h5', plot=False, n=10, /, file_list=None, spacetrack_account=None, spacetrack_password=None, work_dir=None):
+def findSats(dir=None, file=None, pattern='*.h5', plot=False, n=None, /, file_list=None, spacetrack_account=None, spacetrack_password=None, work_dir=None, metrics=None, shard=None, ephem_cache=False, visibility=False, pipeline=False, prune_bands=False, downlink_tables=None, keep_unknown=True, tiers=None, selector=None, site=None, memoize=False):
     """
     Identify satellite interference in radio astronomy observation data.
     
@@ -185,9 +499,9 @@ def findSats(dir=None, file=None, pattern='*.h5', plot=False, n=10, /, file_list
     plot : bool, default=False
         Whether to generate separation plots for each satellite pass.
         Creates time vs. angular separation plots for visual inspection.
-    n : int, default=10
-        Number of partitions for satellite catalog queries. Lower values may
-        overload Space-Track.org API. Do not change unless you understand the implications.
+    n : int, optional
+        Split the satellite catalog into exactly n Space-Track queries. By
+        default the number of queries is chosen automatically (see downloadTLEs).
     file_list : list of str, optional
         Direct list of HDF5 file paths to analyze.
         Mutually exclusive with `dir` and `file`.
@@ -198,6 +512,71 @@ def findSats(dir=None, file=None, pattern='*.h5', plot=False, n=10, /, file_list
     work_dir : str, optional
         Directory for storing output files (TLEs, CSVs, plots).
         If None, uses current working directory.
+    metrics : satcheck.metrics.Metrics, optional
+        Collector for per-stage wall/CPU time, peak memory and counters
+        (files, TLEs loaded, satellites propagated, ephem evaluations, hits,
+        bytes downloaded). Its callbacks are called as the run progresses.
+    shard : str or tuple of (int, int), optional
+        Only process shard i of N ("i/N" or (i, N), 0 <= i < N) for runs split
+        across several nodes. Files are partitioned deterministically by
+        observation date, so each shard downloads and parses the TLEs of its
+        own nights only, and all outputs go to work_dir/shard_i_of_N. Combine
+        the shards afterwards with satcheck.shards.mergeShards.
+    ephem_cache : bool, default=False
+        Fit every satellite's position over each observation day once (see
+        satcheck.ephemCache) and take each file's separations from that fit
+        instead of propagating every satellite for every file. The cache is
+        stored in work_dir/ephem_cache and reused by later runs; satellites
+        that cannot be fitted to within 0.001 degrees of sgp4 are still
+        propagated with PyEphem. Separations differ from the default PyEphem
+        ones by a few thousandths of a degree for low orbits and by up to
+        about 0.07 degrees at GNSS altitudes, where the two propagators
+        disagree.
+    visibility : bool, default=False
+        Build (once per TLE file, saved next to it) an index of when each
+        satellite is above the horizon (see satcheck.visibility) and only
+        propagate the satellites that are up during each observation. The
+        elevation limit is the separation threshold (the widest tier) below
+        the horizon, so this drops no passes with targets above the horizon.
+    pipeline : bool, default=False
+        Overlap the stages of the run (see satcheck.pipeline): headers are
+        read ahead of the downloads, each observation day is crossmatched as
+        soon as its TLEs have been downloaded while the next day downloads,
+        and outputs are written by a background writer. The results are the
+        same as without it.
+    prune_bands : bool, default=False
+        Only crossmatch the satellites with a known downlink within 10 MHz of
+        each observation's frequency range (see satcheck.downlinks), using the
+        table shipped with satcheck, work_dir/downlinks.csv if there is one
+        and downlink_tables.
+    downlink_tables : list of str, optional
+        Extra downlink tables for prune_bands.
+    keep_unknown : bool, default=True
+        With prune_bands, still crossmatch the satellites that are in none of
+        the downlink tables.
+    tiers : str, dict or None, default=None
+        Named separation thresholds (see satcheck.tiers), e.g.
+        'primary=beam,near=0.5,sidelobe=3', where 'beam' is the primary beam
+        at the lowest frequency of each file. Satellites are crossmatched out
+        to the widest tier and every pass is tagged in the pass index with
+        the tightest tier it entered. By default satellites are crossmatched
+        within 3 degrees without tagging.
+    selector : SatelliteSelector, optional
+        Only query and crossmatch the satellites of some constellations,
+        orbit classes or NORAD ids (see satcheck.selection). Selected days
+        are downloaded into TLE files of their own.
+    site : str or dict, optional
+        Crossmatch every file from this site (a name or telescope_id in
+        satcheck.sites.SITES, or a site dict). By default each file's site is
+        looked up from the telescope_id of its header, so one run can mix
+        files from several observatories.
+    memoize : bool, default=False
+        Record which satellites have been crossmatched for each observation,
+        and the passes they made, in work_dir/crossmatch_memo.sqlite (see
+        satcheck.memo). A satellite is only propagated again for the same
+        site, target, start time and threshold if its TLE has changed, so
+        re-running after a catalog refresh only propagates the new and
+        updated satellites.
         
     Returns
     -------
@@ -219,11 +598,14 @@ def findSats(dir=None, file=None, pattern='*.h5', plot=False, n=10, /, file_list
     Notes
     -----
     - Requires Space-Track.org account for TLE data access
-    - Considers satellites within 3 degrees of target as potential interference
+    - Considers satellites within the widest tier (3 degrees by default) of target as potential interference
     - Analyzes 5-minute observation windows starting from file timestamp
     - Creates detailed CSV files for each satellite pass detected
+    - Records every pass in work_dir/pass_index.sqlite, queryable with
+      satcheck.passIndex.PassIndex or `satcheck passes`
     - Observation coordinates are read from HDF5 file headers (src_raj, src_dej)
-    - Uses Green Bank Telescope coordinates as observation site
+    - Observation sites are taken from the telescope_id of each header (see
+      satcheck.sites), defaulting to the Green Bank Telescope
     
     Examples
     --------
@@ -239,119 +621,137 @@ def findSats(dir=None, file=None, pattern='*.h5', plot=False, n=10, /, file_list
     Use file containing list of observations:
     
     >>> results = findSats(file="observation_list.txt")
-    """
 
-    # check that end of args.dir is a /
-    if dir != None and not dir[-1] == '/':
-        dir += '/'
+    Collect stage timings and counters:
 
-    # Set work directory, default to current working directory
-    if work_dir is None:
-        work_dir = os.getcwd()
-    
-    # Ensure work_dir exists
-    os.makedirs(work_dir, exist_ok=True)
+    >>> from satcheck.metrics import Metrics
+    >>> m = Metrics()
+    >>> results = findSats(dir="/data/observations/", metrics=m)
+    >>> m.summary()['stages']['propagation']
 
-    # month conversion
-    months = {"01":"jan", "02":"feb","03":"mar","04":"apr","05":"may","06":"jun",
-                  "07":"jul","08":"aug","09":"sep","10":"oct","11":"nov", "12":"dec"}
+    Process the second of four shards of a large run:
 
-    # read in necessary info from the h5 files
-    list_of_filenames = find_files(dir, file, file_list, pattern)
-    start_time_mjd, ra_lst, dec_lst = pull_relevant_header_info(list_of_filenames)
+    >>> results = findSats(file="archive_list.txt", work_dir="/shared/run/", shard="1/4")
 
-    tles = downloadTLEs(list_of_filenames, n, spacetrack_account, spacetrack_password, work_dir=work_dir)
+    Reuse one ephemeris fit for all files observed on the same day:
 
-    # Create ephem Observer object for GBT
-    gbt = ephem.Observer()
-    gbt.long = "-79.839857"
-    gbt.lat = "38.432987"
-    gbt.elevation = 807.0
+    >>> results = findSats(dir="/data/observations/", ephem_cache=True)
 
-    files_affected_by_sats = {}
-    for (fil_file, ra, dec, dd) in zip(list_of_filenames, ra_lst, dec_lst, start_time_mjd):
+    Only propagate the satellites above the horizon during each observation:
 
-        files_affected_by_sats[fil_file] = [[],[],[]]
+    >>> results = findSats(dir="/data/observations/", visibility=True)
 
-        date = convert(dd)
-        year = date.split("-")[0]
-        mon = date.split("-")[1]
-        day1 = date.split("-")[2].split('T')[0]
-        filename = months[mon] + '_' + day1 + "_" +year +"_TLEs.txt"
-        
-        # Construct full path for filename matching
-        full_filename = os.path.join(work_dir, filename)
+    Crossmatch while the TLEs of later days are still downloading:
 
-        # figure out which tle to compare to
-        whichTLE = np.where(full_filename == tles)[0]
+    >>> results = findSats(dir="/data/observations/", pipeline=True)
 
-        # calculate the separation for 5 minutes after the start of observation
-        if len(whichTLE) > 0 and os.path.exists(full_filename):
-            tle = tles[whichTLE][0]
-            satdict = load_tle(tle)
-            sat_hit_dict = separation(satdict, ra, dec, date, gbt)
-        else:
-            print(f'No satellites to crossmatch for {filename}, skipping this observation')
-            print(f'Expected file: {full_filename}')
-            print(f'Available TLE files: {[os.path.basename(t) for t in tles[:5]]}...')  # Show first 5 for debugging
-            continue
+    Skip satellites that do not transmit in the observed band:
 
-        if len(sat_hit_dict.keys()) > 0:
+    >>> results = findSats(dir="/data/observations/", prune_bands=True)
 
-            # write information to output files
-            for stored_sats_in_obs, unique_sat_info in sat_hit_dict.items():
+    Separate primary beam passes from those within half a degree and 5 degrees:
 
-                outname = os.path.join(work_dir, stored_sats_in_obs.replace(' ','_').replace('(','-').replace(')','-').replace('/', '-')+'_separation_'+fil_file.split('_')[-2] + '_' + fil_file.split('_')[-1]).replace('h5', 'csv')
+    >>> results = findSats(dir="/data/observations/", tiers='primary=beam,near=0.5,wide=5')
 
-                if not os.path.exists(outname):
+    Only look for GNSS satellites:
 
-                    print('Writing to: ', outname)
-                    separationData = pd.DataFrame(unique_sat_info)
-                    separationData.to_csv(outname)
-
-                minpoint = min(unique_sat_info['Separation'])
+    >>> from satcheck.selection import SatelliteSelector
+    >>> results = findSats(dir="/data/observations/", selector=SatelliteSelector(constellations=['gnss']))
 
-                minindex = unique_sat_info['Separation'].index(minpoint)
-                mintime = unique_sat_info['Time after start'][minindex]
+    Crossmatch Parkes files whose headers lack a telescope_id:
 
-                if plot:
-                    plotSep(outname, work_dir=work_dir)
-                    #plotSeparation(unique_sat_info, stored_sats_in_obs, fil_file, mintime, minpoint, minindex, work_dir=work_dir)
+    >>> results = findSats(dir="/data/parkes/", site='Parkes')
 
-                files_affected_by_sats[fil_file][0].append(minpoint)
-                files_affected_by_sats[fil_file][1].append(mintime)
-                files_affected_by_sats[fil_file][2].append(outname)
+    Only propagate the satellites whose TLEs changed since the last run:
 
-    # Write csv file of files affected and their minimum separation and time
+    >>> results = findSats(dir="/data/observations/", memoize=True)
+    """
 
-    # unpack files_affected_by_sats
-    forDf = {'filepath' : [], 'satellite?' : [],'minSeparation' : [], 'minTime' : [], 'csvPaths' : []}
-    for key in files_affected_by_sats:
+    with useMetrics(metrics):
+        return _findSats(dir, file, pattern, plot, n, file_list, spacetrack_account, spacetrack_password, work_dir, shard, ephem_cache, visibility, pipeline, prune_bands, downlink_tables, keep_unknown, tiers, selector, site, memoize)
 
-        forDf['filepath'].append(key) # add filename to df
+def _findSats(dir, file, pattern, plot, n, file_list, spacetrack_account, spacetrack_password, work_dir, shard, ephem_cache, visibility, pipeline, prune_bands, downlink_tables, keep_unknown, tiers, selector, site, memoize):
 
-        # check if it has satellites
-        if len(files_affected_by_sats[key]) == 0:
-            forDf['satellite?'].append(False)
-            forDf['minSeparation'].append('N/A')
-            forDf['minTime'].append('N/A')
-            forDf['csvPaths'].append('N/A')
-        else:
-            forDf['satellite?'].append(True)
-            forDf['minSeparation'].append(files_affected_by_sats[key][0])
-            forDf['minTime'].append(files_affected_by_sats[key][1])
-            forDf['csvPaths'].append(files_affected_by_sats[key][2])
+    # check that end of args.dir is a /
+    if dir != None and not dir[-1] == '/':
+        dir += '/'
 
-    affectedFiles = pd.DataFrame(forDf)
+    # Set work directory, default to current working directory
+    if work_dir is None:
+        work_dir = os.getcwd()
     
-    # Save the summary file to the work directory
-    summary_file_path = os.path.join(work_dir, 'files_affected_by_sats.csv')
-    affectedFiles.to_csv(summary_file_path)
-    print(f"Summary saved to: {summary_file_path}")
+    # Ensure work_dir exists
+    os.makedirs(work_dir, exist_ok=True)
+
+    # read in necessary info from the h5 files
+    with stage('find_files'):
+        list_of_filenames = find_files(dir, file, file_list, pattern)
+
+    # the pipeline reads the headers while it downloads, unless a shard needs them all up front
+    headers = None
+    if not pipeline or shard is not None:
+        start_time_mjd, ra_lst, dec_lst, telescope_lst = pull_relevant_header_info(list_of_filenames, telescope=True)
+        headers = (start_time_mjd, ra_lst, dec_lst, telescope_lst)
+
+    # keep only this shard's observation dates and give it its own namespace
+    if shard is not None:
+        shard = parseShard(shard)
+        keep = partitionByDate(start_time_mjd, shard[1])[shard[0]]
+        list_of_filenames = [list_of_filenames[ii] for ii in keep]
+        start_time_mjd = [start_time_mjd[ii] for ii in keep]
+        ra_lst = [ra_lst[ii] for ii in keep]
+        dec_lst = [dec_lst[ii] for ii in keep]
+        telescope_lst = [telescope_lst[ii] for ii in keep]
+        headers = (start_time_mjd, ra_lst, dec_lst, telescope_lst)
+
+        work_dir = shardDir(work_dir, shard)
+        os.makedirs(work_dir, exist_ok=True)
+        print(f'Shard {shard[0]}/{shard[1]}: {len(list_of_filenames)} files, writing to {work_dir}')
+
+    downlinks = DownlinkTable(downlink_tables, work_dir=work_dir, keepUnknown=keep_unknown) if prune_bands else None
+    if tiers is not None and not isinstance(tiers, SeparationTiers):
+        tiers = SeparationTiers(tiers)
+    if site is not None:
+        site = siteNamed(site)
+
+    if pipeline:
+        from .pipeline import runPipeline
+        affectedFiles = runPipeline(list_of_filenames, n, spacetrack_account, spacetrack_password, work_dir,
+                                    plot=plot, ephem_cache=ephem_cache, visibility=visibility, headers=headers, downlinks=downlinks, tiers=tiers, selector=selector, site=site, memoize=memoize)
+    else:
+        with stage('tle_download'):
+            tles = downloadTLEs(list_of_filenames, n, spacetrack_account, spacetrack_password, work_dir=work_dir, start_time_mjd=start_time_mjd, selector=selector)
+
+        observers = {}
+        caches = {}
+        indices = {}
+        memo = CrossmatchMemo(work_dir) if memoize else None
+        passIndex = PassIndex(work_dir)
+        files_affected_by_sats = {}
+        for (fil_file, ra, dec, dd, telescope_id) in zip(list_of_filenames, ra_lst, dec_lst, start_time_mjd, telescope_lst):
+
+            files_affected_by_sats[fil_file] = [[],[],[]]
+
+            span = _observationSpan(fil_file, downlinks, tiers)
+            fileSite = _fileSite(fil_file, telescope_id, site)
+            sat_hit_dict = _crossmatchFile(dd, ra, dec, tles, work_dir, observers, caches, indices, ephem_cache, visibility, downlinks, span, tiers, selector, fileSite, memo)
+            if sat_hit_dict is None:
+                continue
+
+            _writeFileOutputs(fil_file, dd, sat_hit_dict, work_dir, plot, passIndex, files_affected_by_sats, fileSite)
+
+        passIndex.close()
+        if memo is not None:
+            memo.close()
+
+        affectedFiles = _writeSummary(files_affected_by_sats, work_dir)
+
+    if shard is not None:
+        writeShardManifest(work_dir, shard, list_of_filenames, start_time_mjd)
     
     return affectedFiles
 
-def main():
+def main(argv=None):
     '''
     dir [str] : directory that contains h5 files to check for satellites
                 must end with a '/'
@@ -364,20 +764,96 @@ def main():
     parser.add_argument('--file', help='File with list of h5 files to run on. If no dir is provided, will use this file', default=None)
     parser.add_argument('--pattern', help='input pattern to glob', default='*.h5')
     parser.add_argument('--plot', help='set to true to save plot of data', default=False)
-    parser.add_argument('--n', help='higher n will be more inefficient', default=10)
+    parser.add_argument('--n', help='split the NORAD ids into exactly n Space-Track queries, chosen automatically by default', default=None, type=int)
     parser.add_argument('--work_dir', help='directory to store output files, defaults to current working directory', default=None)
-    args = parser.parse_args()
-
-
-    af = findSats(args.dir, args.file,  args.pattern, args.plot, args.n, work_dir=args.work_dir)
+    parser.add_argument('--ephem_cache', help='fit each day\'s ephemerides once and reuse them for every file of that day', action='store_true')
+    parser.add_argument('--visibility', help='only propagate satellites above the horizon during each observation', action='store_true')
+    parser.add_argument('--memoize', help='remember the satellites crossmatched for each observation and only propagate those whose TLEs changed since', action='store_true')
+    parser.add_argument('--prune_bands', help='only crossmatch satellites with a known downlink near the observed band', action='store_true')
+    parser.add_argument('--downlinks', help='extra downlink tables for --prune_bands', nargs='+', default=None)
+    parser.add_argument('--drop_unknown', help='with --prune_bands, also skip satellites with no known downlinks', action='store_true')
+    parser.add_argument('--tiers', help="named separation thresholds in degrees, tightest entered is recorded per pass ('beam' is the primary beam at the lowest frequency of each file)", default=None)
+    parser.add_argument('--constellation', help="only these constellations (e.g. gnss, gps, glonass, galileo, beidou, starlink, iridium) or UCS name patterns", nargs='+', default=None)
+    parser.add_argument('--norad', help='only these NORAD ids (added to --constellation)', nargs='+', type=int, default=None)
+    parser.add_argument('--orbit', help='only these UCS orbit classes (LEO, MEO, GEO, Elliptical)', nargs='+', default=None)
+    parser.add_argument('--site', help="crossmatch every file from this site (e.g. GBT, Parkes, MeerKAT, or a telescope_id) instead of the telescope_id of its header", default=None)
+    parser.add_argument('--watch', help='keep watching these directories (default: --dir) and crossmatch new h5 files as soon as they are written', nargs='*', default=None)
+    parser.add_argument('--alert_sep', help='with --watch, alert on passes closer than this many degrees', default=1, type=float)
+    parser.add_argument('--alert_command', help='with --watch, shell command run with each alert as JSON on its standard input', default=None)
+    parser.add_argument('--poll', help='with --watch, poll the directories instead of using inotify', action='store_true')
+    parser.add_argument('--pipeline', help='crossmatch each day as soon as its TLEs are downloaded, overlapping downloads, compute and writes', action='store_true')
+    parser.add_argument('--stream', help='crossmatch files one at a time as they are found, appending to the summary every --batch files, so memory does not grow with the number of files', action='store_true')
+    parser.add_argument('--batch', help='with --stream, number of summary rows written at a time', default=100, type=int)
+    parser.add_argument('--shard', help="only process shard i of N ('i/N', 0 <= i < N), outputs go to work_dir/shard_i_of_N", default=None)
+    addMetricsArgs(parser)
+    args = parser.parse_args(argv)
+
+    metrics = metricsFromArgs(args)
+    args.selector = _selectorFromArgs(args)
+
+    if args.watch is not None:
+        return _watch(args, metrics)
+    if args.stream:
+        return _stream(args, metrics)
+
+    af = findSats(args.dir, args.file,  args.pattern, args.plot, args.n, work_dir=args.work_dir, metrics=metrics, shard=args.shard, ephem_cache=args.ephem_cache, visibility=args.visibility, pipeline=args.pipeline,
+                  prune_bands=args.prune_bands, downlink_tables=args.downlinks, keep_unknown=not args.drop_unknown, tiers=args.tiers, selector=args.selector, site=args.site, memoize=args.memoize)
     affectedFiles = af.loc[af['minTime'] != 'N/A']#.drop_duplicates()
     
     # Set work directory for final output, default to current working directory
     work_dir = args.work_dir if args.work_dir else os.getcwd()
+    if args.shard is not None:
+        work_dir = shardDir(work_dir, args.shard)
     os.makedirs(work_dir, exist_ok=True)
     final_output_path = os.path.join(work_dir, 'files_affected_by_sats.csv')
     affectedFiles.to_csv(final_output_path)
 
+    writeMetricsFromArgs(metrics, args)
+
+
+def _selectorFromArgs(args):
+    # satellite selection of --constellation, --norad and --orbit, if any
+    if not (args.constellation or args.norad or args.orbit):
+        return None
+    return SatelliteSelector(constellations=args.constellation, norad=args.norad, orbitClasses=args.orbit)
+
+def _stream(args, metrics):
+    # findSats --stream: one observation at a time, summary written as it goes
+    from .streaming import iterFindSats
+
+    if args.shard is not None or args.pipeline:
+        raise ValueError('--stream cannot be combined with --shard or --pipeline')
+
+    work_dir = args.work_dir if args.work_dir else os.getcwd()
+    downlinks = DownlinkTable(args.downlinks, work_dir=work_dir, keepUnknown=not args.drop_unknown) if args.prune_bands else None
+    dir = args.dir if args.dir is None or args.dir.endswith('/') else args.dir + '/'
+
+    with useMetrics(metrics):
+        for row in iterFindSats(dir, args.file, args.pattern, n=args.n, work_dir=work_dir, plot=args.plot, ephem_cache=args.ephem_cache,
+                                visibility=args.visibility, downlinks=downlinks, tiers=args.tiers, selector=args.selector, site=args.site, memoize=args.memoize, batch=args.batch):
+            pass
+
+    writeMetricsFromArgs(metrics, args)
+
+def _watch(args, metrics):
+    # findSats --watch: crossmatch files as they are written until interrupted
+    from .watch import Watcher, commandAlert
+
+    dirs = args.watch or ([args.dir] if args.dir else [])
+    if len(dirs) == 0:
+        raise ValueError('--watch needs directories to watch, or --dir')
+
+    work_dir = args.work_dir if args.work_dir else os.getcwd()
+    downlinks = DownlinkTable(args.downlinks, work_dir=work_dir, keepUnknown=not args.drop_unknown) if args.prune_bands else None
+    onAlert = [commandAlert(args.alert_command)] if args.alert_command else None
+
+    with useMetrics(metrics):
+        with Watcher(dirs, pattern=args.pattern, work_dir=work_dir, alertSeparation=args.alert_sep, polling=args.poll,
+                     n=args.n, plot=args.plot, ephem_cache=args.ephem_cache, visibility=args.visibility,
+                     downlinks=downlinks, tiers=SeparationTiers(args.tiers) if args.tiers else None, selector=args.selector, site=args.site, memoize=args.memoize, onAlert=onAlert) as watcher:
+            watcher.run()
+
+    writeMetricsFromArgs(metrics, args)
 
 if __name__ == '__main__':
     sys.exit(main())
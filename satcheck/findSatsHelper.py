@@ -1,18 +1,23 @@
 import os, sys, time, glob
 import math
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
 
-from blimpy import Waterfall
-from astropy.time import Time , TimeDelta
 from datetime import datetime, date, timedelta
+from contextlib import contextmanager
 import ephem
-from astropy import units as u
-from astropy.coordinates import SkyCoord, EarthLocation, AltAz #,Angle
-import requests
-import urllib
-from io import StringIO
+
+# blimpy, astropy, matplotlib, pandas and requests are slow to import, so they are
+# imported inside the functions that need them to keep `import satcheck` fast
+
+from . import metrics
+from .fileLocks import fileLock, atomicWrite
+
+# Space-Track endpoint and the pause between queries needed to respect its rate limits.
+# The endpoint can be pointed at a mirror or a local stand-in (e.g. for benchmarks).
+SPACETRACK_URL = os.environ.get('SPACETRACK_URL', 'https://www.space-track.org')
+SPACETRACK_SLEEP = 12.001
+
+UCS_URL = os.environ.get('SATCHECK_UCS_URL', 'https://www.ucsusa.org/sites/default/files/2021-11/UCS-Satellite-Database-9-1-2021.txt')
 
 '''
 Following 10 functions taken from Chris Murphy's satellite code
@@ -81,9 +86,10 @@ def find_files(inDir, inFile, fileList, pattern):
     else:
         raise IOError('Please input either a directory housing h5 files or a file with a list of h5 paths')
 
+    metrics.count('files', len(toRet))
     return toRet
 
-def pull_relevant_header_info(filename_array):
+def pull_relevant_header_info(filename_array, telescope=False):
     """
     Extract observation parameters from HDF5 file headers.
     
@@ -95,6 +101,9 @@ def pull_relevant_header_info(filename_array):
     ----------
     filename_array : list of str
         List of paths to HDF5 observation files to process.
+    telescope : bool, default=False
+        Also return the telescope_id of every file, so its site can be looked
+        up (see satcheck.sites.siteOfTelescope) without reading it again.
         
     Returns
     -------
@@ -103,6 +112,7 @@ def pull_relevant_header_info(filename_array):
         - start_time_mjd_array : Modified Julian Date start times for each observation
         - right_ascension_array : Right ascension coordinates (J2000) as strings  
         - declination_array : Declination coordinates (J2000) as strings
+        and with telescope=True a fourth, the telescope_ids (None if missing).
         
     Notes
     -----
@@ -120,14 +130,18 @@ def pull_relevant_header_info(filename_array):
     >>> print(f"First observation: RA={ra_list[0]}, Dec={dec_list[0]}")
     """
 
+    from blimpy import Waterfall
+
     start_time_mjd_array =[]
     right_ascension_array = []
     declination_array = []
+    telescope_array = []
 
     for every_file in filename_array:
 
         # use blimpy to open h5 header
-        wf = Waterfall(every_file, load_data=False)
+        with metrics.stage('header_io'):
+            wf = Waterfall(every_file, load_data=False)
 
         # get information and append to arrays to return
         start_time_mjd = wf.header['tstart']
@@ -137,7 +151,10 @@ def pull_relevant_header_info(filename_array):
         start_time_mjd_array.append(start_time_mjd)
         right_ascension_array.append(right_ascension)
         declination_array.append(declination)
+        telescope_array.append(wf.header.get('telescope_id'))
 
+    if telescope:
+        return start_time_mjd_array, right_ascension_array, declination_array, telescope_array
     return start_time_mjd_array, right_ascension_array, declination_array
 
 def convert(mjd):
@@ -170,11 +187,122 @@ def convert(mjd):
     >>> iso_time = convert(58849.5)
     >>> print(iso_time)  # "2020-01-15T12:00:00.000"
     """
+    from astropy.time import Time
+
     startdate = Time(mjd, format='mjd')
     string_start_date = str(Time(startdate, format='isot'))
     return string_start_date
 
-def query_space_track(fil_files, gps_ids, idx, overwrite=False, spacetrack_account=None, spacetrack_password=None, work_dir=None):
+def tle_filename(mjd, work_dir=None, selection=None):
+    """
+    Path of the combined TLE file that covers an observation start time.
+
+    Parameters
+    ----------
+    mjd : float
+        Observation start time (MJD).
+    work_dir : str, optional
+        Directory holding the TLE files. If None, uses current working directory.
+    selection : str, optional
+        Tag of a satellite selection (see satcheck.selection) whose TLEs the
+        file holds instead of the full catalog's.
+
+    Returns
+    -------
+    str
+        Path of the form {work_dir}/{month}_{day}_{year}_TLEs.txt, or
+        {month}_{day}_{year}_TLEs_{selection}.txt, as written by downloadTLEs.
+
+    Examples
+    --------
+    >>> tle_filename(58849.5, "/data/tles/")
+    '/data/tles/jan_01_2020_TLEs.txt'
+    """
+    months = {"01":"jan", "02":"feb","03":"mar","04":"apr","05":"may","06":"jun",
+              "07":"jul","08":"aug","09":"sep","10":"oct","11":"nov", "12":"dec"}
+
+    if work_dir is None:
+        work_dir = os.getcwd()
+
+    date = convert(mjd)
+    year = date.split("-")[0]
+    mon = date.split("-")[1]
+    day = date.split("-")[2].split('T')[0]
+
+    suffix = "_TLEs.txt" if selection is None else "_TLEs_" + selection + ".txt"
+    return os.path.join(work_dir, months[mon] + '_' + day + "_" + year + suffix)
+
+def dayTLEFiles(mjd, work_dir=None):
+    """
+    TLE files on disk that findSats would have used for an observation start time.
+
+    That is the day's full TLE file if there is one, otherwise the files of
+    the satellite selections downloaded for the day (see satcheck.selection).
+
+    Returns
+    -------
+    list of str
+        The files, empty if there are none.
+    """
+    full = tle_filename(mjd, work_dir)
+    if os.path.isfile(full):
+        return [full]
+    # selection tags are 'select-' and 8 hex digits, which leaves out their download chunks
+    return sorted(glob.glob(tle_filename(mjd, work_dir, 'select-' + '[0-9a-f]' * 8)))
+
+# responses worth retrying with a smaller batch: request too long, too large or
+# timed out, rate limited, or a server error
+RETRY_STATUS = (408, 413, 414, 429, 500, 502, 503, 504)
+
+class SpaceTrackQueryError(RuntimeError):
+    """
+    A Space-Track query that failed in a way a smaller or later query may not.
+
+    Attributes
+    ----------
+    status : int or None
+        HTTP status of the response, None if no response was received.
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+def tle_query_url(date1, date2, gps_ids):
+    """
+    Space-Track query for the TLEs of some satellites with epochs between two dates.
+
+    Parameters
+    ----------
+    date1, date2 : str
+        Dates as YYYY-MM-DD.
+    gps_ids : str
+        Comma-separated string of NORAD catalog IDs.
+
+    Returns
+    -------
+    str
+        Query URL.
+    """
+    return f'{SPACETRACK_URL}/basicspacedata/query/class/tle/EPOCH/{date1}--{date2}/NORAD_CAT_ID/{gps_ids}/orderby/TLE_LINE1 ASC/format/3le'
+
+@contextmanager
+def _spacetrackPause():
+    """
+    Pause between Space-Track queries.
+
+    Yields a dict; the pause is only taken on exit if its 'due' entry was set.
+    Entered before a file lock, the pause starts after the lock is released.
+    """
+    pause = {'due' : False}
+    try:
+        yield pause
+    finally:
+        if pause['due']:
+            with metrics.stage('spacetrack_sleep'):
+                time.sleep(SPACETRACK_SLEEP)
+
+def query_space_track(fil_files, gps_ids, idx, overwrite=False, spacetrack_account=None, spacetrack_password=None, work_dir=None, start_time_mjd=None, raise_errors=False):
     """
     Download Two-Line Element (TLE) data from Space-Track.org for specific satellites and dates.
     
@@ -202,6 +330,13 @@ def query_space_track(fil_files, gps_ids, idx, overwrite=False, spacetrack_accou
         If None, uses SPACETRACK_PASS environment variable.
     work_dir : str, optional
         Directory to save TLE files. If None, uses current working directory.
+    start_time_mjd : list of float, optional
+        Observation start times (MJD) to download TLEs for. If given, the
+        headers of fil_files are not read, so fil_files may be empty.
+    raise_errors : bool, default=False
+        Raise SpaceTrackQueryError when a query fails with a connection error
+        or one of RETRY_STATUS, instead of printing a warning and falling back
+        to the latest TLEs, so the caller can retry it (see queryPlanner).
         
     Returns
     -------
@@ -212,6 +347,8 @@ def query_space_track(fil_files, gps_ids, idx, overwrite=False, spacetrack_accou
     ------
     ValueError
         If Space-Track.org credentials are not provided via parameters or environment variables.
+    SpaceTrackQueryError
+        If raise_errors is set and a query failed in a way worth retrying.
         
     Notes
     -----
@@ -219,6 +356,8 @@ def query_space_track(fil_files, gps_ids, idx, overwrite=False, spacetrack_accou
     - Implements 12-second delays between queries to respect API rate limits
     - Downloads TLEs for observation date ±1 day to ensure coverage
     - Files are named: {month}_{day}_{year}_TLEs_{idx}.txt
+    - Each file is downloaded under a lock and written atomically, so processes
+      sharing work_dir download it once and never read a partial file
     - Handles various API response codes and error conditions gracefully
     - Falls back to latest TLE queries if historical data is unavailable
     
@@ -233,6 +372,10 @@ def query_space_track(fil_files, gps_ids, idx, overwrite=False, spacetrack_accou
     ...                              spacetrack_password="password")
     """
 
+    import requests
+    from blimpy import Waterfall
+    from astropy.time import Time, TimeDelta
+
     if spacetrack_account is None:
         spacetrack_account = os.environ.get('SPACETRACK_ACCT')
     if spacetrack_account is None:
@@ -254,15 +397,20 @@ def query_space_track(fil_files, gps_ids, idx, overwrite=False, spacetrack_accou
     # Ensure work_dir exists
     os.makedirs(work_dir, exist_ok=True)
 
-    array_of_TLE_filenames = []
-    for files in fil_files:
+    if start_time_mjd is None:
+        start_time_mjd = []
+        for files in fil_files:
 
-        # get important info from hdf5 header
-        wf = Waterfall(files, load_data=False)
+            # get important info from hdf5 header
+            with metrics.stage('header_io'):
+                wf = Waterfall(files, load_data=False)
+            start_time_mjd.append(wf.header['tstart'])
+
+    array_of_TLE_filenames = []
+    for obs_start in start_time_mjd:
 
         # Format dates
-        start_time_mjd = wf.header['tstart']
-        mjd = Time(start_time_mjd, format='mjd')
+        mjd = Time(obs_start, format='mjd')
         time_isot = Time(mjd, format='isot')
         day_change = TimeDelta(1 , format = 'jd')
         time_mjd_change = mjd + day_change
@@ -283,105 +431,124 @@ def query_space_track(fil_files, gps_ids, idx, overwrite=False, spacetrack_accou
         filename = os.path.join(work_dir, monthConversion[mon1] + "_" + day1 + '_' + year_full_1 + "_TLEs_" + str(idx) + ".txt")
         #print('Downloading TLEs to ', filename)
 
-        if not os.path.isfile(filename) or overwrite: # only do next steps if file doesn't exist
+        # one process downloads each file, the others wait here and reuse it
+        stamp = os.path.getmtime(filename) if os.path.isfile(filename) else None
+        # sleep after the lock is released, so the processes waiting for the file can read it meanwhile
+        with _spacetrackPause() as pause, fileLock(filename):
+            # an overwrite that another process finished while we waited counts as done
+            fresh = os.path.isfile(filename) and (not overwrite or os.path.getmtime(filename) != stamp)
+            if not fresh:
 
-            #Query space track for properly dated TLE info
-            date1 = year_full_1+'-'+mon1+'-'+day1
-            date2 = year_full_2+'-'+mon2+'-'+day2
+                #Query space track for properly dated TLE info
+                date1 = year_full_1+'-'+mon1+'-'+day1
+                date2 = year_full_2+'-'+mon2+'-'+day2
 
-            # Create a session for proper authentication
-            session = requests.Session()
+                # Create a session for proper authentication
+                session = requests.Session()
             
-            # Login data for authentication
-            login_data = {
-                'identity': spacetrack_account,
-                'password': spacetrack_password
-            }
+                # Login data for authentication
+                login_data = {
+                    'identity': spacetrack_account,
+                    'password': spacetrack_password
+                }
             
-            try:
-                # First authenticate to get session cookies
-                login_response = session.post('https://www.space-track.org/ajaxauth/login', data=login_data)
+                try:
+                    # First authenticate to get session cookies
+                    with metrics.stage('spacetrack_request'):
+                        login_response = session.post(f'{SPACETRACK_URL}/ajaxauth/login', data=login_data)
                 
-                if login_response.status_code == 200:
-                    # Check if login was actually successful by examining response
-                    if 'Failed' in login_response.text or 'Login' in login_response.text:
-                        print(f"Authentication failed for Space-Track.org. Login response indicates failure.")
-                        continue
+                    if login_response.status_code == 200:
+                        # Check if login was actually successful by examining response
+                        if 'Failed' in login_response.text or 'Login' in login_response.text:
+                            print(f"Authentication failed for Space-Track.org. Login response indicates failure.")
+                            continue
                         
-                    # Now make the query using the authenticated session
-                    # Format: class/tle for Two-Line Elements
-                    query_url = f'https://www.space-track.org/basicspacedata/query/class/tle/EPOCH/{date1}--{date2}/NORAD_CAT_ID/{gps_ids}/orderby/TLE_LINE1 ASC/format/3le'
+                        # Now make the query using the authenticated session
+                        # Format: class/tle for Two-Line Elements
+                        query_url = tle_query_url(date1, date2, gps_ids)
                     
-                    # print(f"Debug: Query URL: {query_url}")  # Debug output
+                        # print(f"Debug: Query URL: {query_url}")  # Debug output
                     
-                    response = session.get(query_url)
+                        with metrics.stage('spacetrack_request'):
+                            response = session.get(query_url)
+                        metrics.count('spacetrack_requests')
+                        metrics.count('bytes_downloaded', len(response.content))
                     
-                    # Check if we got actual TLE data (not error messages)
-                    response_text = response.content.decode('utf-8', errors='ignore')
+                        if raise_errors and response.status_code in RETRY_STATUS:
+                            raise SpaceTrackQueryError(f'Space-Track query for {filename} failed with status {response.status_code}', response.status_code)
+
+                        # Check if we got actual TLE data (not error messages)
+                        response_text = response.content.decode('utf-8', errors='ignore')
                     
-                    # Debug output
-                    # print(f"Debug: Response status: {response.status_code}")
-                    # print(f"Debug: Response length: {len(response_text)}")
-                    # print(f"Debug: Querying {len(gps_ids.split(','))} satellites for date range {date1} to {date2}")
-                    # if len(response_text) < 500:  # Print short responses for debugging
-                    #     print(f"Debug: Response content preview: {response_text[:200]}")
+                        # Debug output
+                        # print(f"Debug: Response status: {response.status_code}")
+                        # print(f"Debug: Response length: {len(response_text)}")
+                        # print(f"Debug: Querying {len(gps_ids.split(','))} satellites for date range {date1} to {date2}")
+                        # if len(response_text) < 500:  # Print short responses for debugging
+                        #     print(f"Debug: Response content preview: {response_text[:200]}")
                     
-                    # Skip if response contains error messages or is empty
-                    if (response.status_code == 200 and 
-                        len(response_text.strip()) > 0 and 
-                        'deprecated' not in response_text.lower() and
-                        'error' not in response_text.lower() and
-                        'unauthorized' not in response_text.lower() and
-                        not response_text.strip().startswith('"') and
-                        not response_text.strip().startswith('No records found')):
+                        # Skip if response contains error messages or is empty
+                        if (response.status_code == 200 and 
+                            len(response_text.strip()) > 0 and 
+                            'deprecated' not in response_text.lower() and
+                            'error' not in response_text.lower() and
+                            'unauthorized' not in response_text.lower() and
+                            not response_text.strip().startswith('"') and
+                            not response_text.strip().startswith('No records found')):
                         
-                        print('######################################################################')
-                        print("Downloading active GPS satellite TLEs from Space-Track: " , filename)
-                        print('######################################################################')
+                            print('######################################################################')
+                            print("Downloading active GPS satellite TLEs from Space-Track: " , filename)
+                            print('######################################################################')
                         
-                        with open(filename, 'w+') as file:
-                            file.write(response_text)
-                    else:
-                        print(f"Warning: No valid TLE data received for {filename}")
-                        print(f"Response status: {response.status_code}")
-                        if response.status_code == 204:
-                            print("HTTP 204 means the query was valid but returned no data.")
-                            print("This typically happens when:")
-                            print("  - Satellites didn't exist during the requested time period")
-                            print("  - SpaceTrack doesn't have historical TLE data for these satellites")
-                            print("  - The date range is too specific for historical queries")
+                            with atomicWrite(filename) as file:
+                                file.write(response_text)
+                        else:
+                            print(f"Warning: No valid TLE data received for {filename}")
+                            print(f"Response status: {response.status_code}")
+                            if response.status_code == 204:
+                                print("HTTP 204 means the query was valid but returned no data.")
+                                print("This typically happens when:")
+                                print("  - Satellites didn't exist during the requested time period")
+                                print("  - SpaceTrack doesn't have historical TLE data for these satellites")
+                                print("  - The date range is too specific for historical queries")
                         
-                        # Don't try alternative query for 204 responses - they indicate no data available
-                        if response.status_code != 204 and len(response_text) < 500:
-                            print(f"Response content: {response_text}")
+                            # Don't try alternative query for 204 responses - they indicate no data available
+                            if response.status_code != 204 and len(response_text) < 500:
+                                print(f"Response content: {response_text}")
                         
-                        # Only try alternative query if it's not a clear "no data" response
-                        if response.status_code != 204 and (len(response_text.strip()) == 0 or response.status_code != 200):
-                            print(f"Trying alternative query format for historical data...")
-                            # Try querying with a broader time range or different approach
-                            alt_query_url = f'https://www.space-track.org/basicspacedata/query/class/tle_latest/NORAD_CAT_ID/{gps_ids}/orderby/TLE_LINE1 ASC/format/3le'
-                            # print(f"Debug: Alternative query URL: {alt_query_url}")
+                            # Only try alternative query if it's not a clear "no data" response
+                            if response.status_code != 204 and (len(response_text.strip()) == 0 or response.status_code != 200):
+                                print(f"Trying alternative query format for historical data...")
+                                # Try querying with a broader time range or different approach
+                                alt_query_url = f'{SPACETRACK_URL}/basicspacedata/query/class/tle_latest/NORAD_CAT_ID/{gps_ids}/orderby/TLE_LINE1 ASC/format/3le'
+                                # print(f"Debug: Alternative query URL: {alt_query_url}")
                             
-                            alt_response = session.get(alt_query_url)
-                            alt_response_text = alt_response.content.decode('utf-8', errors='ignore')
+                                with metrics.stage('spacetrack_request'):
+                                    alt_response = session.get(alt_query_url)
+                                metrics.count('spacetrack_requests')
+                                metrics.count('bytes_downloaded', len(alt_response.content))
+                                alt_response_text = alt_response.content.decode('utf-8', errors='ignore')
                             
-                            if (alt_response.status_code == 200 and 
-                                len(alt_response_text.strip()) > 0 and
-                                'deprecated' not in alt_response_text.lower() and
-                                'error' not in alt_response_text.lower()):
+                                if (alt_response.status_code == 200 and 
+                                    len(alt_response_text.strip()) > 0 and
+                                    'deprecated' not in alt_response_text.lower() and
+                                    'error' not in alt_response_text.lower()):
                                 
-                                print(f"Alternative query succeeded, but data may not match exact date range.")
-                                with open(filename, 'w+') as file:
-                                    file.write(alt_response_text)
-                else:
-                    print(f"Authentication failed for Space-Track.org. Status code: {login_response.status_code}")
+                                    print(f"Alternative query succeeded, but data may not match exact date range.")
+                                    with atomicWrite(filename) as file:
+                                        file.write(alt_response_text)
+                    else:
+                        print(f"Authentication failed for Space-Track.org. Status code: {login_response.status_code}")
                     
-            except requests.exceptions.RequestException as e:
-                print(f"Error querying Space-Track.org: {e}")
-            finally:
-                session.close()
+                except requests.exceptions.RequestException as e:
+                    if raise_errors:
+                        raise SpaceTrackQueryError(f'Error querying Space-Track.org for {filename}: {e}') from e
+                    print(f"Error querying Space-Track.org: {e}")
+                finally:
+                    session.close()
 
-            time.sleep(12.001)
+                    # also after a failed query, which is usually retried straight away
+                    pause['due'] = True
 
         if filename not in array_of_TLE_filenames:
             array_of_TLE_filenames.append(filename)
@@ -495,13 +662,13 @@ def load_tle(filename):
     print(f"%i TLEs loaded from: %s" % (len(satlist), filename))
     return satdict
 
-def separation(tle, ra_obs, dec_obs, start_time, gbt):
+def separation(tle, ra_obs, dec_obs, start_time, gbt, threshold=3):
     """
     Calculate angular separation between satellites and observation target over time.
     
     This function computes the angular separation between each satellite and the
     observation target coordinates for a 5-minute observation period. It identifies
-    satellites that pass within 3 degrees of the target as potential interference sources.
+    satellites that pass within threshold degrees of the target as potential interference sources.
     
     Parameters
     ----------
@@ -515,22 +682,27 @@ def separation(tle, ra_obs, dec_obs, start_time, gbt):
         Observation start time in ISO format "YYYY-MM-DDTHH:MM:SS.fff".
     gbt : ephem.Observer
         PyEphem observer object representing the observation site location.
+    threshold : float, default=3
+        Separation in degrees below which a satellite is reported.
         
     Returns
     -------
     dict
         Dictionary mapping satellite names to separation data for satellites that
-        pass within 3 degrees of the target. Each entry contains:
-        - 'RA': List of satellite RA positions during close approaches
-        - 'DEC': List of satellite declination positions  
+        pass within threshold degrees of the target. Each entry contains:
+        - 'RA': List of satellite RA positions (J2000) during close approaches
+        - 'DEC': List of satellite declination positions (J2000)
         - 'Separation': List of angular separations in degrees
         - 'Time after start': List of time offsets in seconds from observation start
         
     Notes
     -----
     - Analyzes 300 seconds (5 minutes) of satellite motion at 1-second intervals
-    - Only includes satellites that come within 3 degrees of the target
+    - Only includes satellites that come within threshold degrees of the target
     - Uses PyEphem for accurate satellite position calculations
+    - Satellite positions are topocentric astrometric J2000 (a_ra, a_dec),
+      the frame of the header's src_raj/src_dej; the apparent positions of
+      date are about 0.3 degrees away for 2020 data
     - Observer location affects satellite visibility and positions
     - Angular separations calculated using great circle distance
     
@@ -556,6 +728,9 @@ def separation(tle, ra_obs, dec_obs, start_time, gbt):
     dec_obs = ephem.degrees(dec_obs)
     ra_obs = ephem.hours(ra_obs)
 
+    # astrometric positions are precessed to the observer's epoch, J2000 like the target
+    gbt.epoch = ephem.J2000
+
     for unique_sats, satellite_object in tle.items():
 
         ra = []
@@ -574,17 +749,17 @@ def separation(tle, ra_obs, dec_obs, start_time, gbt):
             time_after_start += 1
             gbt.date = time
             satellite_object.compute(gbt)
-            sat_ra, sat_dec = str(satellite_object.ra) , str(satellite_object.dec)
+            sat_ra, sat_dec = str(satellite_object.a_ra) , str(satellite_object.a_dec)
 
-            sep = ephem.separation((satellite_object.ra, satellite_object.dec), (ra_obs , dec_obs))
+            sep = ephem.separation((satellite_object.a_ra, satellite_object.a_dec), (ra_obs , dec_obs))
 
             sep_rad = repr(sep)
 
             sep_deg = np.rad2deg(float(sep_rad))
 
-            if sep_deg < 3:
+            if sep_deg < threshold:
 
-                # get important info if the separation is less than 3 for an observation
+                # get important info if the separation is less than threshold for an observation
                 ra.append(sat_ra)
                 dec.append(sat_dec)
                 close_sep.append(sep_deg)
@@ -601,6 +776,115 @@ def separation(tle, ra_obs, dec_obs, start_time, gbt):
     return sat_hit_dict
 
 
+# ephem dates count days from 1899-12-31 12:00 UT, i.e. MJD 15019.5
+EPHEM_MJD_OFFSET = 15019.5
+
+def parseRaDec(ra, dec):
+    """
+    Convert target coordinates to radians.
+
+    Parameters
+    ----------
+    ra, dec : float or str
+        Either numbers in degrees or header style strings such as
+        "12h30m45s" and "+41d16m09s" (sexagesimal "12:30:45" also works).
+
+    Returns
+    -------
+    tuple of (float, float)
+        Right ascension and declination in radians.
+
+    Raises
+    ------
+    ValueError
+        If a value cannot be parsed.
+    """
+    def parse(value, hours):
+        if isinstance(value, str):
+            value = value.strip()
+            try:
+                value = float(value)
+            except ValueError:
+                value = value.replace('h', ':').replace('d', ':').replace('m', ':').replace('s', '')
+                return float(ephem.hours(value) if hours else ephem.degrees(value))
+        return float(np.deg2rad(float(value)))
+
+    return parse(ra, True), parse(dec, False)
+
+def satellitePositions(tle, mjds, observer):
+    """
+    Topocentric J2000 RA/Dec of every satellite at every requested time, in
+    the frame of the observation headers as in separation().
+
+    Parameters
+    ----------
+    tle : dict
+        Dictionary of satellite objects from load_tle().
+    mjds : array_like
+        Times (MJD) to evaluate.
+    observer : ephem.Observer
+        Observation site. Its date and epoch are changed by this function.
+
+    Returns
+    -------
+    tuple of (list, numpy.ndarray, numpy.ndarray)
+        Satellite names and (nsats, ntimes) arrays of RA and Dec in radians.
+    """
+    names = list(tle)
+    sats = [tle[name] for name in names]
+    mjds = np.asarray(mjds, dtype=float)
+
+    ra = np.empty((len(sats), len(mjds)))
+    dec = np.empty((len(sats), len(mjds)))
+    observer.epoch = ephem.J2000
+    for jj, mjd in enumerate(mjds):
+        observer.date = mjd - EPHEM_MJD_OFFSET
+        for ii, sat in enumerate(sats):
+            sat.compute(observer)
+            ra[ii, jj] = sat.a_ra
+            dec[ii, jj] = sat.a_dec
+
+    return names, ra, dec
+
+def angularSeparation(ra1, dec1, ra2, dec2):
+    """
+    Great circle distance in radians between points given in radians.
+
+    Broadcasts like numpy, and uses the Vincenty formula so small separations
+    stay accurate.
+    """
+    dra = ra2 - ra1
+    sinDec1, cosDec1 = np.sin(dec1), np.cos(dec1)
+    sinDec2, cosDec2 = np.sin(dec2), np.cos(dec2)
+
+    num = np.hypot(cosDec2 * np.sin(dra), cosDec1 * sinDec2 - sinDec1 * cosDec2 * np.cos(dra))
+    den = sinDec1 * sinDec2 + cosDec1 * cosDec2 * np.cos(dra)
+    return np.arctan2(num, den)
+
+def precessionMatrix(mjd):
+    """
+    Rotation of unit vectors from J2000 to the mean equator and equinox of a date.
+
+    The TEME frame of sgp4 differs from the mean frame of date by nutation
+    only, at most about 0.005 degrees. The transpose rotates back to J2000.
+    """
+    date = mjd - EPHEM_MJD_OFFSET
+    columns = []
+    for ra, dec in ((0.0, 0.0), (np.pi / 2, 0.0), (0.0, np.pi / 2)):
+        eq = ephem.Equatorial(ephem.Equatorial(ra, dec, epoch=ephem.J2000), epoch=date)
+        ra, dec = float(eq.ra), float(eq.dec)
+        columns.append([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)])
+    return np.array(columns).T
+
+def rotateRaDec(ra, dec, matrix):
+    """
+    RA and Dec (radians) rotated by a 3x3 matrix such as precessionMatrix.
+    """
+    ra, dec = np.asarray(ra, dtype=float), np.asarray(dec, dtype=float)
+    vec = np.stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1) @ matrix.T
+    return np.mod(np.arctan2(vec[..., 1], vec[..., 0]), 2 * np.pi), np.arcsin(np.clip(vec[..., 2], -1, 1))
+
+
 '''
 Now the rest of these functions I wrote
 '''
@@ -649,6 +933,9 @@ def queryUCS(work_dir=None):
     >>> print(f"Database contains {len(satellites)} satellites")
     """
 
+    import urllib.request
+    import pandas as pd
+
     print('Downloading newest UCS Satellite Database File')
 
     # Set work directory, default to current working directory
@@ -658,17 +945,21 @@ def queryUCS(work_dir=None):
     # Ensure work_dir exists
     os.makedirs(work_dir, exist_ok=True)
 
-    url = 'https://www.ucsusa.org/sites/default/files/2021-11/UCS-Satellite-Database-9-1-2021.txt'
+    url = UCS_URL
     outPath = os.path.join(work_dir, 'UCS-Satellite-Database.txt')
 
     req = urllib.request.Request(url, headers={'User-Agent' : 'Mozilla/5.0'})
-    ucsData = urllib.request.urlopen(req).read()
+    with metrics.stage('ucs_download'):
+        ucsData = urllib.request.urlopen(req).read()
+    metrics.count('bytes_downloaded', len(ucsData))
 
     strUCS = ucsData.decode('cp1252')
     dataArr = [s.split('\t') for s in strUCS.split('\n')]
     parsedData = pd.DataFrame(dataArr[1:], columns=dataArr[0])
 
-    parsedData.to_csv(outPath)
+    # written atomically as another process sharing work_dir may be reading it
+    with atomicWrite(outPath) as f:
+        parsedData.to_csv(f)
 
     return outPath
 
@@ -719,6 +1010,8 @@ def plotSeparation(unique_sat_info, stored_sats_in_obs, fil_file, mintime, minpo
     ...               180, 1.8, 2, work_dir="/plots/")
     """
 
+    import matplotlib.pyplot as plt
+
     # Set work directory, default to current working directory
     if work_dir is None:
         work_dir = os.getcwd()
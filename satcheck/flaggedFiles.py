@@ -0,0 +1,175 @@
+import os, sys, json, pickle
+import numpy as np
+import argparse
+
+'''
+Columnar, memory-mapped store for the flagged-files database used by findGPSFiles.
+
+The original database is a pickle with one ragged array of (string) flagged
+frequencies per file. Here the ragged arrays are stored as a single float64
+buffer plus an offsets array so that file i owns freqs[offsets[i]:offsets[i+1]].
+All three arrays are plain .npy files opened with mmap_mode='r', so opening a
+store does not read any of the frequencies into memory.
+'''
+
+DEFAULT_FLAGGED_PATH = '/home/ubuntu/scratch/flagged_files_2SD.flagged'
+LEGACY_FLAGGED_PATH = '/home/ubuntu/scratch/flagged_files_2SD.pkl'
+
+def flaggedPath(path=None):
+    """
+    Resolve the location of the flagged-files database.
+
+    Parameters
+    ----------
+    path : str, optional
+        Explicit path to a columnar store directory or a legacy .pkl file.
+        If None, the SATCHECK_FLAGGED_FILES environment variable is used and
+        then the default scratch location, falling back to the legacy pickle
+        there if it has not been converted yet.
+
+    Returns
+    -------
+    str
+        Path to the flagged-files database.
+    """
+    if path is None:
+        path = os.environ.get('SATCHECK_FLAGGED_FILES', DEFAULT_FLAGGED_PATH)
+        if path == DEFAULT_FLAGGED_PATH and not os.path.exists(path) and os.path.exists(LEGACY_FLAGGED_PATH):
+            print(f"{path} not found, reading the legacy {LEGACY_FLAGGED_PATH} instead. Convert it once with "
+                  f"`python -m satcheck.flaggedFiles {LEGACY_FLAGGED_PATH}` for faster lookups.")
+            path = LEGACY_FLAGGED_PATH
+    return path
+
+def convertFlaggedPickle(pklPath, outPath=None):
+    """
+    Convert the flagged-files pickle into the memory-mapped columnar format.
+
+    Parameters
+    ----------
+    pklPath : str
+        Path to the pickle with 'file name' and 'flagged frequency' entries,
+        where each flagged frequency entry is an array of frequencies in MHz
+        (stored as strings or numbers).
+    outPath : str, optional
+        Output store directory. Defaults to the pickle path with the
+        extension replaced by '.flagged'.
+
+    Returns
+    -------
+    str
+        Path to the written store directory.
+
+    Notes
+    -----
+    The store directory contains:
+    - freqs.npy : float64 array with every flagged frequency, concatenated
+    - offsets.npy : int64 array of length nfiles+1 into freqs
+    - names.npy : unicode array with the file names
+    - meta.json : format version and array sizes
+    """
+    if outPath is None:
+        outPath = os.path.splitext(pklPath)[0] + '.flagged'
+    os.makedirs(outPath, exist_ok=True)
+
+    with open(pklPath, 'rb') as f:
+        flaggedFiles = pickle.load(f)
+
+    names = np.asarray(flaggedFiles['file name'], dtype=str)
+    freqList = flaggedFiles['flagged frequency']
+
+    offsets = np.zeros(len(names)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(freq) for freq in freqList])
+
+    # write the frequencies straight into the memory-mapped output so the
+    # converted copy never has to exist in memory all at once
+    freqs = np.lib.format.open_memmap(os.path.join(outPath, 'freqs.npy'), mode='w+', dtype=np.float64, shape=(int(offsets[-1]),))
+    for ii, freq in enumerate(freqList):
+        freqs[offsets[ii]:offsets[ii+1]] = np.asarray(freq).astype(float)
+    freqs.flush()
+    del freqs
+
+    np.save(os.path.join(outPath, 'offsets.npy'), offsets)
+    np.save(os.path.join(outPath, 'names.npy'), names)
+
+    with open(os.path.join(outPath, 'meta.json'), 'w') as f:
+        json.dump({'version' : 1, 'nfiles' : len(names), 'nfreqs' : int(offsets[-1])}, f)
+
+    print(f'Wrote {len(names)} files ({offsets[-1]} flagged frequencies) to {outPath}')
+    return outPath
+
+class FlaggedFiles:
+    """
+    Read-only, zero-copy view of a columnar flagged-files store.
+
+    Parameters
+    ----------
+    path : str, optional
+        Store directory written by convertFlaggedPickle. Resolved with
+        flaggedPath() if None.
+
+    Attributes
+    ----------
+    names : numpy.ndarray
+        Memory-mapped array of file names.
+    freqs : numpy.ndarray
+        Memory-mapped float64 array of all flagged frequencies in MHz.
+    offsets : numpy.ndarray
+        Memory-mapped int64 offsets; file i owns freqs[offsets[i]:offsets[i+1]].
+
+    Examples
+    --------
+    >>> store = FlaggedFiles("/data/flagged_files_2SD.flagged")
+    >>> store.fileNamesInRange(1590, 1610)
+    """
+
+    def __init__(self, path=None):
+        self.path = flaggedPath(path)
+        if not os.path.isdir(self.path):
+            raise IOError(f'No flagged-files store found at {self.path}, convert the pickle with convertFlaggedPickle first')
+
+        self.names = np.load(os.path.join(self.path, 'names.npy'), mmap_mode='r')
+        self.freqs = np.load(os.path.join(self.path, 'freqs.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(self.path, 'offsets.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, ii):
+        return self.names[ii], self.freqs[self.offsets[ii]:self.offsets[ii+1]]
+
+    def fileIndicesInRange(self, fmin, fmax, blockSize=2**24):
+        """
+        Indices of files with at least one flagged frequency in (fmin, fmax) MHz.
+
+        The frequency buffer is scanned in blocks of blockSize values so the
+        temporary mask stays small no matter how large the store is.
+        """
+        owners = []
+        for start in range(0, len(self.freqs), blockSize):
+            block = self.freqs[start:start+blockSize]
+            hits = np.flatnonzero((block > fmin) & (block < fmax)) + start
+
+            # map each matching frequency back to the file that owns it
+            owners.append(np.unique(np.searchsorted(self.offsets, hits, side='right') - 1))
+
+        if len(owners) == 0:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(owners))
+
+    def fileNamesInRange(self, fmin, fmax):
+        """
+        Names of files with at least one flagged frequency in (fmin, fmax) MHz.
+        """
+        return [str(name) for name in self.names[self.fileIndicesInRange(fmin, fmax)]]
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Convert the flagged-files pickle into a memory-mapped columnar store')
+    parser.add_argument('pickle', help='Path to the flagged files pickle')
+    parser.add_argument('--out', help='Output store directory, defaults to the pickle path with a .flagged extension', default=None)
+    args = parser.parse_args(argv)
+
+    convertFlaggedPickle(args.pickle, args.out)
+
+if __name__ == '__main__':
+    sys.exit(main())
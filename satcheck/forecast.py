@@ -0,0 +1,296 @@
+#imports
+import os, sys, time
+import numpy as np
+import argparse
+
+from .findSatsHelper import tle_filename, dayTLEFiles, parseRaDec, angularSeparation, precessionMatrix, rotateRaDec
+from .sgp4Tools import GBT_SITE, readTLELines, satrecArray, topocentric, maxAngularMotion
+
+'''
+Forecast satellite passes for a planned observing schedule.
+
+Every slot of the schedule is checked the same way separation() checks a
+recorded file (samples every second, separation threshold in degrees), but the
+whole catalog is propagated with sgp4 in a few vectorized passes. Satellites
+are first sampled coarsely; a satellite is only sampled more finely for a slot
+if, allowing for the furthest it could have moved between samples, it could
+have come within the threshold of the target. Only the few satellites that
+survive every level are evaluated every second, so the result is the same as
+evaluating everything every second.
+'''
+
+# coarse sampling intervals (s) used to discard satellites before the final pass
+DEFAULT_REFINE_STEPS = (300, 60, 10)
+
+def readSchedule(path):
+    """
+    Read a planned observing schedule.
+
+    Parameters
+    ----------
+    path : str
+        CSV file with columns 'target', 'ra', 'dec', 'start' and optionally
+        'duration' (seconds, default 300). RA/Dec are degrees or header style
+        strings ("4h12m00s", "+12d30m00s"); start is an MJD or any date string
+        astropy understands (e.g. "2020-05-31T04:48:00").
+
+    Returns
+    -------
+    pandas.DataFrame
+        The schedule with the added columns 'mjd', 'raRad' and 'decRad'.
+
+    Raises
+    ------
+    ValueError
+        If a required column is missing.
+    """
+    import pandas as pd
+    from astropy.time import Time
+
+    schedule = pd.read_csv(path, skipinitialspace=True, dtype={'ra' : str, 'dec' : str, 'start' : str})
+    schedule.columns = [c.strip().lower() for c in schedule.columns]
+
+    missing = [c for c in ('target', 'ra', 'dec', 'start') if c not in schedule.columns]
+    if missing:
+        raise ValueError(f'Schedule {path} is missing the columns {missing}')
+    if 'duration' not in schedule.columns:
+        schedule['duration'] = 300.0
+
+    def toMjd(start):
+        try:
+            return float(start)
+        except ValueError:
+            return Time(start).mjd
+
+    schedule['mjd'] = [toMjd(start) for start in schedule['start']]
+    coords = [parseRaDec(ra, dec) for ra, dec in zip(schedule['ra'], schedule['dec'])]
+    schedule['raRad'] = [c[0] for c in coords]
+    schedule['decRad'] = [c[1] for c in coords]
+    schedule['duration'] = schedule['duration'].astype(float)
+
+    return schedule
+
+def forecastTLEs(start_mjd, n=None, spacetrack_account=None, spacetrack_password=None, work_dir=None):
+    """
+    Latest TLE files available for a schedule starting at start_mjd.
+
+    Uses the TLEs of the day before the schedule starts, or of yesterday if the
+    schedule is in the future: the day's full TLE file or, if only selected
+    satellites were downloaded that day, their files (see dayTLEFiles). The
+    full file is downloaded into work_dir if there are none.
+
+    Returns
+    -------
+    list of str
+    """
+    from astropy.time import Time
+
+    # Set work directory, default to current working directory
+    if work_dir is None:
+        work_dir = os.getcwd()
+
+    mjd = min(start_mjd, Time.now().mjd) - 1
+    paths = dayTLEFiles(mjd, work_dir)
+    if not paths:
+        from .findSats import downloadTLEs
+        downloadTLEs([], n, spacetrack_account, spacetrack_password, work_dir=work_dir, start_time_mjd=[mjd])
+        paths = [tle_filename(mjd, work_dir)]
+    return paths
+
+def _sampleOffsets(duration, step, interval):
+    # samples at most interval apart covering the same span as the fine samples
+    nsamples = int(np.ceil(max(duration - step, 0) / interval)) + 1
+    offsets = np.linspace(step, max(duration, step), nsamples)
+    spacing = offsets[1] - offsets[0] if nsamples > 1 else 0
+    return offsets, spacing / 2
+
+def _candidates(sep, margin, threshold):
+    # could the satellite have been within threshold anywhere between samples
+    closest = np.where(np.isnan(sep), np.inf, sep - margin)
+    return closest.min(axis=1) < threshold
+
+def forecastSchedule(schedule, tle_file, threshold=3, step=1, refineSteps=DEFAULT_REFINE_STEPS, site=GBT_SITE, maxElements=2**22):
+    """
+    Predict the satellite passes through every slot of an observing schedule.
+
+    Parameters
+    ----------
+    schedule : pandas.DataFrame
+        Output of readSchedule.
+    tle_file : str or list of str
+        TLE file(s) to propagate (see forecastTLEs).
+    threshold : float, default=3
+        Separation in degrees below which a satellite counts as contaminating.
+    step : float, default=1
+        Sampling interval in seconds of the final check, as in separation().
+    refineSteps : tuple of float, default=(300, 60, 10)
+        Decreasing coarse sampling intervals used to discard satellites.
+    site : dict, default=GBT_SITE
+        Observer 'lat', 'lon' (degrees) and 'elevation' (m).
+    maxElements : int, default=2**22
+        Bound on the satellite-time pairs propagated at once in the first level.
+
+    Returns
+    -------
+    tuple of (pandas.DataFrame, pandas.DataFrame)
+        The slots ranked by predicted contamination, with the added columns
+        'contaminatedSeconds', 'contaminatedFraction', 'nSatellites',
+        'minSeparation' and 'closestSatellite', and one row per predicted pass
+        with 'slot', 'target', 'satellite', 'minSeparation', 'minTime'
+        (seconds after start) and 'samples'.
+    """
+    import pandas as pd
+    from sgp4.api import SatrecArray
+
+    tles = {}
+    for path in np.atleast_1d(tle_file):
+        tles.update(readTLELines(str(path)))
+    names, sats, allSats = satrecArray(tles)
+    thr = np.deg2rad(threshold)
+    nslots = len(schedule)
+    mjds = schedule['mjd'].to_numpy()
+    durations = schedule['duration'].to_numpy()
+    # sgp4 positions are in TEME, so precess each J2000 target to the date of its slot
+    ras, decs = np.array([rotateRaDec(ra, dec, precessionMatrix(mjd))
+                          for ra, dec, mjd in zip(schedule['raRad'], schedule['decRad'], mjds)]).reshape(nslots, 2).T
+
+    # first level: the whole catalog, on the union of the coarse samples of as
+    # many slots at a time as fit in maxElements
+    candidates = [None] * nslots
+    groupSize = max(1, maxElements // max(len(sats), 1))
+    slot = 0
+    while slot < nslots:
+        group, times = [], []
+        while slot < nslots and (len(group) == 0 or sum(len(t) for t in times) < groupSize):
+            offsets, half = _sampleOffsets(durations[slot], step, refineSteps[0])
+            group.append((slot, half))
+            times.append(np.round((mjds[slot] + offsets / 86400) * 86400e6))
+            slot += 1
+
+        uniqueTimes, inverse = np.unique(np.concatenate(times), return_inverse=True)
+        ra, dec, dist, speed = topocentric(allSats, uniqueTimes / 86400e6, site)
+
+        start = 0
+        for (ii, half), t in zip(group, times):
+            cols = inverse[start:start+len(t)]
+            start += len(t)
+            sep = angularSeparation(ra[:, cols], dec[:, cols], ras[ii], decs[ii])
+            margin = maxAngularMotion(dist[:, cols], speed[:, cols], half)
+            candidates[ii] = np.flatnonzero(_candidates(sep, margin, thr))
+
+    # finer levels and the final check, slot by slot on the survivors only
+    slotStats, passes = [], []
+    for ii in range(nslots):
+        cand = candidates[ii]
+        for interval in refineSteps[1:]:
+            if len(cand) == 0:
+                break
+            offsets, half = _sampleOffsets(durations[ii], step, interval)
+            ra, dec, dist, speed = topocentric(SatrecArray([sats[jj] for jj in cand]), mjds[ii] + offsets / 86400, site)
+            sep = angularSeparation(ra, dec, ras[ii], decs[ii])
+            cand = cand[_candidates(sep, maxAngularMotion(dist, speed, half), thr)]
+
+        offsets = np.arange(1, int(durations[ii] / step) + 1) * step
+        contaminated = np.zeros(len(offsets), dtype=bool)
+        slotPasses = []
+        if len(cand) > 0:
+            ra, dec, _, _ = topocentric(SatrecArray([sats[jj] for jj in cand]), mjds[ii] + offsets / 86400, site)
+            sep = np.rad2deg(angularSeparation(ra, dec, ras[ii], decs[ii]))
+            close = sep < threshold
+            contaminated = close.any(axis=0)
+            for kk in np.flatnonzero(close.any(axis=1)):
+                best = int(np.argmin(np.where(close[kk], sep[kk], np.inf)))
+                slotPasses.append({'slot' : ii,
+                                   'target' : schedule['target'].iloc[ii],
+                                   'satellite' : names[cand[kk]],
+                                   'minSeparation' : float(sep[kk, best]),
+                                   'minTime' : float(offsets[best]),
+                                   'samples' : int(close[kk].sum())})
+        passes.extend(slotPasses)
+
+        closest = min(slotPasses, key=lambda p: p['minSeparation']) if slotPasses else None
+        slotStats.append({'contaminatedSeconds' : float(contaminated.sum() * step),
+                          'contaminatedFraction' : float(contaminated.mean()) if len(contaminated) else 0.0,
+                          'nSatellites' : len(slotPasses),
+                          'minSeparation' : closest['minSeparation'] if closest else np.nan,
+                          'closestSatellite' : closest['satellite'] if closest else ''})
+
+    slots = pd.concat([schedule.drop(columns=['raRad', 'decRad']).reset_index(drop=True), pd.DataFrame(slotStats)], axis=1)
+    slots.insert(0, 'slot', np.arange(nslots))
+    slots = slots.sort_values(['contaminatedFraction', 'minSeparation'], ascending=[False, True], na_position='last').reset_index(drop=True)
+
+    passes = pd.DataFrame(passes, columns=['slot', 'target', 'satellite', 'minSeparation', 'minTime', 'samples'])
+
+    return slots, passes
+
+def forecast(schedule_file, tle_file=None, threshold=3, work_dir=None, n=None, spacetrack_account=None, spacetrack_password=None):
+    """
+    Rank the slots of an observing schedule by predicted satellite contamination.
+
+    Parameters
+    ----------
+    schedule_file : str
+        Schedule CSV, see readSchedule.
+    tle_file : str or list of str, optional
+        TLE file(s) to use. If None, the latest TLEs available for the schedule
+        are used, downloaded into work_dir if needed (see forecastTLEs).
+    threshold : float, default=3
+        Separation in degrees below which a satellite counts as contaminating.
+    work_dir : str, optional
+        Output directory for forecast.csv and forecast_passes.csv. If None,
+        uses current working directory.
+    n : int, optional
+        Number of Space-Track queries, chosen automatically by default.
+    spacetrack_account, spacetrack_password : str, optional
+        Space-Track.org credentials, defaulting to SPACETRACK_ACCT and SPACETRACK_PASS.
+
+    Returns
+    -------
+    tuple of (pandas.DataFrame, pandas.DataFrame)
+        Ranked slots and predicted passes, see forecastSchedule.
+
+    Examples
+    --------
+    >>> slots, passes = forecast("tonight.csv", work_dir="/output/")
+    >>> slots[['target', 'start', 'contaminatedFraction', 'closestSatellite']].head()
+    """
+
+    # Set work directory, default to current working directory
+    if work_dir is None:
+        work_dir = os.getcwd()
+    os.makedirs(work_dir, exist_ok=True)
+
+    schedule = readSchedule(schedule_file)
+    if tle_file is None:
+        tle_file = forecastTLEs(schedule['mjd'].min(), n, spacetrack_account, spacetrack_password, work_dir=work_dir)
+
+    t0 = time.perf_counter()
+    slots, passes = forecastSchedule(schedule, tle_file, threshold=threshold)
+    print(f'Forecast {len(slots)} slots against {", ".join(str(path) for path in np.atleast_1d(tle_file))} in {time.perf_counter() - t0:.2f} s')
+
+    slotsPath = os.path.join(work_dir, 'forecast.csv')
+    passesPath = os.path.join(work_dir, 'forecast_passes.csv')
+    slots.to_csv(slotsPath, index=False)
+    passes.to_csv(passesPath, index=False)
+    print(f"Ranked slots saved to: {slotsPath}")
+    print(f"Predicted passes saved to: {passesPath}")
+
+    return slots, passes
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Rank the slots of a planned observing schedule by predicted satellite contamination')
+    parser.add_argument('schedule', help='CSV with columns target, ra, dec, start (MJD or ISO date) and duration (s)')
+    parser.add_argument('--tle', help='TLE file to use, defaults to the latest TLEs for the schedule', default=None)
+    parser.add_argument('--threshold', help='separation in degrees below which a satellite contaminates a slot', default=3, type=float)
+    parser.add_argument('--work_dir', help='output directory, defaults to current working directory', default=None)
+    parser.add_argument('--n', help='split the NORAD ids into exactly n Space-Track queries, chosen automatically by default', default=None, type=int)
+    parser.add_argument('--spacetrack_account', help='Space-Track.org account, defaults to $SPACETRACK_ACCT', default=None)
+    parser.add_argument('--spacetrack_password', help='Space-Track.org password, defaults to $SPACETRACK_PASS', default=None)
+    args = parser.parse_args(argv)
+
+    forecast(args.schedule, args.tle, threshold=args.threshold, work_dir=args.work_dir, n=args.n,
+             spacetrack_account=args.spacetrack_account, spacetrack_password=args.spacetrack_password)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,43 +1,35 @@
 #imports
-import os, sys, glob
-
-import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
+import os, sys
 import argparse
 
-from blimpy import Waterfall
-from turbo_seti.find_event.plot_event import plot_waterfall
-
-from genPlotsAll import plotWfSep
+from .passIndex import PassIndex, indexPath
+from .genPlotsAll import plotH5, plotSep
 
-def main():
+def main(argv=None):
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--target', help='Name of target file to plot', default=False)
-    parser.add_argument('--dir', help='Directory of target file', default=os.getcwd())
-    args = parser.parse_args()
-
-    csvs = glob.glob(args.dir+'/*separation*0000*.csv')
-
-    affectedFiles = pd.read_csv(args.dir+'/files_affected_by_sats.csv')
-    h5Files = np.array(affectedFiles['filepath'])
-    h5Files = h5Files[affectedFiles['satellite?'] == True]
-
-    h5Path = None
-    csvPath = None
-    for h5, csv in zip(h5Files, csvs):
-        if h5.find(args.target)!=-1 and h5.find('0000')!=-1:
-            h5Path = h5
-            csvPath = csv
-            break
-
-    try:
-        plotWfSep(csv, h5)
-    except Exception as e:
-        print(e)
-        print()
+    parser.add_argument('--dir', help='work_dir of the findSats run, plots are saved here too', default=os.getcwd())
+    parser.add_argument('--memLim', help='Memory limit for reading in the h5 file', default=40, type=float)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(indexPath(args.dir)):
+        raise IOError(f'No pass index found in {args.dir}, run findSats first')
+
+    # look the target's passes up in the pass index instead of globbing the separation csvs
+    with PassIndex(args.dir) as index:
+        passes = index.passes(target=args.target)
+    passes = passes[passes['filepath'].str.contains('0000')]
+
+    if len(passes) == 0:
         raise ValueError('Target name was either mistyped or was not affected by satellites')
 
+    h5Path = passes['filepath'].iloc[0]
+    csvPaths = list(passes.loc[passes['filepath'] == h5Path, 'csvPath'].dropna())
+
+    plotH5(csvPaths, h5Path, memLim=args.memLim, work_dir=args.dir)
+    for csvPath in csvPaths:
+        plotSep(csvPath, work_dir=args.dir)
+
 if __name__ == '__main__':
     sys.exit(main())
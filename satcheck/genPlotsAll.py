@@ -1,16 +1,16 @@
 #imports
-import os, sys, glob, ast
+import os, sys, ast
 
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
 
-from blimpy import Waterfall
-from turbo_seti.find_event.plot_event import plot_waterfall
-from blimpy.io.hdf_reader import H5Reader
+from .metrics import stage, count, useMetrics, addMetricsArgs, metricsFromArgs, writeMetricsFromArgs
 
-import matplotlib as mpl
-mpl.rcParams['agg.path.chunksize'] = 10000
+def _pyplot():
+    # matplotlib is only imported once something is plotted
+    import matplotlib as mpl
+    mpl.rcParams['agg.path.chunksize'] = 10000
+    import matplotlib.pyplot as plt
+    return plt
 
 def band(file, tol=0.7):
     """
@@ -59,6 +59,8 @@ def band(file, tol=0.7):
     ...     print(f"X-band observation: {band_info[0]}-{band_info[1]} GHz")
     """
 
+    from blimpy.io.hdf_reader import H5Reader
+
     L = [1.10, 1.90]
     S = [1.80, 2.80]
     C = [4.00, 7.80]
@@ -173,6 +175,9 @@ def plotH5(satCsv, h5Path, memLim=20, work_dir=None):
     >>> plotH5(["satellite_separation.csv"], "obs.h5")
     """
 
+    from blimpy import Waterfall
+    plt = _pyplot()
+
     # Set work directory, default to current working directory
     if work_dir is None:
         work_dir = os.getcwd()
@@ -242,6 +247,9 @@ def plotSep(satCsv, work_dir=None):
     >>> plotSep("satellite_separation_data.csv")
     """
 
+    import pandas as pd
+    plt = _pyplot()
+
     # Set work directory, default to current working directory
     if work_dir is None:
         work_dir = os.getcwd()
@@ -265,7 +273,7 @@ def plotSep(satCsv, work_dir=None):
     minpoint = min(sep)
 
     minindex = np.where(sep == minpoint)[0] #df['Separation'].index(minpoint)
-    mintime = int(time[minindex])
+    mintime = int(time.iloc[minindex[0]])
 
     ax.scatter(minpoint, mintime, s = 50, label = 'Min: ' + str("%.5fdeg" % minpoint) + ', ' + str(mintime) + "s", color='orange')
 
@@ -274,36 +282,195 @@ def plotSep(satCsv, work_dir=None):
     fig.savefig(plot_path, bbox_inches='tight', transparent=False)
     plt.close(fig)
 
-def main():
+# waterfalls of the files with the closest passes are plotted first
+BAND_ORDER = ('L', 'S', 'C', 'X')
+CLOSENESS_STEP = 0.1
+SKIPPED_FILE = 'plots_skipped.csv'
 
-    import argparse
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--h5Dir', help='Directory with h5 files to run on', default=None)
-    parser.add_argument('--memLim', help='Memory limit for reading in the h5 files', default=40)
-    parser.add_argument('--work_dir', help='directory to store output files, defaults to current working directory', default=None)
-    args = parser.parse_args()
+def bandName(h5Path):
+    """
+    Name ('L', 'S', 'C' or 'X') of the band of an observation, 'NA' if it is
+    none of them or the file cannot be read.
+    """
+    try:
+        b = band(h5Path)
+    except Exception:
+        return 'NA'
+    names = {(1.10, 1.90) : 'L', (1.80, 2.80) : 'S', (4.00, 7.80) : 'C', (7.80, 11.20) : 'X'}
+    return 'NA' if isinstance(b, str) else names.get(tuple(b), 'NA')
+
+def planPlots(affectedFiles, h5Dir=None, bandOrder=BAND_ORDER):
+    """
+    Order the plotting jobs of a findSats run by how useful their plots are.
+
+    Every affected file is one job: its waterfall and the separation plots of
+    its passes. Jobs are ranked by their closest pass, in steps of
+    CLOSENESS_STEP degrees, then by their number of passes and then by band.
+
+    Parameters
+    ----------
+    affectedFiles : pandas.DataFrame
+        files_affected_by_sats.csv as written by findSats, or a skipped-plots
+        log written by plotAll.
+    h5Dir : str, optional
+        Directory the h5 files have been moved to; files are matched by name.
+    bandOrder : sequence of str, default=BAND_ORDER
+        Bands from most to least interesting.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per job, in plotting order, with 'filepath', 'csvPaths' (list),
+        'minSeparation', 'npasses' and 'band'.
+    """
+    import pandas as pd
+
+    def parse(value):
+        if isinstance(value, str):
+            try:
+                return ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                return []
+        return value if isinstance(value, list) else []
+
+    jobs = []
+    for row in affectedFiles.itertuples(index=False):
+        csvPaths = parse(row.csvPaths)
+        if len(csvPaths) == 0:
+            continue
+        minSeparation = parse(row.minSeparation)
+        minSeparation = min(minSeparation) if isinstance(minSeparation, list) and minSeparation else float(row.minSeparation)
+
+        h5Path = row.filepath
+        if h5Dir:
+            h5Path = os.path.join(h5Dir, os.path.basename(h5Path))
+        jobs.append({'filepath' : h5Path, 'csvPaths' : csvPaths, 'minSeparation' : minSeparation,
+                     'npasses' : len(csvPaths), 'band' : bandName(h5Path)})
+
+    jobs = pd.DataFrame(jobs, columns=['filepath', 'csvPaths', 'minSeparation', 'npasses', 'band'])
+    if len(jobs) == 0:
+        return jobs
+
+    bandRank = {name : ii for ii, name in enumerate(bandOrder)}
+    jobs['_closeness'] = np.floor(jobs['minSeparation'] / CLOSENESS_STEP)
+    jobs['_band'] = [bandRank.get(b, len(bandOrder)) for b in jobs['band']]
+    jobs = jobs.sort_values(['_closeness', 'npasses', '_band', 'minSeparation'], ascending=[True, False, True, True], kind='stable')
+    return jobs.drop(columns=['_closeness', '_band']).reset_index(drop=True)
+
+def plotAll(work_dir=None, h5Dir=None, memLim=40, timeBudget=None, maxPlots=None, resume=False, bandOrder=BAND_ORDER):
+    """
+    Plot the waterfalls and separations of a findSats run, most useful first.
+
+    Jobs are ordered by planPlots and plotted until the time budget or the
+    maximum number of waterfalls is reached. Jobs not plotted, or whose plots
+    failed, are written to work_dir/plots_skipped.csv for a later run with
+    resume=True.
+
+    Parameters
+    ----------
+    work_dir : str, optional
+        work_dir of the findSats run, plots are saved here too. Defaults to
+        the current directory.
+    h5Dir : str, optional
+        Directory the h5 files have been moved to.
+    memLim : float, default=40
+        Memory limit in GB for loading each observation.
+    timeBudget : float, optional
+        Seconds to spend plotting. A job is only started if it is expected to
+        finish (from the average time of the jobs so far) within the budget.
+    maxPlots : int, optional
+        Largest number of files (waterfalls) to plot.
+    resume : bool, default=False
+        Plot the jobs skipped by an earlier run instead of every affected file.
+    bandOrder : sequence of str, default=BAND_ORDER
+        Bands from most to least interesting.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The skipped jobs, with the 'reason' each was skipped.
+
+    Examples
+    --------
+    >>> skipped = plotAll("/output/", timeBudget=600)
+    >>> skipped = plotAll("/output/", resume=True)
+    """
+    import time
+    import pandas as pd
 
     # Set work directory, default to current working directory
-    work_dir = args.work_dir if args.work_dir else os.getcwd()
+    if work_dir is None:
+        work_dir = os.getcwd()
     os.makedirs(work_dir, exist_ok=True)
 
-    affectedFiles = pd.read_csv(os.path.join(work_dir, 'files_affected_by_sats.csv'))
+    skippedPath = os.path.join(work_dir, SKIPPED_FILE)
+    source = skippedPath if resume else os.path.join(work_dir, 'files_affected_by_sats.csv')
+    if resume and not os.path.exists(skippedPath):
+        print(f'No skipped plots in {work_dir}')
+        return pd.DataFrame(columns=['filepath', 'csvPaths', 'minSeparation', 'npasses', 'band', 'reason'])
+
+    with stage('plot_planning'):
+        jobs = planPlots(pd.read_csv(source), h5Dir=h5Dir, bandOrder=bandOrder)
+    print(f'{len(jobs)} files to plot')
+
+    t0 = time.perf_counter()
+    durations = []
+    skipped = []
+    for job in jobs.itertuples(index=False):
+
+        # stop once the limits are reached, but log what is left
+        if maxPlots is not None and len(durations) >= maxPlots:
+            skipped.append(job + ('max plots',))
+            continue
+        elapsed = time.perf_counter() - t0
+        expected = np.mean(durations) if durations else 0
+        if timeBudget is not None and elapsed + expected > timeBudget:
+            skipped.append(job + ('time budget',))
+            continue
+
+        print(f'Plotting for {job.filepath} (closest pass {job.minSeparation:.3f} degrees, {job.npasses} passes, {job.band} band)')
+        start = time.perf_counter()
+        try:
+            with stage('plot_waterfall'):
+                plotH5(job.csvPaths, job.filepath, memLim=memLim, work_dir=work_dir)
+            count('waterfall_plots')
+            for csv in job.csvPaths:
+                with stage('plot_separation'):
+                    plotSep(csv, work_dir=work_dir)
+                count('separation_plots')
+        except Exception as e:
+            print(f'Could not plot {job.filepath}: {e}')
+            skipped.append(job + (f'error: {e}',))
+        durations.append(time.perf_counter() - start)
+
+    skipped = pd.DataFrame(skipped, columns=list(jobs.columns) + ['reason'])
+    count('plots_skipped', len(skipped))
+    if len(skipped) > 0:
+        skipped.to_csv(skippedPath, index=False)
+        print(f'Skipped {len(skipped)} files, listed in {skippedPath}; plot them later with --resume')
+    elif os.path.exists(skippedPath):
+        os.remove(skippedPath)
+
+    return skipped
+
+def main(argv=None):
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--h5Dir', help='Directory with h5 files to run on', default=None)
+    parser.add_argument('--memLim', help='Memory limit for reading in the h5 files', default=40, type=float)
+    parser.add_argument('--work_dir', help='directory to store output files, defaults to current working directory', default=None)
+    parser.add_argument('--time-budget', help='seconds to spend plotting, the closest passes are plotted first', default=None, type=float)
+    parser.add_argument('--max-plots', help='largest number of files to plot, the closest passes first', default=None, type=int)
+    parser.add_argument('--resume', help='plot the files skipped by an earlier run (work_dir/plots_skipped.csv)', action='store_true')
+    addMetricsArgs(parser)
+    args = parser.parse_args(argv)
 
-    csvs = np.array([ast.literal_eval(x) for x in affectedFiles['csvPaths']])
+    metrics = metricsFromArgs(args)
+    with useMetrics(metrics):
+        plotAll(args.work_dir, args.h5Dir, memLim=args.memLim, timeBudget=args.time_budget, maxPlots=args.max_plots, resume=args.resume)
 
-    if not args.h5Dir:
-        h5Files = np.array(affectedFiles['filepath'])
-        h5Files = h5Files[affectedFiles['satellite?'] == True]
-    else:
-        if args.h5Dir[-1] != '/':
-            args.h5Dir += '/'
-        h5Files = glob.glob(args.h5Dir + '*.h5')
-
-    for csvList, h5 in zip(csvs, h5Files):
-        print(f'Plotting for {h5}')
-        plotH5(csvList, h5, memLim=args.memLim, work_dir=work_dir)
-        for csv in csvList:
-            plotSep(csv, work_dir=work_dir)
+    writeMetricsFromArgs(metrics, args)
 
 
 if __name__ == '__main__':
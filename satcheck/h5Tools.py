@@ -0,0 +1,113 @@
+'''
+Small helpers for reading Breakthrough Listen HDF5 (FBH5) files in pieces with
+h5py, without going through blimpy and without loading the full data array.
+'''
+
+def h5pyModule():
+    """
+    Import h5py on first use, registering the bitshuffle/lz4 filters used by
+    Breakthrough Listen h5 files if hdf5plugin is installed.
+    """
+    import h5py
+    try:
+        # imported for its side effect of registering the filters with h5py
+        import hdf5plugin
+    except ImportError:
+        pass
+    return h5py
+
+# width of a GBT Breakthrough Listen coarse channel in MHz (187.5 MHz / 64)
+COARSE_CHAN_BW = 2.9296875
+
+def readH5Header(h5Path):
+    """
+    Read the filterbank header stored as attributes of the 'data' dataset.
+
+    Parameters
+    ----------
+    h5Path : str
+        Path to HDF5 observation file.
+
+    Returns
+    -------
+    dict
+        Header keywords (e.g. 'tstart', 'tsamp', 'fch1', 'foff', 'nchans')
+        plus 'shape' and 'chunks' of the data array.
+    """
+    h5py = h5pyModule()
+
+    with h5py.File(h5Path, 'r') as f:
+        dset = f['data']
+        hdr = {}
+        for key, val in dset.attrs.items():
+            if isinstance(val, bytes):
+                val = val.decode()
+            hdr[key] = val
+        hdr['shape'] = dset.shape
+        hdr['chunks'] = dset.chunks
+
+    return hdr
+
+def fineChannelsPerCoarse(hdr, coarseBw=COARSE_CHAN_BW):
+    """
+    Number of fine channels in each coarse channel of an observation.
+
+    Parameters
+    ----------
+    hdr : dict
+        Header from readH5Header.
+    coarseBw : float, default=2.9296875
+        Coarse channel width in MHz.
+
+    Returns
+    -------
+    int
+        Fine channels per coarse channel. Falls back to nchans (the whole band
+        as one channel) if the coarse width does not divide the band evenly.
+    """
+    nchans = int(hdr['nchans'])
+    nfpc = int(round(coarseBw / abs(hdr['foff'])))
+    if nfpc < 1 or nchans % nfpc != 0:
+        return nchans
+    return nfpc
+
+def iterBlocks(dset, rowStart, rowStop, chanStart=0, chanStop=None, maxBytes=64*2**20, chanAlign=1):
+    """
+    Iterate over a (time, pol, freq) dataset in blocks of bounded size.
+
+    Parameters
+    ----------
+    dset : h5py.Dataset
+        The 'data' dataset of an observation file.
+    rowStart, rowStop : int
+        Range of time rows to read.
+    chanStart, chanStop : int, optional
+        Range of frequency channels to read. Defaults to all channels.
+    maxBytes : int, default=64 MiB
+        Upper bound on the size of each block.
+    chanAlign : int, default=1
+        Frequency blocks are a multiple of this many channels (e.g. the
+        number of fine channels per coarse channel), even if one aligned
+        block is larger than maxBytes.
+
+    Yields
+    ------
+    tuple of (int, int, numpy.ndarray)
+        First row and first channel of the block, and the block itself.
+    """
+    if chanStop is None:
+        chanStop = dset.shape[2]
+
+    itemBytes = dset.dtype.itemsize * dset.shape[1]
+    nchan = chanStop - chanStart
+
+    # read whole rows when they fit, otherwise split the band into aligned pieces
+    chanStep = min(nchan, max(1, maxBytes // itemBytes))
+    chanStep = max(chanAlign, chanStep - chanStep % chanAlign)
+    rowStep = max(1, maxBytes // (itemBytes * chanStep))
+
+    for r0 in range(rowStart, rowStop, rowStep):
+        r1 = min(r0 + rowStep, rowStop)
+        for c0 in range(chanStart, chanStop, chanStep):
+            c1 = min(c0 + chanStep, chanStop)
+            yield r0, c0, dset[r0:r1, :, c0:c1]
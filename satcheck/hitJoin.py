@@ -0,0 +1,381 @@
+import os, sys, re, glob
+import numpy as np
+import argparse
+
+from .findSatsHelper import dayTLEFiles
+from .passIndex import PassIndex
+from .sgp4Tools import GBT_SITE, readTLELines, topocentricVectors
+from .sites import siteNamed
+from .metrics import stage, count
+
+'''
+Join turboSETI hits with the satellite passes found by findSats.
+
+Every hit of a .dat file has a time span (the observation it was found in), a
+frequency and a drift rate. A hit is only explained by a satellite if a pass
+overlaps it in time, and a satellite transmitter only drifts the way the
+Doppler shift of its pass makes it drift:
+
+    drift = -f * (d^2 range / dt^2) / c
+
+so the drift expected from every pass is computed once, from the same TLEs
+findSats used, and each hit is tagged with the passes it overlaps and whether
+its drift rate is consistent with one of them.
+
+Passes are indexed by (file, start time): sorted on the file they were found
+in and then on their start, every hit's candidates are one contiguous block
+found with a binary search, so the join is a few array operations however
+many hits there are. Hits are joined and written in batches, which keeps
+memory bounded for a season of .dat files.
+'''
+
+HITS_FILE = 'hits_tagged.csv'
+SPEED_OF_LIGHT = 299792.458 # km/s
+# hits are joined and written this many at a time
+BATCH_SIZE = 1_000_000
+# a hit's drift may be this many drift resolutions away from the expected range
+DRIFT_TOLERANCE_STEPS = 2
+DAT_COLUMNS = ['hit', 'driftRate', 'snr', 'frequency', 'correctedFrequency', 'index', 'freqStart', 'freqEnd']
+# columns written by tagHits; formatting floats dominates writing millions of hits
+TAGGED_COLUMNS = ['datFile', 'hit', 'driftRate', 'snr', 'frequency', 'npasses', 'satelliteConsistent', 'pass', 'satellite',
+                  'norad', 'minSeparation', 'expectedDriftMin', 'expectedDriftMax']
+
+def readDat(path):
+    """
+    Read the hits of a turboSETI .dat file.
+
+    Parameters
+    ----------
+    path : str
+        Path to a .dat file written by turboSETI's FindDoppler.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per hit with the columns of DAT_COLUMNS (frequencies in MHz,
+        drift rates in Hz/s), plus 'file' (the h5 file name of the 'File ID'
+        header), 'start' and 'stop' (MJD) and 'driftResolution' (Hz/s).
+    """
+    import pandas as pd
+
+    header = {}
+    with open(path) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            for key, value in re.findall(r'([A-Za-z_ ]+?(?:\(Hz\))?):\s*(\S+)', line.lstrip('#')):
+                header[key.strip()] = value
+
+    hits = pd.read_csv(path, sep=r'\s+', comment='#', header=None, usecols=range(len(DAT_COLUMNS)), names=DAT_COLUMNS)
+
+    obsLength = float(header.get('obs_length', 0))
+    hits['file'] = os.path.basename(header.get('File ID', os.path.splitext(os.path.basename(path))[0] + '.h5'))
+    hits['start'] = float(header['MJD'])
+    hits['stop'] = hits['start'] + obsLength / 86400
+    hits['driftResolution'] = abs(float(header.get('DELTAF(Hz)', 0))) / obsLength if obsLength > 0 else 0.0
+    return hits
+
+def passDrifts(intervals, work_dir, step=1.0, site=None):
+    """
+    Range of the Doppler drift of every pass, per Hz of transmitted frequency.
+
+    Each file's passes are propagated together over the time they span.
+
+    Parameters
+    ----------
+    intervals : pandas.DataFrame
+        Passes with their 'start' and 'stop', as returned by PassIndex.intervals.
+    work_dir : str
+        Directory of the TLE files findSats used.
+    step : float, default=1.0
+        Time step in seconds.
+    site : dict, optional
+        Observer the passes were seen from. By default each pass is seen from
+        the site recorded with it in the pass index, or the GBT if it has none.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        Lowest and highest drift of each pass in Hz/s per Hz, NaN for passes
+        whose satellite is not in the TLE file of its day.
+    """
+    from sgp4.api import Satrec, SatrecArray
+
+    lowest = np.full(len(intervals), np.nan)
+    highest = np.full(len(intervals), np.nan)
+    days = {}
+    missing = 0
+
+    for _, group in intervals.groupby(['filepath', 'tstart'], sort=False):
+        # a selected run only has the TLE files of its selection
+        day = tuple(dayTLEFiles(group['tstart'].iloc[0], work_dir))
+        if day not in days:
+            days[day] = {name : lines for path in day for name, lines in readTLELines(path).items()}
+        tles = days[day]
+        groupSite = site if site is not None else _passSite(group)
+
+        rows = np.flatnonzero(group['satellite'].isin(tles.keys()).to_numpy())
+        missing += len(group) - len(rows)
+        if len(rows) == 0:
+            continue
+        sats = SatrecArray([Satrec.twoline2rv(*tles[name]) for name in group['satellite'].iloc[rows]])
+
+        # one step either side so the second derivative is centred at the ends
+        start = group['start'].to_numpy()[rows]
+        stop = group['stop'].to_numpy()[rows]
+        mjds = np.arange(start.min() - step/86400, stop.max() + 1.5*step/86400, step/86400)
+        topo, vel, err = topocentricVectors(sats, mjds, groupSite)
+
+        rangeRate = np.einsum('stc,stc->st', topo, vel) / np.linalg.norm(topo, axis=-1)
+        drift = -np.gradient(rangeRate, step, axis=1) / SPEED_OF_LIGHT
+        inPass = (mjds >= start[:, None] - 1e-9) & (mjds <= stop[:, None] + 1e-9) & (err == 0)
+
+        index = group.index.to_numpy()[rows]
+        lowest[index] = np.where(inPass, drift, np.inf).min(axis=1)
+        highest[index] = np.where(inPass, drift, -np.inf).max(axis=1)
+
+    if missing:
+        print(f'Warning: {missing} passes have no TLE in {work_dir}, their hits cannot be drift-checked')
+    lowest[~np.isfinite(lowest)] = np.nan
+    highest[~np.isfinite(highest)] = np.nan
+    return lowest, highest
+
+def _passSite(group):
+    # site recorded with a file's passes, the GBT for indices written before sites were
+    name = group['site'].iloc[0] if 'site' in group else None
+    return siteNamed(name) if isinstance(name, str) else GBT_SITE
+
+class PassIntervals:
+    """
+    Passes indexed by (file, start time), with their expected drift.
+
+    Parameters
+    ----------
+    intervals : pandas.DataFrame
+        Passes with their 'start' and 'stop', as returned by PassIndex.intervals.
+    lowest, highest : array_like
+        Drift range of every pass in Hz/s per Hz, as returned by passDrifts.
+
+    Examples
+    --------
+    >>> intervals = PassIndex("/output/").intervals()
+    >>> index = PassIntervals(intervals, *passDrifts(intervals, "/output/"))
+    >>> tagged = index.join(readDat("/data/blc00_guppi_58849_12345_TARGET_0001.gpuspec.0000.dat"))
+    """
+
+    def __init__(self, intervals, lowest, highest):
+        files = intervals['filepath'].map(os.path.basename).to_numpy()
+        self.files, codes = np.unique(files, return_inverse=True)
+
+        order = np.lexsort((intervals['start'].to_numpy(), codes))
+        self.codes = codes[order]
+        self.start = intervals['start'].to_numpy(dtype=float)[order]
+        # (file, start) as one sorted key: start relative to the file's first
+        # pass, offset by file, so each file's passes are one block of it
+        self.origin = np.full(len(self.files), np.nan)
+        self.origin[self.codes[::-1]] = self.start[::-1]
+        rel = self.start - self.origin[self.codes]
+        self.width = (rel.max() if len(rel) else 0) + 2
+        self.key = self.codes * self.width + rel
+        self.stop = intervals['stop'].to_numpy(dtype=float)[order]
+        self.lowest = np.asarray(lowest, dtype=float)[order]
+        self.highest = np.asarray(highest, dtype=float)[order]
+        self.minSeparation = intervals['minSeparation'].to_numpy(dtype=float)[order]
+        self.passId = intervals['id'].to_numpy()[order]
+        self.satellite = intervals['satellite'].to_numpy()[order]
+        self.norad = intervals['norad'].to_numpy()[order]
+
+    def candidates(self, files, start, stop):
+        """
+        Pairs of hits and the passes overlapping them.
+
+        Parameters
+        ----------
+        files : array_like of str
+            h5 file name of every hit.
+        start, stop : array_like
+            Time span (MJD) of every hit.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            Hit and (sorted) pass positions of every overlapping pair.
+        """
+        files = np.asarray(files)
+        if len(self.files) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        codes = np.searchsorted(self.files, files)
+        known = codes < len(self.files)
+        known[known] = self.files[codes[known]] == files[known]
+
+        # every pass of the hit's file from the first to the last starting
+        # before the hit ends is a candidate
+        codes = np.where(known, codes, 0)
+        first = np.searchsorted(self.codes, codes, 'left')
+        rel = np.clip(np.asarray(stop, dtype=float) - self.origin[codes], -0.5, self.width - 1)
+        ends = np.searchsorted(self.key, codes * self.width + rel, 'right')
+        counts = np.where(known, ends - first, 0)
+
+        hits = np.repeat(np.arange(len(files)), counts)
+        passes = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+
+        overlap = self.stop[passes] >= np.asarray(start)[hits]
+        return hits[overlap], passes[overlap]
+
+    def join(self, hits, tolerance=None):
+        """
+        Tag hits with the passes they overlap and whether their drift fits one.
+
+        Parameters
+        ----------
+        hits : pandas.DataFrame
+            Hits as returned by readDat.
+        tolerance : float, optional
+            Hz/s by which a drift rate may miss a pass's expected range,
+            defaults to DRIFT_TOLERANCE_STEPS drift resolutions of each hit.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The hits with 'npasses' (passes overlapping the hit),
+            'satelliteConsistent', and the pass that explains the hit best (a
+            consistent one first, then the closest): 'pass', 'satellite',
+            'norad', 'minSeparation', and 'expectedDriftMin' and
+            'expectedDriftMax' in Hz/s.
+        """
+        hitIdx, passIdx = self.candidates(hits['file'].to_numpy(), hits['start'].to_numpy(), hits['stop'].to_numpy())
+
+        freq = hits['frequency'].to_numpy(dtype=float)[hitIdx] * 1e6
+        expectedMin = freq * self.lowest[passIdx]
+        expectedMax = freq * self.highest[passIdx]
+        if tolerance is None:
+            tol = DRIFT_TOLERANCE_STEPS * hits['driftResolution'].to_numpy(dtype=float)[hitIdx]
+        else:
+            tol = np.full(len(hitIdx), float(tolerance))
+        drift = hits['driftRate'].to_numpy(dtype=float)[hitIdx]
+        consistent = (drift >= expectedMin - tol) & (drift <= expectedMax + tol)
+
+        # best pair of each hit first: consistent, then closest
+        order = np.lexsort((self.minSeparation[passIdx], ~consistent, hitIdx))
+        hitIdx, passIdx, consistent = hitIdx[order], passIdx[order], consistent[order]
+        expectedMin, expectedMax = expectedMin[order], expectedMax[order]
+        tagged, best, npasses = np.unique(hitIdx, return_index=True, return_counts=True)
+
+        out = hits.copy()
+        n = len(out)
+        out['npasses'] = _scatter(n, tagged, npasses, 0)
+        out['satelliteConsistent'] = _scatter(n, tagged, consistent[best], False)
+        out['pass'] = _scatter(n, tagged, self.passId[passIdx[best]], -1)
+        out['satellite'] = _scatter(n, tagged, self.satellite[passIdx[best]], None)
+        out['norad'] = _scatter(n, tagged, self.norad[passIdx[best]], None)
+        out['minSeparation'] = _scatter(n, tagged, self.minSeparation[passIdx[best]], np.nan)
+        out['expectedDriftMin'] = _scatter(n, tagged, expectedMin[best], np.nan)
+        out['expectedDriftMax'] = _scatter(n, tagged, expectedMax[best], np.nan)
+        return out
+
+def _scatter(n, positions, values, fill):
+    values = np.asarray(values)
+    dtype = object if fill is None or values.dtype == object else np.result_type(values.dtype, np.asarray(fill).dtype)
+    out = np.full(n, fill, dtype=dtype)
+    out[positions] = values
+    return out
+
+def tagHits(datFiles, work_dir=None, out=None, tolerance=None, batchSize=BATCH_SIZE, site=None):
+    """
+    Tag the hits of turboSETI .dat files against the pass index of a findSats run.
+
+    Parameters
+    ----------
+    datFiles : list of str
+        .dat files to tag.
+    work_dir : str, optional
+        Output directory of findSats, with its pass index and TLEs. Defaults
+        to the current directory.
+    out : str, optional
+        CSV to write the tagged hits to, defaults to work_dir/hits_tagged.csv.
+    tolerance : float, optional
+        Hz/s by which a drift rate may miss the expected range, defaults to
+        DRIFT_TOLERANCE_STEPS drift resolutions.
+    batchSize : int, default=BATCH_SIZE
+        Hits joined and written at a time.
+    site : dict, optional
+        Observer the passes were seen from, by default the site recorded
+        with each pass.
+
+    Returns
+    -------
+    dict
+        Numbers of 'hits', hits overlapping a pass ('overlapping') and
+        'satelliteConsistent' hits.
+    """
+    import pandas as pd
+
+    # Set work directory, default to current working directory
+    if work_dir is None:
+        work_dir = os.getcwd()
+    if out is None:
+        out = os.path.join(work_dir, HITS_FILE)
+
+    with stage('pass_drift'):
+        with PassIndex(work_dir) as index:
+            intervals = index.intervals()
+        intervals = intervals.reset_index(drop=True)
+        passIntervals = PassIntervals(intervals, *passDrifts(intervals, work_dir, site=site))
+
+    totals = {'hits' : 0, 'overlapping' : 0, 'satelliteConsistent' : 0}
+    tmpPath = f'{out}.{os.getpid()}.tmp'
+    header = True
+
+    def flush(batch):
+        nonlocal header
+        with stage('hit_join'):
+            tagged = passIntervals.join(pd.concat(batch, ignore_index=True), tolerance)
+        tagged.to_csv(tmpPath, columns=TAGGED_COLUMNS, mode='w' if header else 'a', header=header, index=False)
+        header = False
+        totals['hits'] += len(tagged)
+        totals['overlapping'] += int((tagged['npasses'] > 0).sum())
+        totals['satelliteConsistent'] += int(tagged['satelliteConsistent'].sum())
+
+    batch, nBatch = [], 0
+    for datFile in datFiles:
+        hits = readDat(datFile)
+        hits.insert(0, 'datFile', datFile)
+        batch.append(hits)
+        nBatch += len(hits)
+        if nBatch >= batchSize:
+            flush(batch)
+            batch, nBatch = [], 0
+    if batch or header:
+        flush(batch if batch else [_noHits()])
+    os.replace(tmpPath, out)
+
+    count('hits_tagged', totals['hits'])
+    count('hits_satellite_consistent', totals['satelliteConsistent'])
+    print(f"{totals['hits']} hits, {totals['overlapping']} during a pass, {totals['satelliteConsistent']} consistent with "
+          f"a satellite's drift, written to {out}")
+    return totals
+
+def _noHits():
+    import pandas as pd
+    hits = pd.DataFrame({column : pd.Series(dtype=float) for column in ['datFile'] + DAT_COLUMNS + ['start', 'stop', 'driftResolution']})
+    hits.insert(len(DAT_COLUMNS) + 1, 'file', pd.Series(dtype=object))
+    return hits
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Tag turboSETI hits that overlap satellite passes and drift like them")
+    parser.add_argument('dat', help='turboSETI .dat files, or directories to search for them', nargs='+')
+    parser.add_argument('--work_dir', help='output directory of findSats, defaults to current working directory', default=None)
+    parser.add_argument('--out', help=f'CSV for the tagged hits, defaults to work_dir/{HITS_FILE}', default=None)
+    parser.add_argument('--tolerance', help=f'Hz/s a drift rate may miss the expected range by, defaults to {DRIFT_TOLERANCE_STEPS} drift resolutions', default=None, type=float)
+    parser.add_argument('--batch', help='hits joined at a time', default=BATCH_SIZE, type=int)
+    args = parser.parse_args(argv)
+
+    datFiles = []
+    for path in args.dat:
+        datFiles += sorted(glob.glob(os.path.join(path, '**', '*.dat'), recursive=True)) if os.path.isdir(path) else [path]
+
+    tagHits(datFiles, work_dir=args.work_dir, out=args.out, tolerance=args.tolerance, batchSize=args.batch)
+
+if __name__ == '__main__':
+    sys.exit(main())
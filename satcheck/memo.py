@@ -0,0 +1,199 @@
+import os, json, hashlib, sqlite3
+import numpy as np
+
+from .sgp4Tools import readTLELines
+from .ephemCache import siteKey
+
+'''
+Content-addressed memo of crossmatch results.
+
+The same target is observed many times, within a cadence, across nights and
+again whenever a run is repeated, and each time every satellite used to be
+propagated from scratch. With memoize=True findSats records, for every
+observation, which satellites it has crossmatched and the passes they made,
+in crossmatch_memo.sqlite in the work_dir.
+
+An observation is addressed by its site, target RA/Dec, start time, duration,
+threshold and crossmatch method, and a satellite by a digest of its name and
+TLE lines, so a satellite is only propagated again for an observation if its
+elements have changed. Re-running after the catalog of a night has been
+refreshed, or has gained new objects, only propagates the satellites whose
+TLEs are new; the passes of all the others are read back from the memo.
+
+    >>> with CrossmatchMemo("/output/") as memo:
+    ...     key = memo.observationKey(site, ra, dec, start_mjd, threshold=3)
+    ...     todo, known = memo.recall(key, tle_file, names)
+'''
+
+MEMO_NAME = 'crossmatch_memo.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS observations (
+    key TEXT PRIMARY KEY,
+    checked BLOB
+);
+CREATE TABLE IF NOT EXISTS hits (
+    key TEXT NOT NULL,
+    digest INTEGER NOT NULL,
+    satellite TEXT NOT NULL,
+    info TEXT,
+    PRIMARY KEY (key, digest)
+);
+'''
+
+def tleDigest(name, line1, line2):
+    """
+    64 bit digest of a satellite's name and TLE lines, as a signed integer.
+    """
+    digest = hashlib.blake2b(f'{name}\n{line1}\n{line2}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+class CrossmatchMemo:
+    """
+    SQLite memo of the satellites crossmatched for each observation and the
+    passes they made.
+
+    Parameters
+    ----------
+    work_dir : str, optional
+        Directory holding crossmatch_memo.sqlite, created if missing. Defaults
+        to the current working directory.
+    path : str, optional
+        Explicit database path, overrides work_dir.
+
+    Examples
+    --------
+    >>> memo = CrossmatchMemo("/output/")
+    >>> key = memo.observationKey(GBT_SITE, "14h00m00s", "12d30m00s", 59000.2, threshold=3)
+    >>> todo, known = memo.recall(key, "may_31_2020_TLEs.txt", names)
+    >>> hits = separation({name : satdict[name] for name in todo}, ...)
+    >>> memo.remember(key, "may_31_2020_TLEs.txt", todo, hits)
+    >>> memo.close()
+    """
+
+    def __init__(self, work_dir=None, path=None):
+        if path is None:
+            path = os.path.join(work_dir if work_dir is not None else os.getcwd(), MEMO_NAME)
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        # several processes may share a memo, and the pipeline uses it from its crossmatch thread
+        self.db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+        # path and mtime of the most recently used TLE file, and its digests
+        self._tleVersion = None
+        self._digests = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def observationKey(self, site, ra, dec, start_mjd, threshold, duration=300, method='exact'):
+        """
+        Address of one observation's crossmatch.
+
+        Parameters
+        ----------
+        site : dict
+            Observer 'lat', 'lon' and 'elevation'.
+        ra, dec : str
+            Target coordinates as read from the header.
+        start_mjd : float
+            Observation start time (MJD).
+        threshold : float
+            Separation in degrees out to which passes are recorded.
+        duration : int, default=300
+            Seconds after the start that are checked.
+        method : str, default='exact'
+            'exact' for PyEphem, 'cache' for an ephemeris cache, whose
+            separations differ slightly.
+
+        Returns
+        -------
+        str
+        """
+        spec = repr((siteKey(site), str(ra), str(dec), f'{float(start_mjd):.9f}', float(threshold), int(duration), method))
+        return hashlib.sha1(spec.encode()).hexdigest()
+
+    def digests(self, tle_file, names):
+        """
+        TLE digest of each of names, as in tle_file.
+        """
+        version = (tle_file, os.path.getmtime(tle_file) if os.path.exists(tle_file) else None)
+        if version != self._tleVersion:
+            self._tleVersion = version
+            self._digests = {name : tleDigest(name, *lines) for name, lines in readTLELines(tle_file).items()}
+        return {name : self._digests[name] for name in names if name in self._digests}
+
+    def _checked(self, key):
+        row = self.db.execute('SELECT checked FROM observations WHERE key = ?', (key,)).fetchone()
+        return np.frombuffer(row[0], dtype=np.int64) if row is not None else np.zeros(0, dtype=np.int64)
+
+    def recall(self, key, tle_file, names):
+        """
+        Split the satellites of an observation into those still to crossmatch
+        and the passes already known.
+
+        Parameters
+        ----------
+        key : str
+            Address of the observation, from observationKey.
+        tle_file : str
+            TLE file the satellites are taken from.
+        names : iterable of str
+            Satellites to crossmatch, named as in load_tle.
+
+        Returns
+        -------
+        todo : list of str
+            Satellites whose current TLEs have not been crossmatched for this
+            observation, in the order of names.
+        known : dict
+            Passes of the others, with the structure of separation().
+        """
+        names = list(names)
+        digests = self.digests(tle_file, names)
+        checked = set(self._checked(key).tolist())
+
+        todo = [name for name in names if digests.get(name) not in checked]
+        known = {}
+        if len(todo) < len(names):
+            hits = dict(self.db.execute('SELECT digest, info FROM hits WHERE key = ?', (key,)).fetchall())
+            for name in names:
+                digest = digests.get(name)
+                if digest in checked and digest in hits:
+                    known[name] = json.loads(hits[digest])
+        return todo, known
+
+    def remember(self, key, tle_file, names, sat_hit_dict):
+        """
+        Record that names were crossmatched for an observation, with the
+        passes they made.
+
+        Parameters
+        ----------
+        key : str
+            Address of the observation, from observationKey.
+        tle_file : str
+            TLE file the satellites were taken from.
+        names : iterable of str
+            Satellites crossmatched.
+        sat_hit_dict : dict
+            Their passes, as returned by separation().
+        """
+        digests = self.digests(tle_file, names)
+        if not digests:
+            return
+        with self.db:
+            checked = np.union1d(self._checked(key), np.fromiter(digests.values(), dtype=np.int64, count=len(digests)))
+            self.db.execute('INSERT OR REPLACE INTO observations VALUES (?, ?)', (key, checked.astype(np.int64).tobytes()))
+            self.db.executemany('INSERT OR REPLACE INTO hits VALUES (?, ?, ?, ?)',
+                                [(key, digests[name], name, json.dumps({column : list(values) for column, values in info.items() if column != 'Tier'}))
+                                 for name, info in sat_hit_dict.items() if name in digests])
@@ -0,0 +1,279 @@
+import os, time, json, resource, tracemalloc, threading
+import cProfile
+from contextlib import contextmanager
+
+'''
+Lightweight run instrumentation for findSats and genPlotsAll.
+
+A Metrics object collects per-stage wall and CPU time, peak memory and named
+counters. The pipeline reports to whichever Metrics object is active through
+the module level stage() and count() functions, which do nothing when no
+collector is active, so instrumented code costs next to nothing by default.
+Stages and counters may be updated from several threads at once; each thread
+keeps its own stack of nested stages.
+
+    >>> m = Metrics()
+    >>> m.addCallback(lambda event: print(event))
+    >>> findSats(dir="/data/", metrics=m)
+    >>> m.writeJson("run_metrics.json")
+'''
+
+_active = None
+
+class Metrics:
+    """
+    Collector for stage timings, peak memory and counters of a run.
+
+    Parameters
+    ----------
+    profile : str, optional
+        If given, the whole run is profiled with cProfile and the stats are
+        written to this path (readable with pstats or snakeviz).
+    traceMemory : bool, default=False
+        Track Python heap allocations with tracemalloc to get a peak memory
+        figure for each stage. This slows allocation-heavy code down, so by
+        default only the process-wide maximum resident set size is recorded.
+    callbacks : list of callable, optional
+        Functions called with an event dict every time a stage finishes or a
+        counter changes. See addCallback.
+
+    Examples
+    --------
+    >>> m = Metrics(profile="findSats.prof")
+    >>> with m:
+    ...     with m.stage("header_io"):
+    ...         read_headers()
+    ...     m.count("files", 10)
+    >>> m.summary()
+    """
+
+    def __init__(self, profile=None, traceMemory=False, callbacks=None):
+        self.profile = profile
+        self.traceMemory = traceMemory
+        self.callbacks = list(callbacks) if callbacks else []
+        self.stages = {}
+        self.counters = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._previous = None
+        self._startedTracing = False
+        self._t0 = None
+
+    def addCallback(self, callback):
+        """
+        Register a function called with an event dict on every update.
+
+        Stage events look like {'type': 'stage', 'name': ..., 'wall': ...,
+        'cpu': ..., 'peak_memory_bytes': ...} and counter events like
+        {'type': 'count', 'name': ..., 'value': ..., 'total': ...}.
+        """
+        self.callbacks.append(callback)
+
+    @property
+    def _stack(self):
+        # nested stages of the calling thread
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _emit(self, event):
+        for callback in self.callbacks:
+            callback(event)
+
+    def __enter__(self):
+        global _active
+        self._previous = _active
+        _active = self
+        self._t0 = time.perf_counter()
+
+        if self.traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._startedTracing = True
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile)
+            self._profiler = None
+        if self._startedTracing:
+            tracemalloc.stop()
+            self._startedTracing = False
+
+        self.counters['run_wall_seconds'] = time.perf_counter() - self._t0
+        _active = self._previous
+
+    def _tracedPeak(self):
+        if not tracemalloc.is_tracing():
+            return None
+        peak = tracemalloc.get_traced_memory()[1]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        return peak
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a block of code as one occurrence of the named stage.
+
+        Stages may be nested; every stage records inclusive times.
+        """
+        # fold the peak seen so far into the enclosing stage before resetting it
+        peak = self._tracedPeak()
+        if peak is not None and self._stack:
+            self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+
+        frame = {'peak' : 0}
+        self._stack.append(frame)
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+            self._stack.pop()
+
+            peak = self._tracedPeak()
+            if peak is not None:
+                frame['peak'] = max(frame['peak'], peak)
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], frame['peak'])
+
+            with self._lock:
+                stats = self.stages.setdefault(name, {'calls' : 0, 'wall' : 0.0, 'cpu' : 0.0, 'peak_memory_bytes' : None, 'max_rss_bytes' : 0})
+                stats['calls'] += 1
+                stats['wall'] += wall
+                stats['cpu'] += cpu
+                if peak is not None:
+                    stats['peak_memory_bytes'] = max(stats['peak_memory_bytes'] or 0, frame['peak'])
+                stats['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+            self._emit({'type' : 'stage', 'name' : name, 'wall' : wall, 'cpu' : cpu,
+                        'peak_memory_bytes' : frame['peak'] if peak is not None else None})
+
+    def count(self, name, n=1):
+        """
+        Add n to the named counter.
+        """
+        with self._lock:
+            self.counters[name] = total = self.counters.get(name, 0) + n
+        self._emit({'type' : 'count', 'name' : name, 'value' : n, 'total' : total})
+
+    def summary(self):
+        """
+        Return all stages and counters as a JSON-serializable dict.
+        """
+        return {'stages' : self.stages, 'counters' : self.counters}
+
+    def writeJson(self, path):
+        """
+        Write summary() to a JSON file.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def writePrometheus(self, path, prefix='satcheck'):
+        """
+        Write the metrics in the Prometheus text exposition format.
+
+        The file is written to a temporary name and renamed into place, as
+        the node_exporter textfile collector expects.
+        """
+        lines = [f'# TYPE {prefix}_stage_wall_seconds counter',
+                 f'# TYPE {prefix}_stage_cpu_seconds counter',
+                 f'# TYPE {prefix}_stage_calls_total counter',
+                 f'# TYPE {prefix}_stage_peak_memory_bytes gauge']
+        for name, stats in self.stages.items():
+            lines.append(f'{prefix}_stage_wall_seconds{{stage="{name}"}} {stats["wall"]:.6f}')
+            lines.append(f'{prefix}_stage_cpu_seconds{{stage="{name}"}} {stats["cpu"]:.6f}')
+            lines.append(f'{prefix}_stage_calls_total{{stage="{name}"}} {stats["calls"]}')
+            peak = stats['peak_memory_bytes'] if stats['peak_memory_bytes'] is not None else stats['max_rss_bytes']
+            lines.append(f'{prefix}_stage_peak_memory_bytes{{stage="{name}"}} {peak}')
+
+        for name, value in self.counters.items():
+            metric = f'{prefix}_{name}' if name.endswith('seconds') else f'{prefix}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+
+        tmpPath = f'{path}.{os.getpid()}.tmp'
+        with open(tmpPath, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmpPath, path)
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_nullStage = _NullStage()
+
+def activeMetrics():
+    """
+    Return the active Metrics collector, or None.
+    """
+    return _active
+
+def stage(name):
+    """
+    Time a block as the named stage of the active collector (no-op if none).
+    """
+    if _active is None:
+        return _nullStage
+    return _active.stage(name)
+
+def count(name, n=1):
+    """
+    Add n to the named counter of the active collector (no-op if none).
+    """
+    if _active is not None:
+        _active.count(name, n)
+
+@contextmanager
+def useMetrics(metrics):
+    """
+    Activate metrics for the duration of a block; does nothing if metrics is
+    None or already active.
+    """
+    if metrics is None or metrics is _active:
+        yield metrics
+        return
+    with metrics:
+        yield metrics
+
+def addMetricsArgs(parser):
+    """
+    Add the --metrics, --prometheus, --profile and --trace_memory options to a
+    command line parser.
+    """
+    parser.add_argument('--metrics', help='write stage timings, peak memory and counters to this JSON file', default=None)
+    parser.add_argument('--prometheus', help='write the metrics as a Prometheus textfile to this path', default=None)
+    parser.add_argument('--profile', help='profile the run with cProfile and write the stats to this path', default=None)
+    parser.add_argument('--trace_memory', help='record the peak Python heap memory of every stage with tracemalloc (slower)', action='store_true')
+
+def metricsFromArgs(args):
+    """
+    Build a Metrics collector from parsed command line options, or None if
+    none of them were given.
+    """
+    if not (args.metrics or args.prometheus or args.profile):
+        return None
+    return Metrics(profile=args.profile, traceMemory=args.trace_memory)
+
+def writeMetricsFromArgs(metrics, args):
+    """
+    Write a finished collector to the outputs requested on the command line.
+    """
+    if metrics is None:
+        return
+    if args.metrics:
+        metrics.writeJson(args.metrics)
+        print(f"Metrics saved to: {args.metrics}")
+    if args.prometheus:
+        metrics.writePrometheus(args.prometheus)
+        print(f"Prometheus metrics saved to: {args.prometheus}")
@@ -0,0 +1,404 @@
+import os, sys, base64, struct, warnings
+import numpy as np
+import argparse
+
+from xml.sax.saxutils import escape, quoteattr
+
+from .passIndex import PassIndex, indexPath
+from .fileLocks import atomicWrite
+
+'''
+Export the pass index to binary FITS or VOTable for TOPCAT.
+
+The CSV outputs of findSats are one small file per pass plus a summary whose
+list columns are stringified Python lists, which TOPCAT loads slowly if at all.
+This writes two column-oriented binary tables from the pass index instead:
+
+- FILES : one row per observation, with the NORAD id, closest approach and
+  its time of every pass as list (variable-length array) columns
+- PASSES : one row per pass, with the whole track (time, MJD, separation,
+  satellite RA/Dec) as list columns
+
+to either a FITS file (two BINTABLE extensions) or a BINARY2 VOTable, with
+units and UCDs. Rows are read from the index and written in chunks, so the
+memory used does not grow with the size of the index. FITS needs the position
+of every list in the heap before the rows are written, so it makes two passes
+over the index: the first writes the rows, the second the list contents.
+'''
+
+# column name, type, unit, UCD, description
+# types: 'str', 'f8' and 'i4', or a list of 'f8' or 'i4' with '[]'
+FILE_COLUMNS = [
+    ('filepath', 'str', None, 'meta.file', 'Observation h5 file'),
+    ('target', 'str', None, 'meta.id;src', 'Observation target'),
+    ('tstart', 'f8', 'd', 'time.start', 'Observation start time (MJD)'),
+    ('npasses', 'i4', None, 'meta.number', 'Number of satellite passes'),
+    ('norad', 'i4[]', None, 'meta.id', 'NORAD id of each passing satellite'),
+    ('minSeparation', 'f8[]', 'deg', 'pos.angDistance', 'Closest approach of each pass'),
+    ('minTime', 'f8[]', 's', 'time.epoch', 'Time of each closest approach after the observation start'),
+]
+
+PASS_COLUMNS = [
+    ('id', 'i4', None, 'meta.id', 'Pass id in the pass index'),
+    ('filepath', 'str', None, 'meta.file', 'Observation h5 file'),
+    ('target', 'str', None, 'meta.id;src', 'Observation target'),
+    ('satellite', 'str', None, 'meta.id', 'Satellite name and NORAD id'),
+    ('norad', 'i4', None, 'meta.id', 'NORAD id'),
+    ('tstart', 'f8', 'd', 'time.start', 'Observation start time (MJD)'),
+    ('minSeparation', 'f8', 'deg', 'pos.angDistance', 'Closest approach'),
+    ('minTime', 'f8', 's', 'time.epoch', 'Time of the closest approach after the observation start'),
+    ('nsamples', 'i4', None, 'meta.number', 'Number of samples in the track'),
+    ('csvPath', 'str', None, 'meta.file', 'Separation CSV written by findSats'),
+    ('tier', 'str', None, 'meta.code.class', 'Tightest separation tier the pass entered'),
+    ('site', 'str', None, 'meta.id;instr.obsty', 'Site the observation was taken at'),
+    ('time', 'f8[]', 's', 'time.epoch', 'Track sample times after the observation start'),
+    ('mjd', 'f8[]', 'd', 'time.epoch', 'Track sample times (MJD)'),
+    ('separation', 'f8[]', 'deg', 'pos.angDistance', 'Separation from the target'),
+    ('ra', 'f8[]', 'deg', 'pos.eq.ra', 'Satellite right ascension'),
+    ('dec', 'f8[]', 'deg', 'pos.eq.dec', 'Satellite declination'),
+]
+
+# NORAD ids the index does not know are written as this (and flagged as null)
+INT_NULL = -1
+
+FITS_BLOCK = 2880
+
+def _sexagesimal(values, hours):
+    # RA/Dec strings as written by separation(), e.g. "13:50:50.75", to degrees.
+    # Parsing them all as one string is much faster than one at a time.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        parts = np.fromstring(':'.join(map(str, values)), sep=':') if len(values) else np.zeros(0)
+
+    if len(parts) != 3 * len(values):
+        import ephem
+        parse = ephem.hours if hours else ephem.degrees
+        return np.rad2deg(np.array([float(parse(str(value))) for value in values], dtype=float))
+
+    # copysign keeps the sign of e.g. "-0:30:00"
+    parts = parts.reshape(-1, 3)
+    degrees = np.copysign(np.abs(parts[:, 0]) + parts[:, 1] / 60 + parts[:, 2] / 3600, parts[:, 0])
+    return degrees * 15 if hours else degrees
+
+def _fileChunks(db, chunk, lists=True):
+    last = ''
+    while True:
+        rows = db.execute('SELECT filepath, target, tstart, npasses FROM files WHERE filepath > ? ORDER BY filepath LIMIT ?',
+                          (last, chunk)).fetchall()
+        if len(rows) == 0:
+            return
+        last = rows[-1][0]
+
+        cols = {'filepath' : [row[0] for row in rows],
+                'target' : [row[1] or '' for row in rows],
+                'tstart' : np.array([row[2] for row in rows], dtype=float),
+                'npasses' : np.array([row[3] for row in rows], dtype=np.int32)}
+        cols['_lengths'] = cols['npasses']
+
+        if lists:
+            passes = db.execute('SELECT norad, minSeparation, minTime FROM passes WHERE filepath BETWEEN ? AND ? ORDER BY filepath, id',
+                                (rows[0][0], last)).fetchall()
+            cols['norad'] = np.array([INT_NULL if p[0] is None else p[0] for p in passes], dtype=np.int32)
+            cols['minSeparation'] = np.array([p[1] for p in passes], dtype=float)
+            cols['minTime'] = np.array([p[2] for p in passes], dtype=float)
+            assert len(passes) == cols['npasses'].sum(), 'pass index files and passes tables disagree'
+        yield cols
+
+def _passChunks(db, chunk, lists=True):
+    last = 0
+    while True:
+        rows = db.execute('SELECT id, filepath, target, satellite, norad, tstart, minSeparation, minTime, nsamples, csvPath, tier, site '
+                          'FROM passes WHERE id > ? ORDER BY id LIMIT ?', (last, chunk)).fetchall()
+        if len(rows) == 0:
+            return
+        last = rows[-1][0]
+
+        cols = {'id' : np.array([row[0] for row in rows], dtype=np.int32),
+                'filepath' : [row[1] for row in rows],
+                'target' : [row[2] or '' for row in rows],
+                'satellite' : [row[3] for row in rows],
+                'norad' : np.array([INT_NULL if row[4] is None else row[4] for row in rows], dtype=np.int32),
+                'tstart' : np.array([row[5] for row in rows], dtype=float),
+                'minSeparation' : np.array([row[6] for row in rows], dtype=float),
+                'minTime' : np.array([row[7] for row in rows], dtype=float),
+                'nsamples' : np.array([row[8] for row in rows], dtype=np.int32),
+                'csvPath' : [row[9] or '' for row in rows],
+                'tier' : [row[10] or '' for row in rows],
+                'site' : [row[11] or '' for row in rows]}
+        cols['_lengths'] = cols['nsamples']
+
+        if lists:
+            samples = db.execute('SELECT time, mjd, separation, ra, dec FROM samples WHERE pass BETWEEN ? AND ? ORDER BY pass, rowid',
+                                 (rows[0][0], last)).fetchall()
+            cols['time'] = np.array([s[0] for s in samples], dtype=float)
+            cols['mjd'] = np.array([s[1] for s in samples], dtype=float)
+            cols['separation'] = np.array([s[2] for s in samples], dtype=float)
+            cols['ra'] = _sexagesimal([s[3] for s in samples], hours=True)
+            cols['dec'] = _sexagesimal([s[4] for s in samples], hours=False)
+            assert len(samples) == cols['nsamples'].sum(), 'pass index passes and samples tables disagree'
+        yield cols
+
+def _tables(db):
+    # name, columns, row count, longest list, widths of the string columns, chunk generator
+    def width(table, column):
+        return max(1, db.execute(f'SELECT COALESCE(MAX(LENGTH(CAST({column} AS BLOB))), 0) FROM {table}').fetchone()[0])
+
+    nfiles, maxPasses = db.execute('SELECT COUNT(*), COALESCE(MAX(npasses), 0) FROM files').fetchone()
+    npasses, maxSamples = db.execute('SELECT COUNT(*), COALESCE(MAX(nsamples), 0) FROM passes').fetchone()
+    return [('FILES', FILE_COLUMNS, nfiles, maxPasses,
+             {'filepath' : width('files', 'filepath'), 'target' : width('files', 'target')}, _fileChunks),
+            ('PASSES', PASS_COLUMNS, npasses, maxSamples,
+             {name : width('passes', name) for name in ('filepath', 'target', 'satellite', 'csvPath', 'tier', 'site')}, _passChunks)]
+
+def _isList(kind):
+    return kind.endswith('[]')
+
+def _itemType(kind):
+    return kind[:-2] if _isList(kind) else kind
+
+def _encode(strings):
+    return [s.encode('utf-8') for s in strings]
+
+def _padFits(f, nbytes):
+    if nbytes % FITS_BLOCK:
+        f.write(b'\0' * (FITS_BLOCK - nbytes % FITS_BLOCK))
+
+def _writeFitsTable(f, db, name, columns, nrows, maxLength, widths, chunks, chunk):
+    from astropy.io import fits
+
+    listCols = [col for col in columns if _isList(col[1])]
+    itemBytes = {col[0] : np.dtype(_itemType(col[1])).itemsize for col in listCols}
+    heapBytes = 0
+    for cols in chunks(db, chunk, lists=False):
+        heapBytes += int(cols['_lengths'].sum()) * sum(itemBytes.values())
+
+    # 64 bit descriptors are only needed for heaps beyond 2 GB
+    descriptor = 'Q' if heapBytes >= 2**31 else 'P'
+    descriptorType = '>i8' if descriptor == 'Q' else '>i4'
+
+    dtype, header = [], fits.Header()
+    header['XTENSION'] = 'BINTABLE'
+    header['BITPIX'] = 8
+    header['NAXIS'] = 2
+    header['NAXIS1'] = 0
+    header['NAXIS2'] = nrows
+    header['PCOUNT'] = heapBytes
+    header['GCOUNT'] = 1
+    header['TFIELDS'] = len(columns)
+    for ii, (column, kind, unit, ucd, description) in enumerate(columns, start=1):
+        code = {'f8' : 'D', 'i4' : 'J'}.get(_itemType(kind))
+        if kind == 'str':
+            header[f'TTYPE{ii}'] = column
+            header[f'TFORM{ii}'] = f'{widths[column]}A'
+            dtype.append((column, f'S{widths[column]}'))
+        elif _isList(kind):
+            header[f'TTYPE{ii}'] = column
+            header[f'TFORM{ii}'] = f'{descriptor}{code}({maxLength})'
+            dtype.append((column, descriptorType, (2,)))
+        else:
+            header[f'TTYPE{ii}'] = column
+            header[f'TFORM{ii}'] = code
+            dtype.append((column, '>' + kind))
+        if unit is not None:
+            header[f'TUNIT{ii}'] = unit
+        if _itemType(kind) == 'i4':
+            header[f'TNULL{ii}'] = INT_NULL
+        header[f'TUCD{ii}'] = ucd
+        header[f'TCOMM{ii}'] = description
+    header['EXTNAME'] = name
+
+    dtype = np.dtype(dtype)
+    header['NAXIS1'] = dtype.itemsize
+    f.write(header.tostring().encode('ascii'))
+
+    # rows, with each list's place in the heap: the lists of a chunk are stored
+    # column by column, so the second pass can write each column in one go
+    heapPos = 0
+    for cols in chunks(db, chunk, lists=False):
+        lengths = cols['_lengths'].astype(np.int64)
+        starts = np.cumsum(lengths) - lengths
+        total = int(lengths.sum())
+
+        rows = np.zeros(len(lengths), dtype=dtype)
+        for column, kind, unit, ucd, description in columns:
+            if kind == 'str':
+                rows[column] = _encode(cols[column])
+            elif _isList(kind):
+                rows[column][:, 0] = lengths
+                rows[column][:, 1] = heapPos + starts * itemBytes[column]
+                heapPos += total * itemBytes[column]
+            else:
+                rows[column] = cols[column]
+        f.write(rows.tobytes())
+
+    for cols in chunks(db, chunk, lists=True):
+        for column, kind, unit, ucd, description in listCols:
+            f.write(np.ascontiguousarray(cols[column], dtype='>' + _itemType(kind)).tobytes())
+
+    _padFits(f, dtype.itemsize * nrows + heapBytes)
+
+def writeFits(index, path, chunk=1000):
+    """
+    Write the FILES and PASSES tables of a pass index to a FITS file.
+
+    Parameters
+    ----------
+    index : PassIndex
+        Index to export.
+    path : str
+        Output FITS file.
+    chunk : int, default=1000
+        Rows read from the index at a time.
+    """
+    from astropy.io import fits
+
+    with atomicWrite(path, 'wb') as f:
+        primary = fits.Header()
+        primary['SIMPLE'] = True
+        primary['BITPIX'] = 8
+        primary['NAXIS'] = 0
+        primary['EXTEND'] = True
+        primary['ORIGIN'] = 'SatCheck'
+        f.write(primary.tostring().encode('ascii'))
+
+        for table in _tables(index.db):
+            _writeFitsTable(f, index.db, *table, chunk)
+
+_VOT_TYPES = {'str' : 'char', 'f8' : 'double', 'i4' : 'int'}
+
+def _votField(column, kind, unit, ucd, description):
+    attrs = f'name={quoteattr(column)} datatype="{_VOT_TYPES[_itemType(kind)]}"'
+    if kind == 'str' or _isList(kind):
+        attrs += ' arraysize="*"'
+    if unit is not None:
+        attrs += f' unit={quoteattr(unit)}'
+    attrs += f' ucd={quoteattr(ucd)}'
+    values = f'<VALUES null="{INT_NULL}"/>' if _itemType(kind) == 'i4' else ''
+    return f'    <FIELD {attrs}><DESCRIPTION>{escape(description)}</DESCRIPTION>{values}</FIELD>\n'
+
+def _votRows(columns, cols):
+    # BINARY2 serialization: a null flag bitmask, then every field in order,
+    # with variable length strings and lists preceded by their length
+    nflags = (len(columns) + 7) // 8
+    lengths = cols['_lengths']
+    starts = np.cumsum(lengths) - lengths
+    for row in range(len(lengths)):
+        flags = bytearray(nflags)
+        fields = []
+        for ii, (column, kind, unit, ucd, description) in enumerate(columns):
+            if kind == 'str':
+                value = cols[column][row].encode('utf-8')
+                fields.append(struct.pack('>i', len(value)) + value)
+            elif _isList(kind):
+                values = cols[column][starts[row]:starts[row] + lengths[row]]
+                fields.append(struct.pack('>i', len(values)) + np.asarray(values, dtype='>' + _itemType(kind)).tobytes())
+            else:
+                value = cols[column][row]
+                if kind == 'i4' and value == INT_NULL:
+                    flags[ii // 8] |= 0x80 >> (ii % 8)
+                fields.append(np.asarray(value, dtype='>' + kind).tobytes())
+        yield bytes(flags) + b''.join(fields)
+
+def writeVOTable(index, path, chunk=1000):
+    """
+    Write the FILES and PASSES tables of a pass index to a BINARY2 VOTable.
+
+    Parameters
+    ----------
+    index : PassIndex
+        Index to export.
+    path : str
+        Output VOTable file.
+    chunk : int, default=1000
+        Rows read from the index at a time.
+    """
+    with atomicWrite(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<VOTABLE version="1.3" xmlns="http://www.ivoa.net/xml/VOTable/v1.3">\n'
+                ' <RESOURCE name="SatCheck">\n')
+
+        for name, columns, nrows, maxLength, widths, chunks in _tables(index.db):
+            f.write(f'  <TABLE name="{name}" nrows="{nrows}">\n')
+            for column in columns:
+                f.write(_votField(*column))
+            f.write('   <DATA><BINARY2><STREAM encoding="base64">\n')
+
+            # base64 is written in multiples of 3 bytes so the stream can be split anywhere
+            pending = b''
+            for cols in chunks(index.db, chunk, lists=True):
+                pending += b''.join(_votRows(columns, cols))
+                cut = len(pending) - len(pending) % 57
+                for start in range(0, cut, 57):
+                    f.write(base64.b64encode(pending[start:start+57]).decode('ascii') + '\n')
+                pending = pending[cut:]
+            if pending:
+                f.write(base64.b64encode(pending).decode('ascii') + '\n')
+
+            f.write('   </STREAM></BINARY2></DATA>\n  </TABLE>\n')
+
+        f.write(' </RESOURCE>\n</VOTABLE>\n')
+
+def exportPasses(work_dir=None, out=None, fmt='fits', chunk=1000):
+    """
+    Export the pass index of a work_dir for TOPCAT.
+
+    Parameters
+    ----------
+    work_dir : str, optional
+        work_dir of the findSats runs. Defaults to the current directory.
+    out : str, optional
+        Output file. Defaults to work_dir/passes.fits or passes.vot.
+    fmt : {'fits', 'votable'}, default='fits'
+        Binary FITS tables or a BINARY2 VOTable.
+    chunk : int, default=1000
+        Rows read from the index at a time.
+
+    Returns
+    -------
+    str
+        Path to the written file.
+
+    Raises
+    ------
+    IOError
+        If work_dir has no pass index.
+
+    Examples
+    --------
+    >>> exportPasses("/output/")
+    '/output/passes.fits'
+    """
+    if work_dir is None:
+        work_dir = os.getcwd()
+
+    path = indexPath(work_dir)
+    if not os.path.exists(path):
+        raise IOError(f'No pass index found at {path}, run findSats first')
+
+    if fmt not in ('fits', 'votable'):
+        raise ValueError(f"fmt must be 'fits' or 'votable', not {fmt!r}")
+    if out is None:
+        out = os.path.join(work_dir, 'passes.fits' if fmt == 'fits' else 'passes.vot')
+
+    with PassIndex(path=path) as index:
+        if fmt == 'fits':
+            writeFits(index, out, chunk=chunk)
+        else:
+            writeVOTable(index, out, chunk=chunk)
+
+    print(f'Passes exported to: {out}')
+    return out
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Export the pass index of a findSats work_dir to FITS or VOTable for TOPCAT')
+    parser.add_argument('--work_dir', help='work_dir of the findSats runs, defaults to current working directory', default=None)
+    parser.add_argument('--format', help='fits or votable (BINARY2)', choices=['fits', 'votable'], default='fits')
+    parser.add_argument('--out', help='output file, defaults to work_dir/passes.fits or passes.vot', default=None)
+    parser.add_argument('--chunk', help='rows read from the index at a time', default=1000, type=int)
+    args = parser.parse_args(argv)
+
+    exportPasses(args.work_dir, args.out, args.format, args.chunk)
+
+if __name__ == '__main__':
+    sys.exit(main())
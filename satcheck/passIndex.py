@@ -0,0 +1,370 @@
+import os, sys, sqlite3
+import numpy as np
+import argparse
+
+'''
+Persistent, queryable index of every pass findSats has found in a work_dir.
+
+Separation CSVs are one file per satellite and observation, so answering
+"every observation that satellite X came within 1 degree of" or "every pass
+for target Y" used to mean globbing them all and parsing their names. findSats
+now also records each pass in an SQLite database, pass_index.sqlite, with
+indices on NORAD id, target, file and time, so those lookups take
+milliseconds however many runs have been added to it.
+
+The database has three tables:
+- files : every observation crossmatched, with its start time and number of passes
+- passes : one row per satellite and observation, with its minimum separation,
+  the tightest separation tier it entered (see satcheck.tiers) and the site
+  it was seen from (see satcheck.sites)
+- samples : every sample of every pass (time, separation, satellite RA/Dec)
+
+    >>> with PassIndex("/output/") as index:
+    ...     index.passes(norad=25544, maxSeparation=1)
+'''
+
+INDEX_NAME = 'pass_index.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    filepath TEXT PRIMARY KEY,
+    target TEXT,
+    tstart REAL,
+    npasses INTEGER
+);
+CREATE TABLE IF NOT EXISTS passes (
+    id INTEGER PRIMARY KEY,
+    filepath TEXT NOT NULL,
+    target TEXT,
+    satellite TEXT NOT NULL,
+    norad INTEGER,
+    tstart REAL,
+    minSeparation REAL,
+    minTime REAL,
+    nsamples INTEGER,
+    csvPath TEXT,
+    tier TEXT,
+    site TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    pass INTEGER NOT NULL,
+    time REAL,
+    mjd REAL,
+    separation REAL,
+    ra TEXT,
+    dec TEXT
+);
+CREATE INDEX IF NOT EXISTS files_target ON files (target, tstart);
+CREATE INDEX IF NOT EXISTS passes_norad ON passes (norad, minSeparation);
+CREATE INDEX IF NOT EXISTS passes_target ON passes (target, tstart);
+CREATE INDEX IF NOT EXISTS passes_file ON passes (filepath);
+CREATE INDEX IF NOT EXISTS passes_tstart ON passes (tstart);
+CREATE INDEX IF NOT EXISTS samples_pass ON samples (pass);
+CREATE INDEX IF NOT EXISTS samples_mjd ON samples (mjd);
+'''
+
+PASS_COLUMNS = ['id', 'filepath', 'target', 'satellite', 'norad', 'tstart', 'minSeparation', 'minTime', 'nsamples', 'csvPath', 'tier', 'site']
+SAMPLE_COLUMNS = ['filepath', 'target', 'satellite', 'norad', 'time', 'mjd', 'separation', 'ra', 'dec']
+
+def indexPath(work_dir=None):
+    """
+    Path of the pass index of a work_dir (the current directory by default).
+    """
+    if work_dir is None:
+        work_dir = os.getcwd()
+    return os.path.join(work_dir, INDEX_NAME)
+
+def targetName(filepath):
+    """
+    Target name of an observation, taken from its file name the same way as
+    for the separation CSVs (see decryptSepName).
+    """
+    parts = os.path.basename(filepath).split('_')
+    return parts[-2] if len(parts) > 1 else os.path.splitext(parts[0])[0]
+
+def noradId(satellite):
+    """
+    NORAD id of a satellite named as in load_tle ("NAME NORADID"), or None.
+    """
+    try:
+        return int(satellite.split()[-1])
+    except (ValueError, IndexError):
+        return None
+
+class PassIndex:
+    """
+    SQLite index of the passes found by findSats.
+
+    Parameters
+    ----------
+    work_dir : str, optional
+        Directory holding pass_index.sqlite, created if missing. Defaults to
+        the current working directory.
+    path : str, optional
+        Explicit database path, overrides work_dir.
+
+    Examples
+    --------
+    >>> index = PassIndex("/output/")
+    >>> index.passes(target="HIP12345")
+    >>> index.samples(norad=25544, maxSeparation=0.5, start=59000, stop=59001)
+    >>> index.close()
+    """
+
+    def __init__(self, work_dir=None, path=None):
+        self.path = indexPath(work_dir) if path is None else path
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        # several processes may write to the same index, so wait for their locks
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+        # indices written before passes were tagged with a tier or site
+        for column in ('tier', 'site'):
+            if column not in self._columns('passes'):
+                with self.db:
+                    self.db.execute(f'ALTER TABLE passes ADD COLUMN {column} TEXT')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def _columns(self, table, schema='main'):
+        return [row[1] for row in self.db.execute(f'PRAGMA {schema}.table_info({table})')]
+
+    def addFile(self, filepath, tstart, sat_hit_dict, csvPaths=None, site=None):
+        """
+        Record the crossmatch of one observation, replacing any earlier one.
+
+        Parameters
+        ----------
+        filepath : str
+            The observation's h5 file.
+        tstart : float
+            Observation start time (MJD).
+        sat_hit_dict : dict
+            Passes found in the observation, as returned by separation(), with
+            their 'Tier' if they were tagged.
+        csvPaths : dict, optional
+            Separation CSV written for each satellite.
+        site : str, optional
+            Name of the site the observation was taken at.
+        """
+        if csvPaths is None:
+            csvPaths = {}
+        target = targetName(filepath)
+
+        with self.db:
+            self._remove(filepath)
+            self.db.execute('INSERT INTO files VALUES (?, ?, ?, ?)', (filepath, target, tstart, len(sat_hit_dict)))
+
+            for satellite, info in sat_hit_dict.items():
+                sep = np.asarray(info['Separation'], dtype=float)
+                times = np.asarray(info['Time after start'], dtype=float)
+                imin = int(np.argmin(sep))
+
+                cursor = self.db.execute('INSERT INTO passes (filepath, target, satellite, norad, tstart, minSeparation, minTime, nsamples, csvPath, tier, site) '
+                                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                         (filepath, target, satellite, noradId(satellite), tstart, float(sep[imin]),
+                                          float(times[imin]), len(sep), csvPaths.get(satellite), info.get('Tier'), site))
+                passId = cursor.lastrowid
+
+                mjds = tstart + times / 86400
+                self.db.executemany('INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?)',
+                                    zip([passId]*len(sep), times.tolist(), mjds.tolist(), sep.tolist(),
+                                        [str(ra) for ra in info['RA']], [str(dec) for dec in info['DEC']]))
+
+    def _remove(self, filepath):
+        self.db.execute('DELETE FROM samples WHERE pass IN (SELECT id FROM passes WHERE filepath = ?)', (filepath,))
+        self.db.execute('DELETE FROM passes WHERE filepath = ?', (filepath,))
+        self.db.execute('DELETE FROM files WHERE filepath = ?', (filepath,))
+
+    def removeFile(self, filepath):
+        """
+        Forget every pass of one observation.
+        """
+        with self.db:
+            self._remove(filepath)
+
+    def merge(self, other):
+        """
+        Add the contents of another pass index (e.g. a shard's), replacing
+        any observations both contain.
+
+        Parameters
+        ----------
+        other : str
+            Path to the other pass_index.sqlite.
+        """
+        with self.db:
+            self.db.execute('ATTACH DATABASE ? AS other', (other,))
+        try:
+            with self.db:
+                for (filepath,) in self.db.execute('SELECT filepath FROM other.files').fetchall():
+                    self._remove(filepath)
+
+                self.db.execute('INSERT INTO files SELECT * FROM other.files')
+
+                # pass ids are renumbered after the ones already here
+                offset = self.db.execute('SELECT COALESCE(MAX(id), 0) FROM passes').fetchone()[0]
+                otherColumns = self._columns('passes', 'other')
+                tier, site = [column if column in otherColumns else 'NULL' for column in ('tier', 'site')]
+                self.db.execute('INSERT INTO passes SELECT id + ?, filepath, target, satellite, norad, tstart, minSeparation, '
+                                f'minTime, nsamples, csvPath, {tier}, {site} FROM other.passes', (offset,))
+                self.db.execute('INSERT INTO samples SELECT pass + ?, time, mjd, separation, ra, dec FROM other.samples', (offset,))
+        finally:
+            self.db.execute('DETACH DATABASE other')
+
+    def _where(self, prefix, norad=None, satellite=None, target=None, filepath=None, maxSeparation=None, start=None, stop=None, tier=None):
+        clauses, params = [], []
+        for column, value in (('norad', norad), ('satellite', satellite), ('target', target), ('filepath', filepath), ('tier', tier)):
+            if value is not None:
+                clauses.append(f'{prefix}{column} = ?')
+                params.append(value)
+        if maxSeparation is not None:
+            clauses.append(f'{prefix}minSeparation <= ?')
+            params.append(maxSeparation)
+        if start is not None:
+            clauses.append(f'{prefix}tstart >= ?')
+            params.append(start)
+        if stop is not None:
+            clauses.append(f'{prefix}tstart <= ?')
+            params.append(stop)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def passes(self, norad=None, satellite=None, target=None, filepath=None, maxSeparation=None, start=None, stop=None, tier=None):
+        """
+        Passes matching every given filter, ordered by observation start.
+
+        Parameters
+        ----------
+        norad : int, optional
+            NORAD catalog id of the satellite.
+        satellite : str, optional
+            Satellite name as in load_tle ("NAME NORADID").
+        target : str, optional
+            Observation target, as in the separation CSV names.
+        filepath : str, optional
+            Observation h5 file.
+        maxSeparation : float, optional
+            Only passes that came at least this close (degrees).
+        start, stop : float, optional
+            Range of observation start times (MJD).
+        tier : str, optional
+            Only passes whose tightest separation tier is this one.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per pass with columns 'id', 'filepath', 'target',
+            'satellite', 'norad', 'tstart', 'minSeparation', 'minTime',
+            'nsamples', 'csvPath', 'tier' and 'site'.
+        """
+        import pandas as pd
+
+        where, params = self._where('', norad, satellite, target, filepath, maxSeparation, start, stop, tier)
+        rows = self.db.execute(f'SELECT {", ".join(PASS_COLUMNS)} FROM passes{where} ORDER BY tstart, id', params).fetchall()
+        return pd.DataFrame(rows, columns=PASS_COLUMNS)
+
+    def samples(self, norad=None, satellite=None, target=None, filepath=None, maxSeparation=None, start=None, stop=None, tier=None):
+        """
+        Samples of the passes matching every given filter.
+
+        Takes the same filters as passes(), except that maxSeparation and
+        start/stop apply to each sample's separation and time (MJD).
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per sample with columns 'filepath', 'target', 'satellite',
+            'norad', 'time' (s after start), 'mjd', 'separation', 'ra' and 'dec'.
+        """
+        import pandas as pd
+
+        where, params = self._where('p.', norad, satellite, target, filepath, tier=tier)
+        clauses = [where] if where else []
+        for condition, value in (('s.separation <= ?', maxSeparation), ('s.mjd >= ?', start), ('s.mjd <= ?', stop)):
+            if value is not None:
+                clauses.append(('AND ' if clauses else 'WHERE ') + condition)
+                params.append(value)
+
+        columns = ', '.join(['p.filepath', 'p.target', 'p.satellite', 'p.norad', 's.time', 's.mjd', 's.separation', 's.ra', 's.dec'])
+        rows = self.db.execute(f'SELECT {columns} FROM samples s JOIN passes p ON s.pass = p.id {" ".join(clauses)} '
+                               'ORDER BY s.mjd', params).fetchall()
+        return pd.DataFrame(rows, columns=SAMPLE_COLUMNS)
+
+    def intervals(self, norad=None, satellite=None, target=None, filepath=None, maxSeparation=None, start=None, stop=None, tier=None):
+        """
+        Passes matching every given filter with the time span of their samples.
+
+        Takes the same filters as passes().
+
+        Returns
+        -------
+        pandas.DataFrame
+            The columns of passes() plus 'start' and 'stop', the MJD of the
+            first and last sample of each pass.
+        """
+        import pandas as pd
+
+        where, params = self._where('p.', norad, satellite, target, filepath, maxSeparation, start, stop, tier)
+        columns = ', '.join(f'p.{column}' for column in PASS_COLUMNS)
+        rows = self.db.execute(f'SELECT {columns}, MIN(s.mjd), MAX(s.mjd) FROM passes p JOIN samples s ON s.pass = p.id{where} '
+                               'GROUP BY p.id ORDER BY p.tstart, p.id', params).fetchall()
+        return pd.DataFrame(rows, columns=PASS_COLUMNS + ['start', 'stop'])
+
+    def files(self, target=None, start=None, stop=None):
+        """
+        Observations recorded in the index, with or without passes.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns 'filepath', 'target', 'tstart' and 'npasses'.
+        """
+        import pandas as pd
+
+        where, params = self._where('', target=target, start=start, stop=stop)
+        rows = self.db.execute(f'SELECT filepath, target, tstart, npasses FROM files{where} ORDER BY tstart', params).fetchall()
+        return pd.DataFrame(rows, columns=['filepath', 'target', 'tstart', 'npasses'])
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Look up passes in the pass index of a findSats work_dir')
+    parser.add_argument('--work_dir', help='work_dir of the findSats runs, defaults to current working directory', default=None)
+    parser.add_argument('--norad', help='NORAD id of the satellite', default=None, type=int)
+    parser.add_argument('--satellite', help='satellite name as in the TLE files, with its NORAD id', default=None)
+    parser.add_argument('--target', help='observation target', default=None)
+    parser.add_argument('--h5', help='observation h5 file', default=None)
+    parser.add_argument('--max_sep', help='only passes at least this close, in degrees', default=None, type=float)
+    parser.add_argument('--start', help='earliest time (MJD)', default=None, type=float)
+    parser.add_argument('--stop', help='latest time (MJD)', default=None, type=float)
+    parser.add_argument('--tier', help='only passes whose tightest separation tier is this one, e.g. primary', default=None)
+    parser.add_argument('--samples', help='list every sample instead of one row per pass', action='store_true')
+    parser.add_argument('--out', help='write the results to this CSV instead of printing them', default=None)
+    args = parser.parse_args(argv)
+
+    path = indexPath(args.work_dir)
+    if not os.path.exists(path):
+        print(f'No pass index found at {path}, run findSats first', file=sys.stderr)
+        return 1
+
+    filters = dict(norad=args.norad, satellite=args.satellite, target=args.target, filepath=args.h5,
+                   maxSeparation=args.max_sep, start=args.start, stop=args.stop, tier=args.tier)
+    with PassIndex(path=path) as index:
+        df = index.samples(**filters) if args.samples else index.passes(**filters)
+
+    if args.out is not None:
+        df.to_csv(args.out, index=False)
+        print(f'{len(df)} rows saved to: {args.out}')
+    else:
+        print(df.to_string(index=False))
+
+if __name__ == '__main__':
+    sys.exit(main())
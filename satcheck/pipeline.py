@@ -0,0 +1,145 @@
+import os, asyncio
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .findSatsHelper import pull_relevant_header_info, tle_filename
+from .findSats import io, downloadTLEs, _crossmatchFile, _writeFileOutputs, _writeSummary, _observationSpan, _tleFile, _fileSite
+from .passIndex import PassIndex
+from .memo import CrossmatchMemo
+from .metrics import stage
+
+'''
+findSats with its stages overlapped instead of run one after the other.
+
+A plain findSats run reads every header, then downloads every day's TLEs
+(sleeping between Space-Track queries), then crossmatches every file, so the
+CPU is idle while downloading and the network is idle while crossmatching.
+Here each stage has its own worker thread and asyncio passes every file on
+as soon as it can go:
+
+    headers -> TLE download (once per day) -> crossmatch -> writer
+
+Headers are read ahead of the downloads, which start as soon as the first
+file of a new day has been read. Every file of a day is crossmatched as soon
+as that day's TLEs are on disk, while the next day downloads, and the
+separation CSVs, plots, pass index and summary are written by a background
+writer. On a cold cache the run takes about as long as its slowest stage.
+
+Each stage runs one thing at a time, in the order the files were given, so
+downloads keep to the Space-Track rate limit and the results are the same as
+those of a plain run. The crossmatch stage owns the ephem observer and the
+per-day caches, and the writer owns the pass index connection.
+'''
+
+STAGES = ('headers', 'download', 'crossmatch', 'writer')
+
+def runPipeline(list_of_filenames, n, spacetrack_account, spacetrack_password, work_dir, plot=False, ephem_cache=False, visibility=False, headers=None, downlinks=None, tiers=None, selector=None, site=None, memoize=False):
+    """
+    Crossmatch observation files with the download, compute and write stages overlapped.
+
+    Parameters
+    ----------
+    list_of_filenames : list of str
+        Observation h5 files.
+    n : int or None
+        Number of Space-Track queries per day, as for downloadTLEs.
+    spacetrack_account, spacetrack_password : str
+        Space-Track credentials, or None to use the environment variables.
+    work_dir : str
+        Directory for the TLEs and outputs.
+    plot, ephem_cache, visibility : bool, default=False
+        As for findSats.
+    headers : tuple of lists, optional
+        Start times, RAs, Decs and telescope_ids of the files if they have
+        been read already, as returned by pull_relevant_header_info with
+        telescope=True.
+    downlinks : DownlinkTable, optional
+        Only crossmatch the satellites transmitting near each file's band.
+    tiers : SeparationTiers, optional
+        Crossmatch out to the widest tier and tag each pass with its tightest.
+    selector : SatelliteSelector, optional
+        Only download and crossmatch the satellites it selects.
+    site : dict, optional
+        Site of every file, instead of the telescope_id of its header.
+    memoize : bool, default=False
+        Only propagate the satellites whose TLEs changed since each file was
+        last crossmatched, as for findSats.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The summary, as returned by findSats and written to
+        work_dir/files_affected_by_sats.csv.
+    """
+    coroutine = _pipeline(list_of_filenames, n, spacetrack_account, spacetrack_password, work_dir, plot, ephem_cache, visibility, headers, downlinks, tiers, selector, site, memoize)
+
+    # inside a running event loop (e.g. a notebook) run the pipeline in its own thread
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(1) as runner:
+        return runner.submit(asyncio.run, coroutine).result()
+
+async def _pipeline(list_of_filenames, n, spacetrack_account, spacetrack_password, work_dir, plot, ephem_cache, visibility, headers, downlinks, tiers, selector, site, memoize):
+
+    loop = asyncio.get_running_loop()
+    pools = {name : ThreadPoolExecutor(1, thread_name_prefix=f'satcheck-{name}') for name in STAGES}
+
+    def run(name, func, *args):
+        return loop.run_in_executor(pools[name], func, *args)
+
+    # state only ever touched by one stage's thread
+    observers = {}
+    caches = {}
+    indices = {}
+    noradIds = []
+    files_affected_by_sats = {fil_file : [[],[],[]] for fil_file in list_of_filenames}
+
+    def download(mjd):
+        with stage('tle_download'):
+            # the UCS database is only fetched once, when the first day is missing
+            if not noradIds and not os.path.isfile(_tleFile(mjd, work_dir, selector)):
+                noradIds.append(io(n, work_dir=work_dir, selector=selector))
+            return downloadTLEs([], n, spacetrack_account, spacetrack_password, work_dir=work_dir,
+                                start_time_mjd=[mjd], norad_ids=noradIds[0] if noradIds else None, selector=selector)
+
+    def readHeader(ii, fil_file):
+        # everything needed from one file's header, in one task so files are ready in order
+        if headers is None:
+            (dd,), (ra,), (dec,), (telescope_id,) = pull_relevant_header_info([fil_file], telescope=True)
+        else:
+            dd, ra, dec, telescope_id = (column[ii] for column in headers)
+        return dd, ra, dec, _observationSpan(fil_file, downlinks, tiers), _fileSite(fil_file, telescope_id, site)
+
+    headerReads = [run('headers', readHeader, ii, fil_file) for ii, fil_file in enumerate(list_of_filenames)]
+
+    days = {}
+    async def process(ii, fil_file):
+        dd, ra, dec, span, fileSite = await headerReads[ii]
+
+        # the first file of each day queues that day's download
+        day = tle_filename(dd, work_dir)
+        if day not in days:
+            days[day] = run('download', download, dd)
+        tles = np.asarray(await days[day])
+
+        sat_hit_dict = await run('crossmatch', _crossmatchFile, dd, ra, dec, tles, work_dir, observers, caches, indices, ephem_cache, visibility, downlinks, span, tiers, selector, fileSite, memo)
+        if sat_hit_dict is not None:
+            await run('writer', _writeFileOutputs, fil_file, dd, sat_hit_dict, work_dir, plot, passIndex, files_affected_by_sats, fileSite)
+
+    try:
+        # sqlite connections belong to the thread that opened them
+        passIndex = await run('writer', PassIndex, work_dir)
+        memo = await run('crossmatch', CrossmatchMemo, work_dir) if memoize else None
+        try:
+            await asyncio.gather(*[process(ii, fil_file) for ii, fil_file in enumerate(list_of_filenames)])
+            return await run('writer', _writeSummary, files_affected_by_sats, work_dir)
+        finally:
+            await run('writer', passIndex.close)
+            if memo is not None:
+                await run('crossmatch', memo.close)
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
@@ -0,0 +1,255 @@
+import os, math, time
+import numpy as np
+
+from collections import deque
+
+from .findSatsHelper import query_space_track, tle_query_url, SpaceTrackQueryError
+from .metrics import count
+
+'''
+Batching of NORAD ids into Space-Track queries.
+
+Every Space-Track query costs a 12 s pause, so a day's TLEs should take as
+few queries as possible, but a query can only be so long before the server
+rejects its URL, and a very large response is slow and more likely to time
+out. The planner packs the sorted ids greedily into as few queries as these
+limits allow and, when the hourly rate-limit budget is running out, trades
+response size for fewer queries. A query that fails anyway is split in two
+and both halves are retried, down to single satellites, and the limit that
+was hit is remembered for the rest of the run. Only queries rejected as too
+long or too large are split; when Space-Track is unreachable or failing, the
+same query is retried a few times with backoff and the day is then given up
+on. Every query, retries included, counts against the hourly budget.
+'''
+
+# longest query URL tried, halved whenever Space-Track rejects one as too long
+MAX_URL_LENGTH = 8000
+# largest response aimed for, and the response size per satellite assumed
+# until some TLEs have been downloaded (a 3le is ~170 bytes, there are a few
+# epochs per satellite in the two day window of a query)
+MAX_RESPONSE_BYTES = 32 * 2**20
+BYTES_PER_ID = 1000
+# Space-Track allows 300 queries an hour
+HOURLY_LIMIT = 300
+# how often a failing batch is halved before its satellites are given up on
+MAX_SPLITS = 12
+# failures that say nothing about the query itself: no response, a timeout,
+# rate limiting or a server error
+TRANSIENT_STATUS = (None, 408, 429, 500, 502, 503, 504)
+# how often such a query is sent again before the day is given up on, and the
+# first pause before doing so (doubled every time)
+MAX_RETRIES = 4
+RETRY_WAIT = 30
+# first pause before retrying a query that was rate limited
+RATE_LIMIT_WAIT = 60
+
+class QueryPlanner:
+    """
+    Plan and run the Space-Track queries for a list of NORAD ids.
+
+    Parameters
+    ----------
+    maxUrlLength : int, default=MAX_URL_LENGTH
+        Longest query URL to send.
+    maxResponseBytes : int, default=MAX_RESPONSE_BYTES
+        Largest response to aim for.
+    bytesPerId : float, default=BYTES_PER_ID
+        Expected response size per satellite, updated from every download.
+    hourlyLimit : int, default=HOURLY_LIMIT
+        Queries allowed per hour.
+
+    Examples
+    --------
+    >>> planner = QueryPlanner()
+    >>> batches = planner.plan(noradIds)
+    >>> chunks, failed = planner.download(noradIds, 59000.2, account, password, work_dir="/output/")
+    """
+
+    def __init__(self, maxUrlLength=MAX_URL_LENGTH, maxResponseBytes=MAX_RESPONSE_BYTES, bytesPerId=BYTES_PER_ID, hourlyLimit=HOURLY_LIMIT):
+        self.maxUrlLength = maxUrlLength
+        self.maxResponseBytes = maxResponseBytes
+        self.bytesPerId = bytesPerId
+        self.hourlyLimit = hourlyLimit
+        self._requests = deque()
+        self._bytes = 0
+        self._ids = 0
+
+    def budget(self):
+        """
+        Number of queries left in the current hour.
+        """
+        now = time.time()
+        while self._requests and now - self._requests[0] > 3600:
+            self._requests.popleft()
+        return max(self.hourlyLimit - len(self._requests), 0)
+
+    def urlLength(self, ids):
+        """
+        Length of the (percent-encoded) query URL for some NORAD ids.
+        """
+        from requests.utils import requote_uri
+        return len(requote_uri(tle_query_url('2000-01-01', '2000-01-02', _idString(ids))))
+
+    def plan(self, ids):
+        """
+        Split NORAD ids into as few queries as the limits allow.
+
+        Parameters
+        ----------
+        ids : array_like
+            NORAD catalog numbers.
+
+        Returns
+        -------
+        list of numpy.ndarray
+            Sorted, unique ids of every query.
+        """
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        if len(ids) == 0:
+            return []
+
+        # every id adds its digits and a comma to the URL
+        idLengths = np.char.str_len(ids.astype(str)) + 1
+        room = self.maxUrlLength - self.urlLength([]) + 1
+
+        nUrl = len(_pack(idLengths, room, len(ids)))
+        nResponse = math.ceil(len(ids) * self.bytesPerId / self.maxResponseBytes)
+        nBatches = max(nUrl, nResponse)
+
+        # with little of the hourly budget left, fewer but larger responses
+        budget = self.budget()
+        if nBatches > budget:
+            nBatches = max(nUrl, budget)
+
+        return np.split(ids, _pack(idLengths, room, math.ceil(len(ids) / nBatches))[1:])
+
+    def download(self, ids, mjd, spacetrack_account=None, spacetrack_password=None, work_dir=None, overwrite=False, batches=None, tag=None):
+        """
+        Download the TLEs of some satellites for one day, one chunk file per query.
+
+        Queries rejected as too long or too large are split in two and retried
+        until they succeed or are down to one satellite. Queries that fail
+        otherwise are sent again up to MAX_RETRIES times with backoff, after
+        which the remaining queries of the day are given up on as well.
+
+        Parameters
+        ----------
+        ids : array_like
+            NORAD catalog numbers.
+        mjd : float
+            Observation start time (MJD) of the day.
+        spacetrack_account, spacetrack_password : str, optional
+            Space-Track credentials, default to the environment variables.
+        work_dir : str, optional
+            Directory for the chunk files.
+        overwrite : bool, default=False
+            Download chunks that already exist again.
+        batches : list of array_like, optional
+            Queries to send instead of those planned from ids.
+        tag : str, optional
+            Prefix of the chunk labels, e.g. the tag of a satellite selection,
+            so downloads of different sets of satellites for the same day do
+            not share chunk files.
+
+        Returns
+        -------
+        chunks : list of str
+            Chunk files, in the order of the queries.
+        failed : numpy.ndarray
+            Ids whose queries were given up on.
+        """
+        if batches is None:
+            batches = self.plan(ids)
+        prefix = '' if tag is None else tag + '_'
+        queue = [(prefix + str(ii), np.asarray(batch, dtype=np.int64), 0, 0) for ii, batch in enumerate(batches) if len(batch) > 0]
+
+        chunks, failed = [], []
+        while queue:
+            label, batch, splits, retries = queue.pop(0)
+            self._waitForBudget()
+            self._requests.append(time.time())
+            try:
+                files = query_space_track([], _idString(batch), label, overwrite=overwrite, spacetrack_account=spacetrack_account,
+                                          spacetrack_password=spacetrack_password, work_dir=work_dir, start_time_mjd=[mjd], raise_errors=True)
+            except SpaceTrackQueryError as e:
+                if e.status in TRANSIENT_STATUS:
+                    # smaller queries would not help, wait and send the same one again
+                    if retries < MAX_RETRIES:
+                        wait = (RATE_LIMIT_WAIT if e.status == 429 else RETRY_WAIT) * 2**retries
+                        print(f'{e}, retrying in {wait} s')
+                        count('spacetrack_retries')
+                        time.sleep(wait)
+                        queue.insert(0, (label, batch, splits, retries + 1))
+                        continue
+
+                    # the rest of the day's queries would most likely fail the same way
+                    lost = np.concatenate([batch] + [b for _, b, _, _ in queue])
+                    print(f'Warning: Space-Track still failing, giving up on {len(lost)} satellites: {e}')
+                    count('spacetrack_failed_ids', len(lost))
+                    failed.append(lost)
+                    break
+
+                if e.status == 414:
+                    # plan later queries at the size of the halves about to be tried
+                    self.maxUrlLength = min(self.maxUrlLength, self.urlLength(batch[:(len(batch) + 1)//2]))
+                elif e.status == 413:
+                    self.maxResponseBytes = min(self.maxResponseBytes, len(batch) * self.bytesPerId)
+
+                if len(batch) == 1 or splits >= MAX_SPLITS:
+                    print(f'Warning: giving up on {len(batch)} satellites: {e}')
+                    count('spacetrack_failed_ids', len(batch))
+                    failed.append(batch)
+                    continue
+
+                print(f'{e}, retrying as two queries of {len(batch)//2} and {len(batch) - len(batch)//2} satellites')
+                count('spacetrack_batch_splits')
+                first, second = np.array_split(batch, 2)
+                queue[:0] = [(label + 'a', first, splits + 1, 0), (label + 'b', second, splits + 1, 0)]
+                continue
+
+            for f in files:
+                if os.path.exists(f):
+                    self._learn(len(batch), os.path.getsize(f))
+            chunks.extend(files)
+
+        return chunks, np.concatenate(failed) if failed else np.zeros(0, dtype=np.int64)
+
+    def _waitForBudget(self):
+        # wait for the oldest query of the last hour to drop out of the budget
+        if self.budget() == 0:
+            wait = max(3600 - (time.time() - self._requests[0]), 0)
+            print(f'Space-Track hourly query limit reached, waiting {wait:.0f} s')
+            count('spacetrack_budget_waits')
+            time.sleep(wait)
+
+    def _learn(self, nIds, nBytes):
+        # average response size per satellite of everything downloaded so far
+        self._ids += nIds
+        self._bytes += nBytes
+        self.bytesPerId = max(self._bytes / self._ids, 1)
+
+def _idString(ids):
+    return ','.join(str(int(i)) for i in ids)
+
+def _pack(lengths, room, maxIds):
+    # greedy start indices of batches of at most maxIds ids whose lengths sum to at most room
+    starts = [0]
+    used = 0
+    for ii, length in enumerate(lengths):
+        if ii > starts[-1] and (used + length > room or ii - starts[-1] >= maxIds):
+            starts.append(ii)
+            used = 0
+        used += length
+    return starts
+
+_planner = None
+
+def defaultPlanner():
+    """
+    Planner shared by every download of the process, so what it learns about
+    the limits and the rate-limit budget carries over from one day to the next.
+    """
+    global _planner
+    if _planner is None:
+        _planner = QueryPlanner()
+    return _planner
@@ -0,0 +1,161 @@
+import hashlib, fnmatch, re
+import numpy as np
+
+from .passIndex import noradId
+
+'''
+Selecting the satellites of a targeted findSats run.
+
+A run that only cares about, say, GNSS satellites has no use for the rest of
+the UCS catalog, yet findSats downloads and crossmatches all of it. A
+SatelliteSelector picks the satellites of a run from the UCS catalog by
+constellation (patterns on the satellite names), by orbit class (LEO, MEO,
+GEO, Elliptical) and by explicit NORAD ids; only those are queried from
+Space-Track and propagated.
+
+A selected run downloads its days into TLE files of its own, named after the
+selection, so they are never mistaken for the full catalog by a later run. If
+the full catalog of a day is already in work_dir it is used instead, without
+downloading anything, and the selection is applied when crossmatching.
+'''
+
+# name patterns of the main constellations in the UCS catalog (matched without case)
+CONSTELLATIONS = {
+    'gps' : ['*NAVSTAR*', '*GPS*'],
+    'glonass' : ['*GLONASS*'],
+    'galileo' : ['*GALILEO*', '*GSAT0*'],
+    'beidou' : ['*BEIDOU*', '*COMPASS*'],
+    'qzss' : ['*QZS*', '*MICHIBIKI*'],
+    'navic' : ['*IRNSS*', '*NAVIC*'],
+    'starlink' : ['*STARLINK*'],
+    'oneweb' : ['*ONEWEB*'],
+    'iridium' : ['*IRIDIUM*'],
+    'orbcomm' : ['*ORBCOMM*'],
+    'globalstar' : ['*GLOBALSTAR*'],
+}
+CONSTELLATIONS['gnss'] = CONSTELLATIONS['gps'] + CONSTELLATIONS['glonass'] + CONSTELLATIONS['galileo'] + \
+                         CONSTELLATIONS['beidou'] + CONSTELLATIONS['qzss'] + CONSTELLATIONS['navic']
+
+# UCS catalog columns searched by the constellation patterns
+NAME_COLUMNS = ['Name of Satellite, Alternate Names', 'Current Official Name of Satellite']
+ORBIT_COLUMN = 'Class of Orbit'
+
+class SatelliteSelector:
+    """
+    The satellites of a targeted run.
+
+    A satellite is selected if it matches one of the constellations (or any
+    satellite, if none are given) and is in one of the orbit classes (or any,
+    if none are given), or if its NORAD id is listed.
+
+    Parameters
+    ----------
+    constellations : list of str, optional
+        Names from CONSTELLATIONS (e.g. 'gps', 'gnss', 'starlink') or name
+        patterns (e.g. 'COSMOS*'); a name that is neither matches satellites
+        whose names contain it.
+    norad : list of int, optional
+        NORAD ids to select, whether or not they are in the UCS catalog.
+    orbitClasses : list of str, optional
+        UCS orbit classes to select: 'LEO', 'MEO', 'GEO' or 'Elliptical'.
+
+    Examples
+    --------
+    >>> selector = SatelliteSelector(constellations=['gnss'])
+    >>> selector = SatelliteSelector(norad=[25544, 48274])
+    >>> selector = SatelliteSelector(constellations=['iridium', 'orbcomm'], orbitClasses=['LEO'])
+    >>> selector.noradIds(work_dir="/output/")
+    array([...])
+    """
+
+    def __init__(self, constellations=None, norad=None, orbitClasses=None):
+        self.constellations = list(constellations or [])
+        self.norad = sorted(set(int(i) for i in (norad or [])))
+        self.orbitClasses = [orbit.upper() for orbit in (orbitClasses or [])]
+        if not (self.constellations or self.norad or self.orbitClasses):
+            raise ValueError('A selector needs constellations, NORAD ids or orbit classes')
+
+        patterns = []
+        for name in self.constellations:
+            if name.lower() in CONSTELLATIONS:
+                patterns += CONSTELLATIONS[name.lower()]
+            elif any(char in name for char in '*?['):
+                patterns.append(name)
+            else:
+                patterns.append(f'*{name}*')
+        self.patterns = [re.compile(fnmatch.translate(pattern.upper())) for pattern in patterns]
+        self._ids = None
+
+    @property
+    def needsCatalog(self):
+        """
+        Whether the UCS catalog is needed to resolve the selection.
+        """
+        return bool(self.constellations or self.orbitClasses)
+
+    @property
+    def tag(self):
+        """
+        Short name of the selection, used in the names of its TLE files.
+        """
+        spec = repr((sorted(self.constellations), self.norad, sorted(self.orbitClasses)))
+        return 'select-' + hashlib.sha1(spec.encode()).hexdigest()[:8]
+
+    def select(self, catalog):
+        """
+        NORAD ids of the selected satellites of a UCS catalog.
+
+        Parameters
+        ----------
+        catalog : pandas.DataFrame
+            UCS catalog, as filtered by io().
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted NORAD ids, including the listed ones.
+        """
+        keep = np.ones(len(catalog), dtype=bool)
+        if self.patterns:
+            matched = np.zeros(len(catalog), dtype=bool)
+            for column in NAME_COLUMNS:
+                if column in catalog.columns:
+                    names = catalog[column].fillna('').astype(str).str.strip().str.upper()
+                    matched |= names.map(lambda name: any(pattern.match(name) for pattern in self.patterns)).to_numpy(dtype=bool)
+            keep &= matched
+        if self.orbitClasses:
+            orbits = catalog[ORBIT_COLUMN].fillna('').astype(str).str.strip().str.upper()
+            keep &= orbits.isin(self.orbitClasses).to_numpy()
+        if not (self.patterns or self.orbitClasses):
+            keep[:] = False
+
+        ids = catalog['NORAD Number'].to_numpy()[keep].astype(np.int64)
+        return np.union1d(ids, np.array(self.norad, dtype=np.int64))
+
+    def noradIds(self, work_dir=None):
+        """
+        NORAD ids of the selection, reading the UCS catalog the first time if
+        the selection needs it.
+        """
+        if self._ids is None:
+            if self.needsCatalog:
+                from .findSats import ucsCatalog
+                self._ids = self.select(ucsCatalog(work_dir))
+                print(f'Selected {len(self._ids)} satellites')
+            else:
+                self._ids = np.array(self.norad, dtype=np.int64)
+            self._idSet = set(self._ids.tolist())
+        return self._ids
+
+    def selects(self, satellite, work_dir=None):
+        """
+        Whether a satellite, named as in load_tle ("NAME NORADID"), is selected.
+        """
+        self.noradIds(work_dir)
+        return noradId(satellite) in self._idSet
+
+    def filter(self, names, work_dir=None):
+        """
+        The selected satellites among names.
+        """
+        return [name for name in names if self.selects(name, work_dir)]
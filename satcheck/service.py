@@ -0,0 +1,498 @@
+import os, sys, json, time, queue, threading
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import argparse
+
+from .sites import DEFAULT_SITE, siteNamed, siteObserver
+from .findSatsHelper import load_tle, tle_filename, dayTLEFiles, convert, parseRaDec, satellitePositions, angularSeparation
+
+'''
+Long-running crossmatch service.
+
+Answering "was anything near this target at this MJD?" with findSats pays for
+the imports, the UCS download, parsing the TLE file and setting up the
+observer every time. The service does all of that once and keeps the parsed
+catalogs of the most recently used days in memory, so a query only costs the
+propagation itself.
+
+Queries are handled by a single worker thread. It waits a few milliseconds
+after the first query arrives to collect any others, groups them by day and
+propagates each catalog once over the union of the requested times; the
+satellite positions do not depend on the target, so concurrent queries for
+the same times share one propagation.
+
+    >>> service = CrossmatchService(work_dir="/data/tles/")
+    >>> service.query(63.0, 12.5, 59000.2)
+'''
+
+DEFAULT_PORT = 8765
+
+class CrossmatchService:
+    """
+    Warm, batched satellite crossmatching for single pointings.
+
+    Parameters
+    ----------
+    work_dir : str, optional
+        Directory holding (or receiving) the per-day TLE files. If None, uses
+        current working directory.
+    n : int, optional
+        Number of Space-Track queries when a day's TLEs have to be downloaded,
+        chosen automatically by default.
+    spacetrack_account, spacetrack_password : str, optional
+        Space-Track.org credentials for downloading missing days. If None, the
+        SPACETRACK_ACCT and SPACETRACK_PASS environment variables are used.
+    threshold : float, default=3
+        Separation in degrees below which a satellite is reported.
+    maxCatalogs : int, default=4
+        Number of parsed daily catalogs kept in memory.
+    batchWindow : float, default=0.005
+        Seconds to wait after the first queued query for others to batch with.
+    maxBatch : int, default=256
+        Largest number of queries propagated together.
+    site : str or dict, default=DEFAULT_SITE
+        Site the queries are answered for, a name or telescope_id in
+        satcheck.sites.SITES or a site dict.
+
+    Examples
+    --------
+    >>> with CrossmatchService(work_dir="/data/tles/") as service:
+    ...     result = service.query("4h12m00s", "12d30m00s", 59000.2, duration=300)
+    ...     print(result['hits'])
+    """
+
+    def __init__(self, work_dir=None, n=None, spacetrack_account=None, spacetrack_password=None,
+                 threshold=3, maxCatalogs=4, batchWindow=0.005, maxBatch=256, site=DEFAULT_SITE):
+
+        # Set work directory, default to current working directory
+        if work_dir is None:
+            work_dir = os.getcwd()
+        os.makedirs(work_dir, exist_ok=True)
+
+        self.work_dir = work_dir
+        self.n = n
+        self.spacetrack_account = spacetrack_account
+        self.spacetrack_password = spacetrack_password
+        self.threshold = threshold
+        self.maxCatalogs = maxCatalogs
+        self.batchWindow = batchWindow
+        self.maxBatch = maxBatch
+
+        # Create ephem Observer object for the site, only ever used by the worker
+        self.site = siteNamed(site)
+        self.observer = siteObserver(self.site)
+
+        self.catalogs = OrderedDict()
+        self.stats = {'queries' : 0, 'batches' : 0, 'propagations' : 0, 'ephem_evaluations' : 0,
+                      'catalog_hits' : 0, 'catalog_loads' : 0, 'errors' : 0, 'busy_seconds' : 0.0}
+        self.started = time.time()
+
+        self._queue = queue.Queue()
+        self._worker = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """
+        Start the worker thread.
+        """
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._work, name='satcheck-crossmatch', daemon=True)
+            self._worker.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the worker thread once the queued queries are answered.
+        """
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+
+    def catalog(self, mjd):
+        """
+        Parsed TLE catalog covering an observation start time.
+
+        Catalogs are cached per UTC day; a day with neither a full nor a
+        selection's TLE file in work_dir is downloaded first (see dayTLEFiles).
+        Only call this from the worker.
+        """
+        path = tle_filename(mjd, self.work_dir)
+        if path in self.catalogs:
+            self.catalogs.move_to_end(path)
+            self.stats['catalog_hits'] += 1
+            return self.catalogs[path]
+
+        paths = dayTLEFiles(mjd, self.work_dir)
+        if not paths:
+            from .findSats import downloadTLEs
+            downloadTLEs([], self.n, self.spacetrack_account, self.spacetrack_password, work_dir=self.work_dir, start_time_mjd=[mjd])
+            paths = [path]
+
+        satdict = {}
+        for tle_file in paths:
+            satdict.update(load_tle(tle_file))
+        self.stats['catalog_loads'] += 1
+        self.catalogs[path] = satdict
+        while len(self.catalogs) > self.maxCatalogs:
+            self.catalogs.popitem(last=False)
+        return satdict
+
+    def submit(self, ra, dec, tstart, duration=300, step=1, tracks=False):
+        """
+        Queue a query and return a Future for its result.
+
+        Parameters
+        ----------
+        ra, dec : float or str
+            Target position, in degrees or as header strings (see parseRaDec).
+        tstart : float
+            Start time (MJD) of the observation.
+        duration : float, default=300
+            Length of the observation in seconds.
+        step : float, default=1
+            Sampling interval in seconds; as in separation(), the first sample
+            is one step after tstart.
+        tracks : bool, default=False
+            Include the separation samples of each satellite in the result.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the dict described in query().
+
+        Raises
+        ------
+        ValueError
+            If the query is malformed.
+        """
+        raRad, decRad = parseRaDec(ra, dec)
+        tstart, duration, step = float(tstart), float(duration), float(step)
+        if duration <= 0 or step <= 0 or duration / step > 86400:
+            raise ValueError(f'Invalid duration {duration} s with step {step} s')
+
+        request = {'ra' : raRad, 'dec' : decRad, 'tstart' : tstart, 'duration' : duration,
+                   'step' : step, 'tracks' : bool(tracks), 'future' : Future(), 'received' : time.perf_counter()}
+        self._queue.put(request)
+        return request['future']
+
+    def query(self, ra, dec, tstart, duration=300, step=1, tracks=False, timeout=None):
+        """
+        Crossmatch one pointing, blocking until the answer is ready.
+
+        Returns
+        -------
+        dict
+            - 'tstart', 'duration', 'ra', 'dec' (degrees), 'threshold'
+            - 'hits': one entry per satellite closer than threshold with
+              'satellite', 'minSeparation' (degrees), 'minTime' (seconds after
+              start) and 'samples', plus 'Time after start' and 'Separation'
+              lists if tracks was set, sorted by minSeparation
+            - 'batchSize': number of queries propagated together
+            - 'elapsed_ms': time from submission to answer
+        """
+        return self.submit(ra, dec, tstart, duration, step, tracks).result(timeout)
+
+    def _work(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+
+            # collect whatever else arrives within the batch window
+            batch = [request]
+            stopping = False
+            deadline = time.perf_counter() + self.batchWindow
+            while len(batch) < self.maxBatch:
+                try:
+                    request = self._queue.get(timeout=max(0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+
+            t0 = time.perf_counter()
+            self._run(batch)
+            self.stats['busy_seconds'] += time.perf_counter() - t0
+
+            if stopping:
+                return
+
+    def _run(self, batch):
+        self.stats['batches'] += 1
+        self.stats['queries'] += len(batch)
+
+        byDay = {}
+        for request in batch:
+            byDay.setdefault(tle_filename(request['tstart'], self.work_dir), []).append(request)
+
+        for requests in byDay.values():
+            try:
+                satdict = self.catalog(requests[0]['tstart'])
+
+                # propagate once over the union of all requested sample times,
+                # keyed to the microsecond so equal times from different queries merge
+                offsets = [np.arange(1, int(r['duration'] / r['step']) + 1) * r['step'] for r in requests]
+                keys = np.concatenate([np.round((r['tstart'] + off / 86400) * 86400e6) for r, off in zip(requests, offsets)])
+                uniqueKeys, inverse = np.unique(keys, return_inverse=True)
+
+                names, satRa, satDec = satellitePositions(satdict, uniqueKeys / 86400e6, self.observer)
+                self.stats['propagations'] += 1
+                self.stats['ephem_evaluations'] += satRa.size
+
+                start = 0
+                for request, off in zip(requests, offsets):
+                    cols = inverse[start:start+len(off)]
+                    start += len(off)
+                    request['future'].set_result(self._answer(request, names, satRa[:, cols], satDec[:, cols], off, len(batch)))
+
+            except Exception as e:
+                self.stats['errors'] += len(requests)
+                for request in requests:
+                    if not request['future'].done():
+                        request['future'].set_exception(e)
+
+    def _answer(self, request, names, satRa, satDec, offsets, batchSize):
+        sep = np.rad2deg(angularSeparation(satRa, satDec, request['ra'], request['dec']))
+        close = sep < self.threshold
+
+        hits = []
+        for ii in np.flatnonzero(close.any(axis=1)):
+            mask = close[ii]
+            best = int(np.argmin(np.where(mask, sep[ii], np.inf)))
+            hit = {'satellite' : names[ii],
+                   'minSeparation' : float(sep[ii, best]),
+                   'minTime' : float(offsets[best]),
+                   'samples' : int(mask.sum())}
+            if request['tracks']:
+                hit['Time after start'] = offsets[mask].tolist()
+                hit['Separation'] = sep[ii, mask].tolist()
+            hits.append(hit)
+        hits.sort(key=lambda hit: hit['minSeparation'])
+
+        return {'tstart' : request['tstart'],
+                'duration' : request['duration'],
+                'ra' : float(np.rad2deg(request['ra'])),
+                'dec' : float(np.rad2deg(request['dec'])),
+                'threshold' : self.threshold,
+                'hits' : hits,
+                'batchSize' : batchSize,
+                'elapsed_ms' : (time.perf_counter() - request['received']) * 1e3}
+
+    def handle(self, message):
+        """
+        Answer one decoded JSON query (or a list of them) from a client.
+
+        Errors are returned as {'error': message} instead of raised.
+        """
+        if isinstance(message, list):
+            futures = []
+            for item in message:
+                try:
+                    futures.append(self._submitMessage(item))
+                except (ValueError, TypeError, AttributeError) as e:
+                    futures.append(e)
+            return [self._resolve(f) for f in futures]
+
+        try:
+            return self._resolve(self._submitMessage(message))
+        except (ValueError, TypeError, AttributeError) as e:
+            return {'error' : str(e)}
+
+    def _submitMessage(self, message):
+        missing = [key for key in ('ra', 'dec', 'tstart') if key not in message]
+        if missing:
+            raise ValueError(f'Query is missing {", ".join(missing)}')
+        return self.submit(message['ra'], message['dec'], message['tstart'],
+                           duration=message.get('duration', 300), step=message.get('step', 1),
+                           tracks=message.get('tracks', False))
+
+    def _resolve(self, future):
+        if isinstance(future, Exception):
+            return {'error' : str(future)}
+        try:
+            return future.result()
+        except Exception as e:
+            return {'error' : f'{type(e).__name__}: {e}'}
+
+    def status(self):
+        """
+        Service counters and the days currently held in memory.
+        """
+        stats = dict(self.stats)
+        stats['uptime_seconds'] = time.time() - self.started
+        stats['queued'] = self._queue.qsize()
+        stats['mean_batch_size'] = stats['queries'] / stats['batches'] if stats['batches'] else 0
+        stats['catalogs'] = {os.path.basename(path) : len(satdict) for path, satdict in self.catalogs.items()}
+        return stats
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+
+    # keep connections open between queries from the same client
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply(self, message):
+        result = self.server.service.handle(message)
+        failed = isinstance(result, dict) and 'error' in result
+        self._send(400 if failed else 200, result)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self._send(200, {'status' : 'ok'})
+        elif url.path == '/stats':
+            self._send(200, self.server.service.status())
+        elif url.path == '/query':
+            message = {key : values[-1] for key, values in parse_qs(url.query).items()}
+            if 'tracks' in message:
+                message['tracks'] = message['tracks'].lower() in ('1', 'true', 'yes')
+            self._reply(message)
+        else:
+            self._send(404, {'error' : f'Unknown path {url.path}'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if urlparse(self.path).path != '/query':
+            self._send(404, {'error' : f'Unknown path {self.path}'})
+            return
+        try:
+            message = json.loads(body)
+        except ValueError as e:
+            self._send(400, {'error' : f'Invalid JSON: {e}'})
+            return
+        self._reply(message)
+
+class _UnixHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # one JSON query (or list of queries) per line, one JSON answer per line
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError as e:
+                result = {'error' : f'Invalid JSON: {e}'}
+            else:
+                if message in ('stats', {'stats' : True}):
+                    result = self.server.service.status()
+                else:
+                    result = self.server.service.handle(message)
+            self.wfile.write(json.dumps(result).encode() + b'\n')
+            self.wfile.flush()
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(service, host='127.0.0.1', port=DEFAULT_PORT, unix_socket=None):
+    """
+    Serve a CrossmatchService until interrupted.
+
+    Parameters
+    ----------
+    service : CrossmatchService
+        The service to expose; it is started if it is not running.
+    host : str, default='127.0.0.1'
+        Address for the HTTP server.
+    port : int, default=8765
+        Port for the HTTP server. Use None to only serve the Unix socket.
+    unix_socket : str, optional
+        Also accept newline-delimited JSON queries on this Unix socket path.
+
+    Notes
+    -----
+    HTTP endpoints:
+    - GET /query?ra=63&dec=12.5&tstart=59000.2&duration=300
+    - POST /query with a JSON object (or list of objects) with the same keys
+    - GET /stats and GET /health
+    """
+    service.start()
+
+    servers = []
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        unixServer = _UnixServer(unix_socket, _UnixHandler)
+        unixServer.service = service
+        servers.append(unixServer)
+        print(f'Listening on unix socket {unix_socket}')
+    if port is not None:
+        httpServer = ThreadingHTTPServer((host, port), _HTTPHandler)
+        httpServer.daemon_threads = True
+        httpServer.service = service
+        servers.append(httpServer)
+        print(f'Listening on http://{host}:{httpServer.server_address[1]}')
+
+    if len(servers) == 0:
+        raise ValueError('Nothing to serve, give a port or a unix socket')
+
+    threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in servers]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print('Shutting down')
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        service.stop()
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Serve satellite crossmatch queries from warm in-memory TLE catalogs')
+    parser.add_argument('--work_dir', help='directory with the daily TLE files, defaults to current working directory', default=None)
+    parser.add_argument('--host', help='address to serve HTTP on', default='127.0.0.1')
+    parser.add_argument('--port', help=f'port to serve HTTP on, default {DEFAULT_PORT}', default=DEFAULT_PORT, type=int)
+    parser.add_argument('--no-http', help='only serve the unix socket', action='store_true')
+    parser.add_argument('--unix', help='also serve newline-delimited JSON on this unix socket path', default=None)
+    parser.add_argument('--threshold', help='separation in degrees below which satellites are reported', default=3, type=float)
+    parser.add_argument('--site', help='site to answer queries for (e.g. GBT, Parkes, MeerKAT, or a telescope_id)', default='GBT')
+    parser.add_argument('--catalogs', help='number of daily catalogs kept in memory', default=4, type=int)
+    parser.add_argument('--batch-ms', help='milliseconds to wait for concurrent queries to batch together', default=5, type=float)
+    parser.add_argument('--preload', help='MJDs whose catalogs are loaded before serving', nargs='*', type=float, default=[])
+    parser.add_argument('--n', help='split the NORAD ids into exactly n Space-Track queries, chosen automatically by default', default=None, type=int)
+    parser.add_argument('--spacetrack_account', help='Space-Track.org account, defaults to $SPACETRACK_ACCT', default=None)
+    parser.add_argument('--spacetrack_password', help='Space-Track.org password, defaults to $SPACETRACK_PASS', default=None)
+    args = parser.parse_args(argv)
+
+    service = CrossmatchService(args.work_dir, n=args.n, spacetrack_account=args.spacetrack_account,
+                                spacetrack_password=args.spacetrack_password, threshold=args.threshold,
+                                maxCatalogs=args.catalogs, batchWindow=args.batch_ms / 1e3, site=args.site)
+
+    for mjd in args.preload:
+        print(f'Preloading {convert(mjd)}')
+        service.catalog(mjd)
+
+    serve(service, host=args.host, port=None if args.no_http else args.port, unix_socket=args.unix)
+
+if __name__ == '__main__':
+    sys.exit(main())
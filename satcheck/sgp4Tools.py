@@ -0,0 +1,213 @@
+import os
+import numpy as np
+
+'''
+Vectorized satellite propagation with the sgp4 package.
+
+separation() steps PyEphem one satellite and one second at a time, which is
+fine for a few files but far too slow for thousands of satellites at
+thousands of times. SatrecArray propagates a whole catalog over an array of
+times in C++, and the topocentric RA/Dec is then computed with numpy.
+
+Positions are in the TEME frame of SGP4, so RA/Dec are referred to the true
+equator and mean equinox of date. They agree with PyEphem's topocentric
+ra/dec to a few hundredths of a degree (worst for MEO/GEO, which SGP4 and
+PyEphem propagate slightly differently), far below the separation thresholds
+used by SatCheck.
+'''
+
+# Green Bank Telescope, as used in findSats
+GBT_SITE = {'lat' : 38.432987, 'lon' : -79.839857, 'elevation' : 807.0}
+
+# WGS84 ellipsoid
+EARTH_RADIUS_KM = 6378.137
+EARTH_FLATTENING = 1 / 298.257223563
+EARTH_ROTATION = 7.292115146706979e-5 # rad/s
+
+MJD_TO_JD = 2400000.5
+
+def readTLELines(filename):
+    """
+    Read the element lines of a TLE file written by downloadTLEs.
+
+    Parameters
+    ----------
+    filename : str
+        Path to a 3 line TLE file.
+
+    Returns
+    -------
+    dict
+        Mapping of satellite names, formatted as in load_tle ("NAME NORADID"),
+        to their (line 1, line 2). Later entries for the same satellite win.
+    """
+    if not os.path.exists(filename):
+        print(f"Warning: TLE file {filename} does not exist")
+        return {}
+
+    with open(filename) as f:
+        lines = [line.strip() for line in f]
+
+    tles = {}
+    i = 0
+    while i < len(lines) - 2:
+        l1, l2, l3 = lines[i], lines[i+1], lines[i+2]
+        if not l1 or not l2.startswith('1 ') or not l3.startswith('2 '):
+            i += 1
+            continue
+
+        parts = l3.split()
+        tles[l1.replace('0 ', '') + ' ' + parts[1]] = (l2, l3)
+        i += 3
+
+    return tles
+
+def satrecArray(tles):
+    """
+    Build a SatrecArray from readTLELines output.
+
+    Returns
+    -------
+    tuple of (list, list, sgp4.api.SatrecArray)
+        Names, the individual Satrec objects (to build subsets from) and the
+        array of all of them.
+    """
+    from sgp4.api import Satrec, SatrecArray
+
+    names = list(tles)
+    sats = [Satrec.twoline2rv(*tles[name]) for name in names]
+    return names, sats, SatrecArray(sats)
+
+def gmst(jd):
+    """
+    Greenwich mean sidereal time in radians (IAU 1982, as used by SGP4).
+    """
+    tut1 = (jd - 2451545.0) / 36525.0
+    seconds = (-6.2e-6 * tut1**3 + 0.093104 * tut1**2
+               + (876600.0 * 3600 + 8640184.812866) * tut1 + 67310.54841)
+    return np.mod(np.deg2rad(seconds / 240.0), 2 * np.pi)
+
+def siteVector(site):
+    """
+    Earth-fixed position of a site in km, from its geodetic 'lat' and 'lon'
+    in degrees and 'elevation' in m.
+
+    Returns
+    -------
+    tuple of (float, float)
+        Distance from the rotation axis and height above the equator plane.
+    """
+    lat = np.deg2rad(site['lat'])
+    e2 = EARTH_FLATTENING * (2 - EARTH_FLATTENING)
+    N = EARTH_RADIUS_KM / np.sqrt(1 - e2 * np.sin(lat)**2)
+    h = site['elevation'] / 1e3
+    return (N + h) * np.cos(lat), (N * (1 - e2) + h) * np.sin(lat)
+
+def topocentricVectors(sats, mjds, site=GBT_SITE):
+    """
+    Satellite positions and velocities relative to a site, in TEME.
+
+    Parameters
+    ----------
+    sats : sgp4.api.SatrecArray
+        Satellites to propagate.
+    mjds : array_like
+        Times (MJD, UTC) to evaluate.
+    site : dict, default=GBT_SITE
+        Observer 'lat', 'lon' (degrees) and 'elevation' (m).
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        Position (km) and velocity (km/s) of each satellite relative to the
+        observer, of shape (nsats, ntimes, 3), and the SGP4 error code of
+        shape (nsats, ntimes) (non-zero where a satellite could not be
+        propagated, e.g. after decay).
+    """
+    mjds = np.atleast_1d(np.asarray(mjds, dtype=float))
+    rho, z = siteVector(site)
+
+    days = np.floor(mjds)
+    err, r, v = sats.sgp4(days + MJD_TO_JD, mjds - days)
+
+    # observer position and velocity in TEME at each time
+    theta = gmst(mjds + MJD_TO_JD) + np.deg2rad(site['lon'])
+    obs = np.stack([rho * np.cos(theta), rho * np.sin(theta), np.full_like(theta, z)], axis=-1)
+    obsVel = EARTH_ROTATION * np.stack([-obs[:, 1], obs[:, 0], np.zeros_like(theta)], axis=-1)
+
+    return r - obs, v - obsVel, err
+
+def vectorsToRaDec(topo):
+    """
+    RA and Dec (radians) and length of position vectors with xyz on the last axis.
+    """
+    dist = np.linalg.norm(topo, axis=-1)
+    ra = np.mod(np.arctan2(topo[..., 1], topo[..., 0]), 2 * np.pi)
+    dec = np.arcsin(topo[..., 2] / dist)
+    return ra, dec, dist
+
+def elevation(topo, mjds, site=GBT_SITE):
+    """
+    Elevation (radians) above the site's horizon of topocentric TEME vectors
+    of shape (nsats, ntimes, 3) from topocentricVectors.
+    """
+    lat = np.deg2rad(site['lat'])
+    theta = gmst(np.atleast_1d(np.asarray(mjds, dtype=float)) + MJD_TO_JD) + np.deg2rad(site['lon'])
+    up = np.stack([np.cos(lat) * np.cos(theta), np.cos(lat) * np.sin(theta), np.full_like(theta, np.sin(lat))], axis=-1)
+    return np.arcsin(np.einsum('stc,tc->st', topo, up) / np.linalg.norm(topo, axis=-1))
+
+def topocentric(sats, mjds, site=GBT_SITE, maxElements=2**21):
+    """
+    Topocentric direction, range and speed of satellites seen from a site.
+
+    Parameters
+    ----------
+    sats : sgp4.api.SatrecArray
+        Satellites to propagate.
+    mjds : array_like
+        Times (MJD, UTC) to evaluate.
+    site : dict, default=GBT_SITE
+        Observer 'lat', 'lon' (degrees) and 'elevation' (m).
+    maxElements : int, default=2**21
+        Times are propagated in chunks of at most this many satellite-time
+        pairs to bound memory use.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        RA and Dec (radians), range (km) and speed relative to the observer
+        (km/s), each of shape (nsats, ntimes). Satellites SGP4 cannot
+        propagate at a time (e.g. decayed) are NaN there.
+    """
+    mjds = np.atleast_1d(np.asarray(mjds, dtype=float))
+    nsats = len(sats)
+
+    shape = (nsats, len(mjds))
+    ra, dec, dist, speed = np.empty(shape), np.empty(shape), np.empty(shape), np.empty(shape)
+
+    chunk = max(1, maxElements // max(nsats, 1))
+    for t0 in range(0, len(mjds), chunk):
+        t1 = min(t0 + chunk, len(mjds))
+        topo, vel, err = topocentricVectors(sats, mjds[t0:t1], site)
+
+        ra[:, t0:t1], dec[:, t0:t1], dist[:, t0:t1] = vectorsToRaDec(topo)
+        speed[:, t0:t1] = np.linalg.norm(vel, axis=-1)
+
+        bad = err != 0
+        if bad.any():
+            for arr in (ra, dec, dist, speed):
+                arr[:, t0:t1][bad] = np.nan
+
+    return ra, dec, dist, speed
+
+def maxAngularMotion(dist, speed, dt):
+    """
+    Upper bound on how far (radians) a satellite can move across the sky
+    within dt seconds of a sample taken at the given range and speed.
+
+    The speed is padded by 10% to cover its change between samples.
+    """
+    travel = 1.1 * speed * dt
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bound = np.where(dist > travel, travel / (dist - travel), np.pi)
+    return np.minimum(np.nan_to_num(bound, nan=np.pi), np.pi)
@@ -0,0 +1,222 @@
+import os, sys, ast, glob, json, time
+import numpy as np
+import argparse
+
+from .findSatsHelper import convert
+from .passIndex import PassIndex, indexPath
+
+'''
+Splitting a findSats run across several analysis nodes.
+
+Files are grouped by observation (UTC) date, since TLEs are downloaded and
+parsed per date, and whole dates are assigned to shards. Each shard writes to
+its own subdirectory of the shared work_dir and mergeShards combines them.
+'''
+
+SUMMARY_NAME = 'files_affected_by_sats.csv'
+PASSES_NAME = 'sat_passes.csv'
+MANIFEST_NAME = 'shard.json'
+
+def parseShard(shard):
+    """
+    Parse a shard specification.
+
+    Parameters
+    ----------
+    shard : str or tuple of (int, int)
+        Either "i/N" or (i, N), with 0 <= i < N.
+
+    Returns
+    -------
+    tuple of (int, int)
+        Shard index and number of shards.
+
+    Raises
+    ------
+    ValueError
+        If the specification is malformed or out of range.
+    """
+    if isinstance(shard, str):
+        try:
+            index, count = (int(x) for x in shard.split('/'))
+        except ValueError:
+            raise ValueError(f"Shard must look like 'i/N', got '{shard}'")
+    else:
+        index, count = shard
+
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f'Shard index must satisfy 0 <= i < N, got {index}/{count}')
+
+    return index, count
+
+def shardDir(work_dir, shard):
+    """
+    Directory that one shard writes all of its outputs (TLEs, CSVs) to.
+    """
+    index, count = parseShard(shard)
+    return os.path.join(work_dir, f'shard_{index}_of_{count}')
+
+def observationDates(start_time_mjd):
+    """
+    UTC date (YYYY-MM-DD) of each observation start time, which is the date
+    its TLE file is named after.
+    """
+    return [convert(mjd).split('T')[0] for mjd in start_time_mjd]
+
+def partitionByDate(start_time_mjd, count):
+    """
+    Deterministically assign observations to shards, keeping each date together.
+
+    Dates are assigned largest first to the shard with the fewest files so far,
+    so the partition only depends on the set of files and not on their order,
+    and every node computes the same split.
+
+    Parameters
+    ----------
+    start_time_mjd : list of float
+        Observation start times (MJD).
+    count : int
+        Number of shards.
+
+    Returns
+    -------
+    list of list of int
+        For each shard, the indices of its observations in input order.
+    """
+    dates = observationDates(start_time_mjd)
+    uniqueDates, sizes = np.unique(dates, return_counts=True)
+
+    loads = [0] * count
+    owner = {}
+    for ii in sorted(range(len(uniqueDates)), key=lambda ii: (-sizes[ii], uniqueDates[ii])):
+        target = loads.index(min(loads))
+        owner[uniqueDates[ii]] = target
+        loads[target] += sizes[ii]
+
+    parts = [[] for _ in range(count)]
+    for ii, date in enumerate(dates):
+        parts[owner[date]].append(ii)
+
+    return parts
+
+def writeShardManifest(work_dir, shard, filenames, start_time_mjd):
+    """
+    Record that a shard finished, with the files and dates it covered.
+    """
+    index, count = parseShard(shard)
+    manifest = {'index' : index,
+                'count' : count,
+                'files' : [str(f) for f in filenames],
+                'dates' : sorted(set(observationDates(start_time_mjd))),
+                'finished' : time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    with open(os.path.join(work_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def mergeShards(work_dir=None, allow_partial=False):
+    """
+    Combine the outputs of a sharded findSats run.
+
+    Parameters
+    ----------
+    work_dir : str, optional
+        The work_dir shared by all shards. Defaults to the current directory.
+    allow_partial : bool, default=False
+        Merge even if some shards have not finished.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The combined summary, also written to work_dir as
+        files_affected_by_sats.csv.
+
+    Raises
+    ------
+    IOError
+        If there are no shard outputs, they come from runs with different
+        numbers of shards, or (unless allow_partial) a shard is missing.
+
+    Notes
+    -----
+    All pass samples referenced by the shard summaries are also streamed, one
+    CSV at a time, into a single long-format table sat_passes.csv with
+    columns 'filepath', 'satellite', 'csvPath', 'Time after start',
+    'Separation', 'RA' and 'DEC', and the shards' pass indices are merged
+    into work_dir/pass_index.sqlite.
+
+    Examples
+    --------
+    >>> summary = mergeShards("/output/")
+    """
+    import pandas as pd
+    from .genPlotsAll import decryptSepName
+
+    # Set work directory, default to current working directory
+    if work_dir is None:
+        work_dir = os.getcwd()
+
+    manifests = []
+    for path in sorted(glob.glob(os.path.join(work_dir, 'shard_*_of_*', MANIFEST_NAME))):
+        with open(path) as f:
+            manifests.append((os.path.dirname(path), json.load(f)))
+
+    if len(manifests) == 0:
+        raise IOError(f'No finished shards found in {work_dir}')
+
+    counts = {m['count'] for _, m in manifests}
+    if len(counts) > 1:
+        raise IOError(f'Shard outputs in {work_dir} come from runs with different shard counts: {sorted(counts)}')
+
+    count = counts.pop()
+    missing = sorted(set(range(count)) - {m['index'] for _, m in manifests})
+    if missing and not allow_partial:
+        raise IOError(f'Shards {missing} of {count} have not finished, rerun them or pass allow_partial')
+    elif missing:
+        print(f'Warning: merging without shards {missing} of {count}')
+
+    summaries = []
+    passesPath = os.path.join(work_dir, PASSES_NAME)
+    writeHeader = True
+    for dirname, manifest in sorted(manifests, key=lambda x: x[1]['index']):
+        # keep the N/A of files without passes as written, read_csv would make it NaN
+        summary = pd.read_csv(os.path.join(dirname, SUMMARY_NAME), index_col=0, keep_default_na=False)
+        summaries.append(summary)
+
+        for h5, csvs in zip(summary['filepath'], summary['csvPaths']):
+            if csvs == 'N/A':
+                continue
+            for csv in ast.literal_eval(csvs):
+                passes = pd.read_csv(csv, index_col=0)
+                passes.insert(0, 'csvPath', csv)
+                passes.insert(0, 'satellite', decryptSepName(csv)[0])
+                passes.insert(0, 'filepath', h5)
+                passes.to_csv(passesPath, mode='w' if writeHeader else 'a', header=writeHeader, index=False)
+                writeHeader = False
+
+    # combine the shards' pass indices
+    with PassIndex(work_dir) as passIndex:
+        for dirname, manifest in manifests:
+            if os.path.exists(indexPath(dirname)):
+                passIndex.merge(indexPath(dirname))
+
+    merged = pd.concat(summaries, ignore_index=True)
+    summaryPath = os.path.join(work_dir, SUMMARY_NAME)
+    merged.to_csv(summaryPath)
+
+    print(f"Merged {len(manifests)} shards into: {summaryPath}")
+    if not writeHeader:
+        print(f"Pass samples saved to: {passesPath}")
+
+    return merged
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Merge the outputs of a sharded findSats run')
+    parser.add_argument('--work_dir', help='work_dir shared by the shards, defaults to current working directory', default=None)
+    parser.add_argument('--allow_partial', help='merge even if some shards have not finished', action='store_true')
+    args = parser.parse_args(argv)
+
+    mergeShards(args.work_dir, allow_partial=args.allow_partial)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import ephem
+
+from .sgp4Tools import GBT_SITE
+
+'''
+Registry of the observatories findSats can crossmatch observations from.
+
+findSats used to put every observation at the Green Bank Telescope. Each h5
+header records the telescope it was taken with as a sigproc telescope_id, so
+the site of every file is now looked up in SITES from its header, and a single
+run can crossmatch a mix of GBT, Parkes, MeerKAT, ... files. Everything that
+depends on the site (the ephem observer, visibility indices, ephemeris caches
+and the primary beam of the separation tiers) is built once per site and
+reused for every file from it.
+
+A site is a dict with its 'name', geodetic 'lat' and 'lon' (degrees),
+'elevation' (m) and dish 'diameter' (m), the same keys as GBT_SITE in
+satcheck.sgp4Tools plus the name and diameter. Telescopes missing from SITES
+can be added with registerSite:
+
+    >>> registerSite(12, 'VLA', 34.078749, -107.618283, 2124.0, diameter=25.0)
+'''
+
+# sigproc telescope_id -> site
+SITES = {
+    1 : {'name' : 'Arecibo', 'lat' : 18.344167, 'lon' : -66.752778, 'elevation' : 497.0, 'diameter' : 305.0},
+    4 : {'name' : 'Parkes', 'lat' : -32.998370, 'lon' : 148.263510, 'elevation' : 414.8, 'diameter' : 64.0},
+    5 : {'name' : 'Jodrell', 'lat' : 53.236250, 'lon' : -2.307150, 'elevation' : 77.0, 'diameter' : 76.0},
+    6 : dict(GBT_SITE, name='GBT', diameter=100.0),
+    7 : {'name' : 'GMRT', 'lat' : 19.096517, 'lon' : 74.049742, 'elevation' : 650.0, 'diameter' : 45.0},
+    8 : {'name' : 'Effelsberg', 'lat' : 50.524833, 'lon' : 6.883611, 'elevation' : 369.0, 'diameter' : 100.0},
+    9 : {'name' : 'ATA', 'lat' : 40.817431, 'lon' : -121.470736, 'elevation' : 1019.0, 'diameter' : 6.1},
+    10 : {'name' : 'SRT', 'lat' : 39.493070, 'lon' : 9.245151, 'elevation' : 650.0, 'diameter' : 64.0},
+    64 : {'name' : 'MeerKAT', 'lat' : -30.711055, 'lon' : 21.443888, 'elevation' : 1086.0, 'diameter' : 13.5},
+}
+
+# site of observations whose header has no (known) telescope_id
+DEFAULT_SITE = SITES[6]
+
+# telescope ids already warned about
+_unknown = set()
+
+def registerSite(telescope_id, name, lat, lon, elevation, diameter=None):
+    """
+    Add or replace a site in SITES.
+
+    Parameters
+    ----------
+    telescope_id : int
+        sigproc telescope_id of the site's observations.
+    name : str
+        Name of the site.
+    lat, lon : float
+        Geodetic latitude and east longitude in degrees.
+    elevation : float
+        Height above the WGS84 ellipsoid in m.
+    diameter : float, optional
+        Dish diameter in m, for the primary beam separation tiers.
+
+    Returns
+    -------
+    dict
+        The site.
+    """
+    site = {'name' : name, 'lat' : float(lat), 'lon' : float(lon), 'elevation' : float(elevation), 'diameter' : diameter}
+    SITES[int(telescope_id)] = site
+    return site
+
+def siteNamed(name):
+    """
+    Site registered under a name (any case) or telescope id.
+
+    Raises
+    ------
+    ValueError
+        If no site has that name or id.
+    """
+    if isinstance(name, dict):
+        return name
+    for telescope_id, site in SITES.items():
+        if str(name).lower() in (site['name'].lower(), str(telescope_id)):
+            return site
+    raise ValueError(f"Unknown site '{name}', known sites are {', '.join(site['name'] for site in SITES.values())}")
+
+def siteOfTelescope(telescope_id, default=DEFAULT_SITE, h5Path=None):
+    """
+    Site of a sigproc telescope_id, as read from an observation's header.
+
+    Parameters
+    ----------
+    telescope_id : int or None
+        The header's telescope_id, None if it has none.
+    default : dict, default=DEFAULT_SITE
+        Site of observations without a telescope_id, or with one missing from
+        SITES; a warning is printed the first time each id is met.
+    h5Path : str, optional
+        File the id was read from, for the warning.
+
+    Returns
+    -------
+    dict
+        The site.
+    """
+    try:
+        telescope_id = int(telescope_id)
+    except (TypeError, ValueError):
+        telescope_id = None
+
+    if telescope_id in SITES:
+        return SITES[telescope_id]
+    if telescope_id not in _unknown:
+        _unknown.add(telescope_id)
+        print(f"Warning: telescope_id {telescope_id} of {h5Path} is not a known site, crossmatching it from {default['name']}")
+    return default
+
+def siteOf(h5Path, default=DEFAULT_SITE):
+    """
+    Site an observation was taken at, from the telescope_id of its header.
+    Reads the header; use siteOfTelescope if it has been read already.
+
+    Parameters
+    ----------
+    h5Path : str
+        Path to HDF5 observation file.
+    default : dict, default=DEFAULT_SITE
+        As for siteOfTelescope.
+
+    Returns
+    -------
+    dict
+        The site.
+    """
+    from .h5Tools import readH5Header
+
+    try:
+        telescope_id = readH5Header(h5Path).get('telescope_id')
+    except OSError:
+        telescope_id = None
+    return siteOfTelescope(telescope_id, default, h5Path)
+
+def siteObserver(site=DEFAULT_SITE):
+    """
+    ephem Observer at a site.
+    """
+    observer = ephem.Observer()
+    observer.long = str(site['lon'])
+    observer.lat = str(site['lat'])
+    observer.elevation = site['elevation']
+    return observer
@@ -0,0 +1,196 @@
+import os, glob
+import numpy as np
+
+from .findSatsHelper import pull_relevant_header_info
+from .findSats import io, downloadTLEs, _crossmatchFile, _writeFileOutputs, _summaryFrame, _observationSpan, _tleFile, _fileSite, _incompletePath
+from .sites import siteNamed
+from .passIndex import PassIndex
+from .memo import CrossmatchMemo
+from .tiers import SeparationTiers
+from .metrics import count
+
+'''
+findSats as a stream of observations, for archives too large to hold at once.
+
+findSats lists every file, reads every header and keeps every result until
+the end of the run, so its memory grows with the archive and nothing is on
+disk until it finishes. iterFindSats takes one observation at a time through
+
+    header -> TLE lookup (downloading the day if needed) -> crossmatch -> writes
+
+and yields its summary row as soon as its separation CSVs and pass index rows
+are written. Summary rows are appended to files_affected_by_sats.csv every
+`batch` files, and only the current day's ephemeris cache and visibility index
+are kept, so memory is bounded by the batch size and a single day's catalog
+whatever the number of files, and an interrupted run keeps everything up to
+its last batch.
+'''
+
+SUMMARY_FILE = 'files_affected_by_sats.csv'
+BATCH_SIZE = 100
+
+def iterFiles(dir=None, file=None, file_list=None, pattern='*.h5'):
+    """
+    Observation files one at a time, from the same sources as find_files.
+
+    Parameters
+    ----------
+    dir : str, optional
+        Directory to glob with pattern (ending with '/').
+    file : str, optional
+        Text file with one h5 path per line; blank lines and lines starting
+        with '#' are skipped.
+    file_list : iterable of str, optional
+        The files themselves.
+    pattern : str, default='*.h5'
+        Glob pattern for dir.
+
+    Yields
+    ------
+    str
+        Path of each observation file.
+    """
+    if dir is not None:
+        files = glob.iglob(dir + pattern)
+    elif file is not None:
+        files = _lines(file)
+    elif file_list is not None:
+        files = iter(file_list)
+    else:
+        raise IOError('Please input either a directory housing h5 files or a file with a list of h5 paths')
+
+    for fil_file in files:
+        count('files')
+        yield fil_file
+
+def _lines(path):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
+def iterFindSats(dir=None, file=None, pattern='*.h5', /, file_list=None, n=None, spacetrack_account=None, spacetrack_password=None,
+                 work_dir=None, plot=False, ephem_cache=False, visibility=False, downlinks=None, tiers=None, selector=None, site=None, memoize=False, batch=BATCH_SIZE):
+    """
+    Crossmatch observation files one at a time, yielding each summary row as it is written.
+
+    Takes the inputs and options of findSats. Each file's separation CSVs,
+    plots and pass index rows are written before its row is yielded, and the
+    summary rows are appended to work_dir/files_affected_by_sats.csv every
+    batch files and when the generator finishes or is closed.
+
+    Parameters
+    ----------
+    dir, file, pattern, file_list :
+        Files to crossmatch, as for findSats. Files are taken in the order
+        they are found, without reading the whole list first.
+    n : int, optional
+        Number of Space-Track queries per day, chosen automatically by default.
+    spacetrack_account, spacetrack_password : str, optional
+        Space-Track credentials, default to the environment variables.
+    work_dir : str, optional
+        Directory for the TLEs and outputs, defaults to the current directory.
+    plot, ephem_cache, visibility : bool, default=False
+        As for findSats.
+    downlinks : DownlinkTable, optional
+        Only crossmatch the satellites transmitting near each file's band.
+    tiers : str, dict, SeparationTiers or None, default=None
+        Named separation thresholds, as for findSats.
+    selector : SatelliteSelector, optional
+        Only download and crossmatch the satellites it selects.
+    site : str or dict, optional
+        Site of every file, as for findSats. By default it is read from the
+        telescope_id of each header.
+    memoize : bool, default=False
+        Only propagate the satellites whose TLEs changed since each file was
+        last crossmatched, as for findSats.
+    batch : int, default=BATCH_SIZE
+        Number of summary rows held before they are appended to the summary.
+
+    Yields
+    ------
+    dict
+        Summary row of each file, with the columns of findSats' summary:
+        'filepath', 'satellite?', 'minSeparation', 'minTime' and 'csvPaths'.
+
+    Examples
+    --------
+    >>> for row in iterFindSats("/data/observations/", work_dir="/output/"):
+    ...     if row['minSeparation'] and min(row['minSeparation']) < 1:
+    ...         print(row['filepath'])
+    """
+    # Set work directory, default to current working directory
+    if work_dir is None:
+        work_dir = os.getcwd()
+    os.makedirs(work_dir, exist_ok=True)
+
+    if tiers is not None and not isinstance(tiers, SeparationTiers):
+        tiers = SeparationTiers(tiers)
+    if site is not None:
+        site = siteNamed(site)
+
+    summaryPath = os.path.join(work_dir, SUMMARY_FILE)
+    if os.path.exists(summaryPath):
+        os.remove(summaryPath)
+
+    observers = {}
+    caches = {}
+    indices = {}
+    noradIds = []
+    retried = set()
+    pending = {}
+    nRows = 0
+
+    def tles(dd):
+        # the day's TLE file, downloaded first if it is missing
+        day = _tleFile(dd, work_dir, selector)
+        # an incomplete day is downloaded again once per run
+        retry = os.path.isfile(_incompletePath(day)) and day not in retried
+        if not os.path.isfile(day) or retry:
+            retried.add(day)
+            # the UCS database is only fetched once, when the first day is missing
+            if not noradIds:
+                noradIds.append(io(n, work_dir=work_dir, selector=selector))
+            downloadTLEs([], n, spacetrack_account, spacetrack_password, work_dir=work_dir, start_time_mjd=[dd], norad_ids=noradIds[0], selector=selector)
+        return np.array([day])
+
+    def flush():
+        nonlocal nRows
+        if not pending:
+            return
+        rows = _summaryFrame(pending)
+        rows.index += nRows
+        rows.to_csv(summaryPath, mode='a', header=nRows == 0)
+        nRows += len(rows)
+        pending.clear()
+
+    passIndex = PassIndex(work_dir)
+    memo = CrossmatchMemo(work_dir) if memoize else None
+    try:
+        for fil_file in iterFiles(dir, file, file_list, pattern):
+            (dd,), (ra,), (dec,), (telescope_id,) = pull_relevant_header_info([fil_file], telescope=True)
+
+            # only keep the ephemeris caches and visibility indices of the current day
+            for cache in (caches, indices):
+                for key in [k for k in cache if k[0] != _tleFile(dd, work_dir, selector)]:
+                    del cache[key]
+
+            pending[fil_file] = [[],[],[]]
+            span = _observationSpan(fil_file, downlinks, tiers)
+            fileSite = _fileSite(fil_file, telescope_id, site)
+            sat_hit_dict = _crossmatchFile(dd, ra, dec, tles(dd), work_dir, observers, caches, indices, ephem_cache, visibility, downlinks, span, tiers, selector, fileSite, memo)
+            if sat_hit_dict is not None:
+                _writeFileOutputs(fil_file, dd, sat_hit_dict, work_dir, plot, passIndex, pending, fileSite)
+
+            row = {'filepath' : fil_file, 'satellite?' : True, 'minSeparation' : pending[fil_file][0],
+                   'minTime' : pending[fil_file][1], 'csvPaths' : pending[fil_file][2]}
+            if len(pending) >= batch:
+                flush()
+            yield row
+    finally:
+        flush()
+        passIndex.close()
+        if memo is not None:
+            memo.close()
+        print(f"Summary saved to: {summaryPath}")
@@ -0,0 +1,208 @@
+import numpy as np
+
+'''
+Named separation thresholds ("tiers"), evaluated in a single crossmatch.
+
+A pass within a few arcminutes of the target is in the primary beam, one a
+few degrees away is at most in the sidelobes, and telling them apart used to
+mean rerunning findSats with a different threshold. Instead, findSats
+crossmatches once out to the widest tier and tags every pass with the
+tightest tier its minimum separation entered, which costs one comparison per
+pass on top of a single-threshold run.
+
+A tier is either a radius in degrees or the primary beam of the telescope,
+whose radius is taken to the first null of an Airy pattern, 1.22 lambda/D, at
+the lowest frequency of each observation (read from the fch1, foff and nchans
+of its header), where the beam is widest:
+
+    SeparationTiers('primary=beam,near=0.5,sidelobe=3')
+
+Tiers are only used when asked for; by default findSats crossmatches within
+3 degrees and leaves passes untagged. A beam tier is only as good as the
+separations: an X band beam is a few hundredths of a degree, comparable to
+the error of the ephemeris cache (see satcheck.ephemCache).
+'''
+
+# Green Bank Telescope dish diameter in m
+GBT_DIAMETER = 100.0
+SPEED_OF_LIGHT = 299792458.0 # m/s
+BEAM = 'beam'
+
+def primaryBeamRadius(freqMHz, diameter=GBT_DIAMETER, scale=1.0):
+    """
+    Radius of the primary beam to its first null.
+
+    Parameters
+    ----------
+    freqMHz : float or array_like
+        Observing frequency in MHz.
+    diameter : float, default=GBT_DIAMETER
+        Dish diameter in m.
+    scale : float, default=1.0
+        Multiple of the first-null radius to return.
+
+    Returns
+    -------
+    float or numpy.ndarray
+        Radius in degrees (about 0.19 degrees at 1.1 GHz for the GBT).
+    """
+    wavelength = SPEED_OF_LIGHT / (np.asarray(freqMHz, dtype=float) * 1e6)
+    return scale * np.rad2deg(1.22 * wavelength / diameter)
+
+def parseTiers(spec):
+    """
+    Parse tiers written as 'name=radius,...'.
+
+    Parameters
+    ----------
+    spec : str or dict
+        Comma separated name=value pairs, or a dict of them. A value is a
+        radius in degrees, 'beam' for the primary beam or 'beam*k' for k
+        times the primary beam.
+
+    Returns
+    -------
+    dict
+        Tier name -> radius in degrees (float) or ('beam', scale).
+
+    Raises
+    ------
+    ValueError
+        If a tier cannot be parsed.
+    """
+    if isinstance(spec, dict):
+        items = list(spec.items())
+    else:
+        items = []
+        for part in spec.split(','):
+            if not part.strip():
+                continue
+            if '=' not in part:
+                raise ValueError(f"Tier '{part}' is not of the form name=radius")
+            name, value = part.split('=', 1)
+            items.append((name.strip(), value.strip()))
+
+    tiers = {}
+    for name, value in items:
+        if isinstance(value, str) and value.lower().startswith(BEAM):
+            rest = value[len(BEAM):].strip()
+            scale = float(rest.lstrip('*')) if rest else 1.0
+            tiers[name] = (BEAM, scale)
+        else:
+            try:
+                tiers[name] = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Radius '{value}' of tier '{name}' is neither a number of degrees nor 'beam'")
+    if not tiers:
+        raise ValueError('No tiers given')
+    return tiers
+
+class SeparationTiers:
+    """
+    Named separation thresholds, some of which may follow the primary beam.
+
+    Parameters
+    ----------
+    tiers : str or dict
+        Tiers as accepted by parseTiers.
+    diameter : float, default=GBT_DIAMETER
+        Dish diameter in m for the primary beam tiers of observations whose
+        site has none.
+
+    Examples
+    --------
+    >>> tiers = SeparationTiers('primary=beam,near=0.5,sidelobe=3')
+    >>> radii = tiers.radii(fmin=1100)
+    >>> tiers.threshold(radii)
+    3.0
+    >>> tiers.tier(0.1, radii)
+    'primary'
+    """
+
+    def __init__(self, tiers, diameter=GBT_DIAMETER):
+        self.tiers = parseTiers(tiers)
+        self.diameter = diameter
+
+    @property
+    def needsFrequency(self):
+        """
+        Whether any tier follows the primary beam.
+        """
+        return any(isinstance(value, tuple) for value in self.tiers.values())
+
+    def radii(self, fmin=None, diameter=None):
+        """
+        Radius of every tier for one observation, tightest first.
+
+        Parameters
+        ----------
+        fmin : float, optional
+            Lowest observed frequency in MHz. Without it the primary beam
+            tiers are left out.
+        diameter : float, optional
+            Dish diameter in m of the observation's site, defaults to the
+            diameter the tiers were made with.
+
+        Returns
+        -------
+        list of (str, float)
+            Tier names and radii in degrees, in increasing radius.
+        """
+        if diameter is None:
+            diameter = self.diameter
+
+        radii = []
+        for name, value in self.tiers.items():
+            if isinstance(value, tuple):
+                if fmin is None:
+                    continue
+                value = float(primaryBeamRadius(fmin, diameter, value[1]))
+            radii.append((name, value))
+        return sorted(radii, key=lambda item: item[1])
+
+    def threshold(self, radii):
+        """
+        Separation in degrees to crossmatch out to: the widest tier.
+
+        Raises
+        ------
+        ValueError
+            If radii is empty, i.e. every tier follows the primary beam
+            and the observation's frequency is unknown.
+        """
+        if not radii:
+            raise ValueError('No tier applies: primary beam tiers need the '
+                             "observation's frequency, which is unknown")
+        return max(radius for _, radius in radii)
+
+    def tier(self, minSeparation, radii):
+        """
+        Tightest tier a pass entered, or None if it entered none.
+        """
+        for name, radius in radii:
+            if minSeparation < radius:
+                return name
+        return None
+
+    def tag(self, sat_hit_dict, radii):
+        """
+        Record the tier of every pass of an observation in its 'Tier' entry.
+
+        Parameters
+        ----------
+        sat_hit_dict : dict
+            Passes as returned by separation().
+        radii : list of (str, float)
+            Tiers of the observation, as returned by radii().
+
+        Returns
+        -------
+        dict
+            Number of passes per tier.
+        """
+        counts = {}
+        for info in sat_hit_dict.values():
+            name = self.tier(min(info['Separation']), radii)
+            info['Tier'] = name
+            counts[name] = counts.get(name, 0) + 1
+        return counts
@@ -0,0 +1,238 @@
+import os, sys, json
+import numpy as np
+import argparse
+
+from .sgp4Tools import GBT_SITE, readTLELines, satrecArray, topocentricVectors, elevation, maxAngularMotion
+from .ephemCache import siteKey, tleDay
+
+'''
+Daily index of when each satellite is above the horizon at a site.
+
+Most satellites are below the horizon for most of any observation, but
+separation() still evaluates each of them every second. The index samples
+the whole catalog over the day once with sgp4 and records, per satellite, the
+intervals in which it could be above a minimum elevation. findSats then only
+propagates the satellites that are up during each observation.
+
+Samples are taken every minute by default. Each sample stands for the half
+minute either side of it, and counts as up if the satellite could be above the
+limit anywhere in that time given its range and speed, so a satellite that
+rises and sets between two samples is never missed.
+
+The index is stored next to its TLE file as <TLE name>_visibility_<site>.npz
+with the intervals sorted by start time. A satellite can be within the
+separation threshold of a target on the horizon while it is that far below
+it, so findSats sets the limit from its threshold (see minElevation); other
+limits than the default are stored as <TLE name>_visibility_<site>_el<limit>.npz.
+'''
+
+# a satellite just below the horizon can still be within the 3 degree
+# separation threshold of a target on the horizon
+DEFAULT_MIN_ELEVATION = -3 # degrees
+DEFAULT_STEP = 60 # s
+DEFAULT_OVERLAP = 3600 # s
+
+def minElevation(threshold):
+    """
+    Elevation limit in degrees that keeps every pass within threshold degrees
+    of a target above the horizon, rounded out to whole degrees so that close
+    thresholds share an index.
+    """
+    return -float(np.ceil(threshold))
+
+def visibilityPath(tle_file, site=GBT_SITE, min_elevation=DEFAULT_MIN_ELEVATION):
+    """
+    Path of the visibility index of a TLE file, in the same directory.
+    """
+    suffix = '' if min_elevation == DEFAULT_MIN_ELEVATION else f'_el{min_elevation:g}'
+    return f'{os.path.splitext(tle_file)[0]}_visibility_{siteKey(site)}{suffix}.npz'
+
+def _tleSignature(tle_file):
+    stat = os.stat(tle_file)
+    return {'tle_size' : stat.st_size, 'tle_mtime' : stat.st_mtime}
+
+def buildVisibilityIndex(tle_file, site=GBT_SITE, min_elevation=DEFAULT_MIN_ELEVATION, step=DEFAULT_STEP,
+                         start_mjd=None, overlap=DEFAULT_OVERLAP, maxElements=2**21):
+    """
+    Compute and save the visibility index of one TLE file for one site.
+
+    Parameters
+    ----------
+    tle_file : str
+        TLE file written by downloadTLEs.
+    site : dict, default=GBT_SITE
+        Observer 'lat', 'lon' (degrees) and 'elevation' (m).
+    min_elevation : float, default=-3
+        Elevation limit in degrees.
+    step : float, default=60
+        Sampling interval in seconds.
+    start_mjd : float, optional
+        Start of the covered span. Defaults to the start of the UTC day the
+        TLE file is named after.
+    overlap : float, default=3600
+        Seconds covered beyond the end of the day.
+    maxElements : int, default=2**21
+        Bound on the satellite-time pairs propagated at once.
+
+    Returns
+    -------
+    str
+        Path to the saved index.
+    """
+    if start_mjd is None:
+        start_mjd = tleDay(tle_file)
+
+    names, sats, allSats = satrecArray(readTLELines(tle_file))
+    nsteps = int(np.ceil((86400 + overlap) / step)) + 1
+    mjds = start_mjd + np.arange(nsteps) * step / 86400
+    limit = np.deg2rad(min_elevation)
+
+    up = np.zeros((len(names), nsteps), dtype=bool)
+    chunk = max(1, maxElements // max(len(names), 1))
+    for t0 in range(0, nsteps, chunk):
+        t1 = min(t0 + chunk, nsteps)
+        topo, vel, err = topocentricVectors(allSats, mjds[t0:t1], site)
+        dist = np.linalg.norm(topo, axis=-1)
+        margin = maxAngularMotion(dist, np.linalg.norm(vel, axis=-1), step / 2)
+        with np.errstate(invalid='ignore'):
+            up[:, t0:t1] = elevation(topo, mjds[t0:t1], site) + margin > limit
+
+        # satellites sgp4 cannot propagate are always treated as up
+        up[:, t0:t1] |= (err != 0)
+
+    # runs of consecutive up samples become intervals, each sample covering half a step either side
+    padded = np.zeros((len(names), nsteps + 2), dtype=np.int8)
+    padded[:, 1:-1] = up
+    edges = np.diff(padded, axis=1)
+    owner, first = np.nonzero(edges == 1)
+    owner2, last = np.nonzero(edges == -1)
+    assert np.array_equal(owner, owner2)
+
+    half = step / 2 / 86400
+    starts = mjds[first] - half
+    stops = mjds[last - 1] + half
+
+    order = np.argsort(starts, kind='stable')
+    meta = {'version' : 1,
+            'start_mjd' : float(start_mjd),
+            'stop_mjd' : float(mjds[-1]),
+            'step' : float(step),
+            'min_elevation' : float(min_elevation),
+            'site' : site}
+    meta.update(_tleSignature(tle_file))
+
+    path = visibilityPath(tle_file, site, min_elevation)
+    tmpPath = f'{path}.{os.getpid()}.tmp'
+    with open(tmpPath, 'wb') as f:
+        np.savez(f, names=np.asarray(names, dtype=str), owner=owner[order].astype(np.int32),
+                 starts=starts[order], stops=stops[order], meta=np.array(json.dumps(meta)))
+    os.replace(tmpPath, path)
+
+    print(f'Visibility index of {len(names)} satellites ({len(starts)} intervals) saved to: {path}')
+    return path
+
+class VisibilityIndex:
+    """
+    Intervals in which each satellite of a TLE file is above the elevation limit.
+
+    Parameters
+    ----------
+    path : str
+        Index written by buildVisibilityIndex.
+
+    Attributes
+    ----------
+    names : numpy.ndarray
+        Satellite names, as in load_tle.
+    owner, starts, stops : numpy.ndarray
+        Satellite index, start and stop (MJD) of every interval, sorted by start.
+    meta : dict
+        Span, sampling, elevation limit, site and TLE file signature.
+
+    Examples
+    --------
+    >>> index = VisibilityIndex(visibilityPath("may_31_2020_TLEs.txt"))
+    >>> index.visibleNames(59000.2, 59000.2 + 300/86400)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path) as data:
+            self.names = data['names']
+            self.owner = data['owner']
+            self.starts = data['starts']
+            self.stops = data['stops']
+            self.meta = json.loads(str(data['meta']))
+
+        # no interval starting earlier than this before a window can reach it
+        self.maxLength = float((self.stops - self.starts).max()) if len(self.starts) else 0.0
+
+    def isValid(self, tle_file, min_elevation=DEFAULT_MIN_ELEVATION, step=DEFAULT_STEP):
+        """
+        Whether the index was built from this TLE file, unchanged, with these settings.
+        """
+        if not os.path.exists(tle_file):
+            return False
+        return (all(self.meta.get(key) == value for key, value in _tleSignature(tle_file).items())
+                and self.meta['min_elevation'] == min_elevation and self.meta['step'] == step)
+
+    def covers(self, t0, t1):
+        """
+        Whether the window [t0, t1] (MJD) is inside the span of the index.
+        """
+        return self.meta['start_mjd'] <= t0 and t1 <= self.meta['stop_mjd']
+
+    def visible(self, t0, t1):
+        """
+        Indices of the satellites up at any time in the window [t0, t1] (MJD).
+
+        Raises
+        ------
+        ValueError
+            If the window is outside the span of the index.
+        """
+        if not self.covers(t0, t1):
+            raise ValueError(f'Window {t0}-{t1} is outside the span of the visibility index {self.path}')
+
+        lo = np.searchsorted(self.starts, t0 - self.maxLength, side='left')
+        hi = np.searchsorted(self.starts, t1, side='right')
+        hits = lo + np.flatnonzero(self.stops[lo:hi] >= t0)
+        return np.unique(self.owner[hits])
+
+    def visibleNames(self, t0, t1):
+        """
+        Names of the satellites up at any time in the window [t0, t1] (MJD).
+        """
+        return [str(name) for name in self.names[self.visible(t0, t1)]]
+
+def visibilityIndex(tle_file, site=GBT_SITE, min_elevation=DEFAULT_MIN_ELEVATION, step=DEFAULT_STEP, start_mjd=None):
+    """
+    Open the visibility index of a TLE file, building it first if it is
+    missing, out of date or does not cover start_mjd.
+
+    Returns
+    -------
+    VisibilityIndex
+    """
+    path = visibilityPath(tle_file, site, min_elevation)
+    if os.path.exists(path):
+        index = VisibilityIndex(path)
+        if index.isValid(tle_file, min_elevation, step) and (start_mjd is None or index.covers(start_mjd, start_mjd)):
+            return index
+
+    buildVisibilityIndex(tle_file, site, min_elevation=min_elevation, step=step, start_mjd=start_mjd)
+    return VisibilityIndex(path)
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Build the daily visibility index of TLE files')
+    parser.add_argument('tle_files', help='TLE files written by findSats/downloadTLEs', nargs='+')
+    parser.add_argument('--min_elevation', help='elevation limit in degrees', default=DEFAULT_MIN_ELEVATION, type=float)
+    parser.add_argument('--step', help='sampling interval in seconds', default=DEFAULT_STEP, type=float)
+    args = parser.parse_args(argv)
+
+    for tle_file in args.tle_files:
+        buildVisibilityIndex(tle_file, min_elevation=args.min_elevation, step=args.step)
+
+if __name__ == '__main__':
+    sys.exit(main())
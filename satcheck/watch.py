@@ -0,0 +1,384 @@
+import os, sys, glob, json, time, fnmatch, select, struct, subprocess
+import numpy as np
+
+from .findSatsHelper import pull_relevant_header_info
+from .findSats import downloadTLEs, _crossmatchFile, _writeFileOutputs, _summaryFrame, _observationSpan, _tleFile, _fileSite, _incompletePath
+from .sites import siteNamed
+from .h5Tools import readH5Header
+from .passIndex import PassIndex, noradId
+from .memo import CrossmatchMemo
+from .metrics import count
+
+'''
+Crossmatch h5 files as they are written, for findSats --watch.
+
+At the telescope new files land continuously, and waiting for the next batch
+run means finding out about a satellite hours later. A Watcher monitors one or
+more directories, with inotify where the platform has it and by polling
+otherwise, and crossmatches each matching file as soon as it has been
+completely written: after inotify reports it closed or moved into place, or,
+when polling (and for files already there at start up), once its size and
+modification time have stopped changing, and in both cases only once it
+opens as a valid h5 file.
+
+Files are crossmatched exactly as by findSats, against the day's TLE file in
+work_dir (downloaded first if it is missing and there are credentials), and
+their separation CSVs, pass index entries and summary rows are written at
+once. Passes closer than the alert separation are printed, appended to
+work_dir/alerts.jsonl and handed to any alert callbacks. Files already in the
+pass index are skipped, so a restarted watcher carries on where it stopped.
+'''
+
+ALERT_FILE = 'alerts.jsonl'
+SUMMARY_FILE = 'files_affected_by_sats.csv'
+
+# inotify(7) constants and event header
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')
+CLOSED = 'closed'
+
+class _Inotify:
+    # minimal ctypes binding, raises OSError (or AttributeError) where inotify is not available
+    def __init__(self, dirs):
+        import ctypes, ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}
+        for d in dirs:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(d), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {d}')
+            self.dirs[wd] = d
+
+    def read(self, timeout):
+        # paths closed after writing or moved into the watched directories
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset + _EVENT.size <= len(buf):
+            wd, mask, cookie, length = _EVENT.unpack_from(buf, offset)
+            name = buf[offset + _EVENT.size : offset + _EVENT.size + length].rstrip(b'\0')
+            offset += _EVENT.size + length
+            if name and wd in self.dirs:
+                paths.append(os.path.join(self.dirs[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+def isComplete(path):
+    """
+    Whether an h5 file can be opened and its header read, i.e. it is not
+    still being written.
+    """
+    try:
+        readH5Header(path)
+    except Exception:
+        return False
+    return True
+
+class Watcher:
+    """
+    Crossmatch the h5 files written to some directories as they arrive.
+
+    Parameters
+    ----------
+    dirs : list of str
+        Directories to watch.
+    pattern : str, default='*.h5'
+        Glob pattern of the file names to crossmatch.
+    work_dir : str, optional
+        Directory with the TLE files and for the outputs. Defaults to the
+        current directory.
+    alertSeparation : float, default=1
+        Alert on passes closer than this many degrees.
+    settle : float, default=2
+        Seconds a file's size and modification time must stay the same before
+        it counts as written, when polling and for the files already there
+        when the watcher starts.
+    interval : float, default=1
+        Seconds between polls (and the longest wait for an inotify event).
+    polling : bool, default=False
+        Poll even where inotify is available (e.g. for network filesystems,
+        which do not report remote writes).
+    n : int, optional
+        Number of Space-Track queries for days whose TLEs are missing.
+    spacetrack_account, spacetrack_password : str, optional
+        Space-Track credentials, default to the environment variables.
+    plot, ephem_cache, visibility : bool, default=False
+        As for findSats. ephem_cache makes every file after the first of a
+        day take well under a second.
+    downlinks : DownlinkTable, optional
+        Only crossmatch the satellites transmitting near each file's band.
+    tiers : SeparationTiers, optional
+        Crossmatch out to the widest tier and tag each pass with its tightest.
+    selector : SatelliteSelector, optional
+        Only download and crossmatch the satellites it selects.
+    site : str or dict, optional
+        Site of every file, instead of the telescope_id of its header.
+    memoize : bool, default=False
+        Only propagate the satellites whose TLEs changed since a file was
+        last crossmatched, as for findSats.
+    onAlert : list of callable, optional
+        Called with the dict of every alert.
+
+    Examples
+    --------
+    >>> watcher = Watcher(["/datax/dibas/"], work_dir="/output/", ephem_cache=True)
+    >>> watcher.run()
+    """
+
+    def __init__(self, dirs, pattern='*.h5', work_dir=None, alertSeparation=1, settle=2, interval=1, polling=False,
+                 n=None, spacetrack_account=None, spacetrack_password=None, plot=False, ephem_cache=False,
+                 visibility=False, downlinks=None, tiers=None, selector=None, site=None, memoize=False, onAlert=None):
+
+        # Set work directory, default to current working directory
+        if work_dir is None:
+            work_dir = os.getcwd()
+        os.makedirs(work_dir, exist_ok=True)
+
+        self.dirs = [os.path.abspath(d) for d in dirs]
+        self.pattern = pattern
+        self.work_dir = work_dir
+        self.alertSeparation = alertSeparation
+        self.settle = settle
+        self.interval = interval
+        self.n = n
+        self.spacetrack_account = spacetrack_account
+        self.spacetrack_password = spacetrack_password
+        self.plot = plot
+        self.ephem_cache = ephem_cache
+        self.visibility = visibility
+        self.downlinks = downlinks
+        self.tiers = tiers
+        self.selector = selector
+        self.site = siteNamed(site) if site is not None else None
+        self.onAlert = list(onAlert) if onAlert else []
+
+        self.observers = {}
+        self.caches = {}
+        self.indices = {}
+        self.passIndex = PassIndex(work_dir)
+        self.memo = CrossmatchMemo(work_dir) if memoize else None
+        self.done = set(self.passIndex.files()['filepath'])
+        self.failed = set()
+        # incomplete TLE days already downloaded again
+        self.retried = set()
+        # path -> None (just found), CLOSED (reported by inotify) or ((size, mtime), first seen)
+        self.pending = {}
+
+        self.inotify = None
+        if not polling:
+            try:
+                self.inotify = _Inotify(self.dirs)
+            except (OSError, AttributeError) as e:
+                print(f'inotify not available ({e}), polling every {interval} s')
+
+        summaryPath = os.path.join(work_dir, SUMMARY_FILE)
+        self._summaryRows = 0
+        if os.path.exists(summaryPath):
+            import pandas as pd
+            self._summaryRows = len(pd.read_csv(summaryPath))
+
+    def close(self):
+        """
+        Stop watching and close the pass index and memo.
+        """
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+        self.passIndex.close()
+        if self.memo is not None:
+            self.memo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _matches(self, path):
+        path = os.path.abspath(path)
+        return fnmatch.fnmatch(os.path.basename(path), self.pattern) and path not in self.done and path not in self.failed
+
+    def scan(self):
+        """
+        Queue every matching file in the watched directories that has not
+        been crossmatched yet.
+        """
+        for d in self.dirs:
+            for path in sorted(glob.glob(os.path.join(d, self.pattern))):
+                if self._matches(path):
+                    self.pending.setdefault(os.path.abspath(path), None)
+
+    def ready(self, timeout=None):
+        """
+        Wait for new files and return those that have been completely written.
+        """
+        timeout = self.interval if timeout is None else timeout
+
+        if self.inotify is not None:
+            for path in self.inotify.read(timeout):
+                if self._matches(path):
+                    self.pending[os.path.abspath(path)] = CLOSED
+        else:
+            time.sleep(timeout)
+            self.scan()
+        now = time.time()
+
+        ready = []
+        for path, seen in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            state = (stat.st_size, stat.st_mtime)
+
+            # closed after writing or renamed into place: only check it opens,
+            # otherwise wait for size and mtime to settle
+            if seen != CLOSED:
+                if seen is None or seen[0] != state:
+                    self.pending[path] = (state, now)
+                    continue
+                if now - seen[1] < self.settle:
+                    continue
+
+            if isComplete(path):
+                ready.append(path)
+                del self.pending[path]
+            elif seen != CLOSED:
+                self.pending[path] = (state, now)
+        return ready
+
+    def _tles(self, dd):
+        # the day's TLE file, downloaded first if needed and possible
+        path = _tleFile(dd, self.work_dir, self.selector)
+        retry = os.path.exists(_incompletePath(path)) and path not in self.retried
+        if not os.path.exists(path) or retry:
+            self.retried.add(path)
+            try:
+                downloadTLEs([], self.n, self.spacetrack_account, self.spacetrack_password, work_dir=self.work_dir, start_time_mjd=[dd], selector=self.selector)
+            except ValueError as e:
+                print(f'No TLEs for {os.path.basename(path)} and they cannot be downloaded: {e}')
+        return np.array([path])
+
+    def process(self, path):
+        """
+        Crossmatch one file and write its outputs and alerts.
+
+        Returns
+        -------
+        dict or None
+            The satellite hits of the file (as from separation), or None if
+            its TLEs are missing.
+        """
+        t0 = time.time()
+        (dd,), (ra,), (dec,), (telescope_id,) = pull_relevant_header_info([path], telescope=True)
+
+        # only keep the ephemeris caches and visibility indices of the current day
+        for cache in (self.caches, self.indices):
+            for key in [k for k in cache if k[0] != _tleFile(dd, self.work_dir, self.selector)]:
+                del cache[key]
+
+        span = _observationSpan(path, self.downlinks, self.tiers)
+        site = _fileSite(path, telescope_id, self.site)
+        sat_hit_dict = _crossmatchFile(dd, ra, dec, self._tles(dd), self.work_dir, self.observers, self.caches, self.indices,
+                                       self.ephem_cache, self.visibility, self.downlinks, span, self.tiers, self.selector, site, self.memo)
+        if sat_hit_dict is None:
+            # tried again when the watcher is restarted
+            self.failed.add(path)
+            return None
+
+        files_affected_by_sats = {path : [[],[],[]]}
+        _writeFileOutputs(path, dd, sat_hit_dict, self.work_dir, self.plot, self.passIndex, files_affected_by_sats, site)
+        self._appendSummary(files_affected_by_sats)
+        self.done.add(path)
+        count('files')
+
+        latency = time.time() - os.path.getmtime(path)
+        print(f'Crossmatched {path} in {time.time() - t0:.1f} s, {latency:.1f} s after it was written: {len(sat_hit_dict)} satellites')
+
+        minSeps, minTimes = files_affected_by_sats[path][0], files_affected_by_sats[path][1]
+        for satellite, sep, minTime in zip(sat_hit_dict, minSeps, minTimes):
+            if sep < self.alertSeparation:
+                self._alert({'filepath' : path, 'satellite' : satellite, 'norad' : noradId(satellite),
+                             'minSeparation' : sep, 'minTime' : minTime, 'tstart' : float(dd), 'latency' : latency})
+        return sat_hit_dict
+
+    def _appendSummary(self, files_affected_by_sats):
+        # one more row of files_affected_by_sats.csv, in the format findSats writes
+        row = _summaryFrame(files_affected_by_sats)
+        row.index += self._summaryRows
+        summaryPath = os.path.join(self.work_dir, SUMMARY_FILE)
+        row.to_csv(summaryPath, mode='a', header=not os.path.exists(summaryPath))
+        self._summaryRows += 1
+
+    def _alert(self, alert):
+        print(f"ALERT: {alert['satellite']} passed {alert['minSeparation']:.3f} degrees from the target of "
+              f"{os.path.basename(alert['filepath'])} at {alert['minTime']:.0f} s", file=sys.stderr, flush=True)
+        count('alerts')
+        with open(os.path.join(self.work_dir, ALERT_FILE), 'a') as f:
+            f.write(json.dumps(alert) + '\n')
+        for callback in self.onAlert:
+            callback(alert)
+
+    def run(self, duration=None, maxFiles=None):
+        """
+        Crossmatch files as they arrive until interrupted.
+
+        Parameters
+        ----------
+        duration : float, optional
+            Stop after this many seconds.
+        maxFiles : int, optional
+            Stop after crossmatching this many files.
+
+        Returns
+        -------
+        int
+            Number of files crossmatched.
+        """
+        mode = 'inotify' if self.inotify is not None else 'polling'
+        print(f"Watching {', '.join(self.dirs)} for {self.pattern} ({mode}), alerting below {self.alertSeparation} degrees")
+
+        # files written while nobody was watching
+        self.scan()
+
+        t0 = time.time()
+        processed = 0
+        try:
+            while duration is None or time.time() - t0 < duration:
+                for path in self.ready():
+                    if self.process(path) is not None:
+                        processed += 1
+                    if maxFiles is not None and processed >= maxFiles:
+                        return processed
+        except KeyboardInterrupt:
+            print('Stopped watching')
+        return processed
+
+def commandAlert(command):
+    """
+    Alert callback that runs a shell command with the alert as JSON on its
+    standard input, without waiting for it.
+    """
+    def alert(event):
+        proc = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE)
+        proc.stdin.write(json.dumps(event).encode())
+        proc.stdin.close()
+    return alert
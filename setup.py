@@ -5,6 +5,8 @@ requirements = [
     "pandas",
     "numpy", 
     "pyephem",  # The pip package name for ephem
+    "h5py",
+    "sgp4",
     "requests",
     "astropy",
     "matplotlib",
@@ -22,12 +24,16 @@ setup(
     long_description=open("README.md").read(),
     long_description_content_type="text/markdown",
     packages=find_packages(),
+    package_data={"satcheck": ["data/*.csv"]},
     install_requires=requirements,
     python_requires=">=3.8",
     entry_points={
         "console_scripts": [
+            "satcheck=satcheck.cli:main",
             "findSats=satcheck.findSats:main",
             "genPlotsAll=satcheck.genPlotsAll:main",
+            "convertFlagged=satcheck.flaggedFiles:main",
+            "confirmPasses=satcheck.confirmPasses:main",
         ],
     },
     classifiers=[